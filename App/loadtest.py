@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+"""
+Headless load generator for the whole service mesh, through the API Gateway.
+
+Runs the scenarios of auto.py (user create/update, order create, order
+status transitions, email/address sync checks, batch create) without any
+prompts, from `--concurrency` worker threads for `--duration` seconds (or
+`--iterations` scenario runs). Each worker picks its next scenario at
+random, weighted by the request mix.
+
+Before the run it seeds users with one batch create and gives each of
+them an order, so updates, transitions and sync checks have known IDs to
+work on. Orders are checked out by one worker at a time, and their
+owners are left out of plain user updates meanwhile, so a status check
+or a sync check never races another scenario.
+
+Reports per gateway route: throughput, p50/p95/p99 latency and error
+rate (transport errors and 4xx/5xx answers), plus per-scenario failures
+and how long a user update took to reach the user's orders. --json
+writes everything, with the git commit, so runs can be compared across
+commits (--compare prints the deltas against an earlier file).
+
+Usage:
+    python loadtest.py [--gateway http://localhost:8000] [--concurrency 20]
+                       [--duration 30 | --iterations 5000]
+                       [--mix read_user=30,create_user=10,...]
+                       [--json run.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+GATEWAY_URL = os.getenv('GATEWAY_URL', 'http://localhost:8000')
+
+ORDER_STATUSES = ["under process", "shipping", "delivered"]
+
+# Scenario -> default weight in the request mix
+DEFAULT_MIX = {
+    'read_user': 30,
+    'update_user': 15,
+    'create_order': 15,
+    'create_user': 10,
+    'order_status': 10,
+    'browse': 10,
+    'batch_create': 3,
+    'sync_check': 2
+}
+
+
+# Measurements ----------------------------------
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, seconds):
+    """Count, throughput and latency percentiles (ms) of one list of latencies"""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "max_ms": round(latencies[-1], 1) if latencies else 0.0
+    }
+
+
+class Recorder:
+    """Latencies and outcomes per gateway route, per scenario and for sync checks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.scenarios = {}
+        self.sync = {"latencies": [], "checks": 0, "timeouts": 0}
+        self.recording = False
+
+    def request(self, route, latency_ms, status):
+        """status is the HTTP status code, or the exception name for a transport error"""
+        if not self.recording:
+            return
+        with self._lock:
+            entry = self.routes.get(route)
+            if entry is None:
+                entry = self.routes[route] = {"latencies": [], "errors": 0, "statuses": {}}
+            entry["latencies"].append(latency_ms)
+            entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+            if not isinstance(status, int) or status >= 400:
+                entry["errors"] += 1
+
+    def scenario(self, name, outcome):
+        """outcome: 'ok', 'failed' or 'skipped' (no free order or user to work on)"""
+        if not self.recording:
+            return
+        with self._lock:
+            entry = self.scenarios.setdefault(name, {"runs": 0, "failed": 0, "skipped": 0})
+            entry["runs"] += 1
+            if outcome != 'ok':
+                entry[outcome] += 1
+
+    def sync_check(self, propagation_ms):
+        """propagation_ms is None when the orders never showed the update"""
+        if not self.recording:
+            return
+        with self._lock:
+            self.sync["checks"] += 1
+            if propagation_ms is None:
+                self.sync["timeouts"] += 1
+            else:
+                self.sync["latencies"].append(propagation_ms)
+
+    def report(self, seconds):
+        with self._lock:
+            routes = {}
+            for route, entry in sorted(self.routes.items()):
+                stats = summarize(entry["latencies"], seconds)
+                stats["errors"] = entry["errors"]
+                stats["error_rate"] = round(entry["errors"] / stats["requests"], 4) if stats["requests"] else 0.0
+                stats["statuses"] = dict(sorted(entry["statuses"].items()))
+                routes[route] = stats
+            everything = [latency for entry in self.routes.values() for latency in entry["latencies"]]
+            errors = sum(entry["errors"] for entry in self.routes.values())
+            totals = summarize(everything, seconds)
+            totals["errors"] = errors
+            totals["error_rate"] = round(errors / totals["requests"], 4) if totals["requests"] else 0.0
+            sync = summarize(self.sync["latencies"], seconds)
+            del sync["requests"], sync["throughput_rps"]
+            sync = {"checks": self.sync["checks"], "timeouts": self.sync["timeouts"], **sync}
+            return {
+                "totals": totals,
+                "routes": routes,
+                "scenarios": {name: dict(entry) for name, entry in sorted(self.scenarios.items())},
+                "sync": sync
+            }
+
+
+# Gateway client ----------------------------------
+
+class GatewayClient:
+    """One keep-alive session per worker thread; every call is recorded under its gateway route"""
+
+    def __init__(self, base_url, recorder, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def call(self, method, route, path, **kwargs):
+        """Return the response (None on a transport error); route is the gateway rule, e.g. /user/<user_account_id>"""
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.recorder.request(f"{method} {route}", (time.perf_counter() - started) * 1000, type(e).__name__)
+            return None
+        self.recorder.request(f"{method} {route}", (time.perf_counter() - started) * 1000, response.status_code)
+        return response
+
+
+def body_of(response):
+    """JSON body of a successful response, else None"""
+    if response is None or response.status_code >= 400:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+# Shared test data ----------------------------------
+
+class TestData:
+    """Seeded user IDs, plus the seeded orders (checked out one worker at a time)"""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.user_ids = []
+        self.orders = queue.Queue()
+        self._held_users = set()
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def unique(self, prefix):
+        with self._lock:
+            self._counter += 1
+            return f"{prefix}_{self.run_id}_{self._counter}"
+
+    def user_id(self, writable=False):
+        """A random seeded user; writable=True avoids the owners of checked-out orders"""
+        for _ in range(10):
+            user_id = random.choice(self.user_ids)
+            if not writable or str(user_id) not in self._held_users:
+                return user_id
+        return None
+
+    def checkout_order(self):
+        """A seeded order {order_id, user_id, status} no other worker holds, or None"""
+        try:
+            order = self.orders.get_nowait()
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._held_users.add(str(order["user_id"]))
+        return order
+
+    def release_order(self, order):
+        with self._lock:
+            self._held_users.discard(str(order["user_id"]))
+        self.orders.put(order)
+
+
+def seed(client, data, users, orders):
+    """Create the users and orders the scenarios work on"""
+    created = []
+    for start in range(0, users, 100):
+        response = client.call('POST', '/users/batch', '/users/batch', json={"users": [
+            {"email": data.unique('load') + '@example.com', "delivery_address": f"{n} Load Test Street, Montreal, QC"}
+            for n in range(start, min(users, start + 100))
+        ]})
+        body = body_of(response) or {}
+        created.extend(user["user_account_id"] for user in body.get("created", []))
+    if not created:
+        # No batch endpoint (V2 down): fall back to existing users
+        body = body_of(client.call('GET', '/users', '/users', params={"limit": users, "fields": "user_account_id"})) or {}
+        if isinstance(body.get("status"), list):
+            created = [user["user_account_id"] for user in body["status"]]
+    data.user_ids = created
+    if not created:
+        return False
+
+    owners = {}
+    for n in range(orders):
+        user_id = created[n % len(created)]
+        email = data.unique('order') + '@example.com'
+        response = client.call('POST', '/order', '/order', json={
+            "user_id": str(user_id),
+            "items": [{"item": "Laptop", "quantity": 1}, {"item": "Mouse", "quantity": 2}],
+            "email": email,
+            "delivery_address": "123 Test Street, Montreal, QC"
+        })
+        if body_of(response) is not None:
+            owners[email] = user_id
+
+    # The create response has no numeric order_id: find the new orders by their unique emails
+    after = None
+    while len(owners) > data.orders.qsize():
+        params = {"limit": 1000, "fields": "order_id,user_id,user_email,status"}
+        if after is not None:
+            params["after"] = after
+        body = body_of(client.call('GET', '/orders', '/orders', params=params)) or {}
+        page = body.get("status")
+        if not isinstance(page, list):
+            break
+        for order in page:
+            if order.get("user_email") in owners:
+                data.orders.put({"order_id": order["order_id"], "user_id": order["user_id"],
+                                 "status": order.get("status", ORDER_STATUSES[0])})
+        after = body.get("next_after")
+        if after is None:
+            break
+    return True
+
+
+# Scenarios ----------------------------------
+# Each returns 'ok', 'failed' or 'skipped'
+
+def read_user(client, data, settings):
+    user_id = data.user_id()
+    response = client.call('GET', '/user/<user_account_id>', f"/user/{user_id}")
+    return 'ok' if body_of(response) is not None else 'failed'
+
+
+def create_user(client, data, settings):
+    response = client.call('POST', '/user', '/user', json={
+        "email": data.unique('user') + '@example.com',
+        "delivery_address": "123 Test Street, Montreal, QC"
+    })
+    return 'ok' if body_of(response) is not None else 'failed'
+
+
+def update_user(client, data, settings):
+    # Leave users with a checked-out order alone: a sync check may be waiting on their update
+    user_id = data.user_id(writable=True)
+    if user_id is None:
+        return 'skipped'
+    if random.random() < 0.5:
+        response = client.call('PUT', '/user/<user_id>/email', f"/user/{user_id}/email",
+                               json={"email": data.unique('updated') + '@example.com'})
+    else:
+        response = client.call('PUT', '/user/<user_id>/address', f"/user/{user_id}/address",
+                               json={"delivery_address": data.unique('Updated Address')})
+    return 'ok' if body_of(response) is not None else 'failed'
+
+
+def create_order(client, data, settings):
+    response = client.call('POST', '/order', '/order', json={
+        "user_id": str(data.user_id()),
+        "items": [{"item": "Test Item", "quantity": random.randint(1, 5)}],
+        "email": data.unique('order') + '@example.com',
+        "delivery_address": "Load Test Address"
+    })
+    return 'ok' if body_of(response) is not None else 'failed'
+
+
+def order_status(client, data, settings):
+    """Move an order to its next status, then read it back"""
+    order = data.checkout_order()
+    if order is None:
+        return 'skipped'
+    try:
+        status = ORDER_STATUSES[(ORDER_STATUSES.index(order["status"]) + 1) % len(ORDER_STATUSES)]
+        order_id = order["order_id"]
+        if body_of(client.call('PUT', '/order/status/<order_id>', f"/order/status/{order_id}",
+                               json={"status": status})) is None:
+            return 'failed'
+        order["status"] = status
+        body = body_of(client.call('GET', '/order/<order_id>', f"/order/{order_id}")) or {}
+        current = body.get("status")
+        return 'ok' if isinstance(current, dict) and current.get("status") == status else 'failed'
+    finally:
+        data.release_order(order)
+
+
+def sync_check(client, data, settings):
+    """Update a user's email or address and time how long until their order shows it"""
+    order = data.checkout_order()
+    if order is None:
+        return 'skipped'
+    try:
+        user_id, order_id = order["user_id"], order["order_id"]
+        if random.random() < 0.5:
+            field, value = "user_email", data.unique('synced') + '@example.com'
+            response = client.call('PUT', '/user/<user_id>/email', f"/user/{user_id}/email", json={"email": value})
+        else:
+            field, value = "user_address", data.unique('Synced Address')
+            response = client.call('PUT', '/user/<user_id>/address', f"/user/{user_id}/address",
+                                   json={"delivery_address": value})
+        if body_of(response) is None:
+            return 'failed'
+        updated = time.perf_counter()
+        deadline = updated + settings.sync_timeout
+        while time.perf_counter() < deadline:
+            body = body_of(client.call('GET', '/order/<order_id>', f"/order/{order_id}")) or {}
+            current = body.get("status")
+            if isinstance(current, dict) and current.get(field) == value:
+                client.recorder.sync_check((time.perf_counter() - updated) * 1000)
+                return 'ok'
+            time.sleep(settings.sync_poll)
+        client.recorder.sync_check(None)
+        return 'failed'
+    finally:
+        data.release_order(order)
+
+
+def batch_create(client, data, settings):
+    response = client.call('POST', '/users/batch', '/users/batch', json={"users": [
+        {"email": data.unique('batch') + '@example.com', "delivery_address": f"Batch Address {n}"}
+        for n in range(settings.batch_size)
+    ]})
+    body = body_of(response)
+    return 'ok' if body is not None and not body.get("total_errors") else 'failed'
+
+
+def browse(client, data, settings):
+    """One of the list and count reads"""
+    choice = random.randrange(4)
+    if choice == 0:
+        response = client.call('GET', '/users', '/users', params={"limit": 100})
+    elif choice == 1:
+        response = client.call('GET', '/orders', '/orders', params={"limit": 100})
+    elif choice == 2:
+        status = random.choice(ORDER_STATUSES)
+        response = client.call('GET', '/orders/status/<status>', f"/orders/status/{status}", params={"limit": 100})
+    else:
+        response = client.call('GET', '/events/count', '/events/count')
+    return 'ok' if body_of(response) is not None else 'failed'
+
+
+SCENARIOS = {
+    'read_user': read_user,
+    'create_user': create_user,
+    'update_user': update_user,
+    'create_order': create_order,
+    'order_status': order_status,
+    'sync_check': sync_check,
+    'batch_create': batch_create,
+    'browse': browse
+}
+
+
+# Load generation ----------------------------------
+
+def parse_mix(text):
+    """'read_user=30,sync_check=0' -> DEFAULT_MIX with those weights replaced"""
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        name, _, weight = item.partition('=')
+        if name not in SCENARIOS:
+            raise ValueError(f"unknown scenario {name!r} (known: {', '.join(SCENARIOS)})")
+        mix[name] = float(weight)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("the request mix needs at least one scenario with a positive weight")
+    return mix
+
+
+def run(settings, data, recorder, mix):
+    """Drive the mix from settings.concurrency threads; returns the elapsed seconds"""
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    stop_at = time.perf_counter() + settings.duration if settings.iterations is None else None
+    remaining = [settings.iterations]
+    lock = threading.Lock()
+
+    def take():
+        if stop_at is not None:
+            return time.perf_counter() < stop_at
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker():
+        client = GatewayClient(settings.gateway, recorder, settings.timeout)
+        while take():
+            name = random.choices(names, weights)[0]
+            try:
+                outcome = SCENARIOS[name](client, data, settings)
+            except Exception as e:
+                print(f"✗ Scenario {name} error: {e}")
+                outcome = 'failed'
+            recorder.scenario(name, outcome)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(settings.concurrency)]
+    recorder.recording = True
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    recorder.recording = False
+    return elapsed
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, timeout=5, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# Reporting ----------------------------------
+
+def print_report(results):
+    totals = results["totals"]
+    print(f"{'route':<36}{'reqs':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for route, r in results["routes"].items():
+        print(f"{route:<36}{r['requests']:>8}{r['throughput_rps']:>9}{r['p50_ms']:>9}"
+              f"{r['p95_ms']:>9}{r['p99_ms']:>9}{r['error_rate']:>8.1%}")
+    print(f"{'total':<36}{totals['requests']:>8}{totals['throughput_rps']:>9}{totals['p50_ms']:>9}"
+          f"{totals['p95_ms']:>9}{totals['p99_ms']:>9}{totals['error_rate']:>8.1%}")
+
+    print(f"\n{'scenario':<16}{'runs':>8}{'failed':>8}{'skipped':>9}")
+    for name, s in results["scenarios"].items():
+        print(f"{name:<16}{s['runs']:>8}{s['failed']:>8}{s['skipped']:>9}")
+
+    sync = results["sync"]
+    if sync["checks"]:
+        print(f"\nSync (user update -> order): {sync['checks']} checks, {sync['timeouts']} timed out, "
+              f"p50 {sync['p50_ms']} ms, p95 {sync['p95_ms']} ms, p99 {sync['p99_ms']} ms")
+
+
+def print_comparison(results, baseline):
+    """Per-route throughput and latency change against an earlier run"""
+    print(f"\nCompared with {baseline['run'].get('commit') or 'baseline'} "
+          f"({baseline['run'].get('started_at')}):")
+    print(f"{'route':<36}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>10}")
+
+    def change(new, old):
+        if not old:
+            return '-'
+        return f"{(new - old) / old:+.0%}"
+
+    rows = list(results["routes"].items()) + [('total', results["totals"])]
+    for route, r in rows:
+        old = baseline["totals"] if route == 'total' else baseline["routes"].get(route)
+        if old is None:
+            print(f"{route:<36}{'new':>10}")
+            continue
+        print(f"{route:<36}{change(r['throughput_rps'], old['throughput_rps']):>10}"
+              f"{change(r['p50_ms'], old['p50_ms']):>10}{change(r['p95_ms'], old['p95_ms']):>10}"
+              f"{change(r['p99_ms'], old['p99_ms']):>10}{r['error_rate'] - old['error_rate']:>+10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gateway', default=GATEWAY_URL, help='gateway base URL (default $GATEWAY_URL or localhost:8000)')
+    parser.add_argument('--concurrency', type=int, default=20, help='worker threads')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--iterations', type=int, help='run this many scenarios instead of --duration')
+    parser.add_argument('--mix', help='scenario weights, e.g. read_user=50,sync_check=0 '
+                                      f"(defaults: {','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+    parser.add_argument('--seed-users', type=int, default=50, help='users created before the run')
+    parser.add_argument('--seed-orders', type=int, default=50, help='orders created before the run')
+    parser.add_argument('--batch-size', type=int, default=5, help='users per batch_create')
+    parser.add_argument('--timeout', type=float, default=15, help='per-request timeout in seconds')
+    parser.add_argument('--sync-timeout', type=float, default=10, help='seconds a sync check waits for the order')
+    parser.add_argument('--sync-poll', type=float, default=0.05, help='seconds between sync check polls')
+    parser.add_argument('--seed', type=int, help='random seed for a repeatable scenario sequence')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='earlier --json results to compare with')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    try:
+        requests.get(f"{args.gateway.rstrip('/')}/", timeout=10).raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"✗ API Gateway not reachable at {args.gateway}: {e}")
+        return 1
+
+    recorder = Recorder()
+    data = TestData(run_id=f"{int(time.time())}{random.randrange(1000):03d}")
+    print(f"Seeding {args.seed_users} users and {args.seed_orders} orders...")
+    if not seed(GatewayClient(args.gateway, recorder, args.timeout), data, args.seed_users, args.seed_orders):
+        print("✗ Could not create or find any users, aborting")
+        return 1
+    print(f"✓ {len(data.user_ids)} users, {data.orders.qsize()} orders")
+    if data.orders.empty() and (mix['order_status'] > 0 or mix['sync_check'] > 0):
+        print("✗ No seeded orders: order_status and sync_check will be skipped")
+
+    print(f"Running with {args.concurrency} workers for "
+          f"{f'{args.iterations} scenarios' if args.iterations is not None else f'{args.duration:g} s'}...")
+    started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    seconds = run(args, data, recorder, mix)
+
+    results = {
+        "run": {
+            "started_at": started_at,
+            "commit": git_commit(),
+            "gateway": args.gateway,
+            "seconds": round(seconds, 3),
+            "settings": {
+                "concurrency": args.concurrency,
+                "duration": args.duration if args.iterations is None else None,
+                "iterations": args.iterations,
+                "mix": mix,
+                "seed_users": args.seed_users,
+                "seed_orders": args.seed_orders,
+                "batch_size": args.batch_size,
+                "timeout": args.timeout,
+                "sync_timeout": args.sync_timeout
+            }
+        },
+        **recorder.report(seconds)
+    }
+    print()
+    print_report(results)
+
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                print_comparison(results, json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"✗ Could not compare with {args.compare}: {e}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✓ Results written to {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
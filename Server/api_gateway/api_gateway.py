@@ -1,12 +1,54 @@
 import requests
-import random
 import yaml
 import json
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import os
+import time
+import logging
+import functools
+import threading
+from urllib.parse import urlencode
+import pika
+from upstream import UpstreamPool
+from health import HealthChecker
+from response_cache import ResponseCache
+from routing import RoutingTable
+from config_snapshot import GatewaySnapshot
+from config_watcher import ConfigWatcher
+from shadow import ShadowMirror
+from breaker import CircuitBreakers, adapts
+from singleflight import SingleFlight
+from metrics import Metrics
+from tracing import Tracer, build_timeline, read_spans, recent_traces
+from logs import StructuredLogging
 
 app = Flask(__name__)
 
+# JSON logs written by a background thread; the level and debug sampling
+# are taken from the logging: block of the config once it is loaded
+log_setup = StructuredLogging.from_env('api_gateway')
+log_setup.instrument(app)
+logger = logging.getLogger('api_gateway')
+
+# Per-route latency histograms, in-flight requests and upstream timings at /metrics
+metrics = Metrics('api_gateway')
+metrics.instrument(app)
+metrics.describe('gateway_upstream_duration_seconds', 'histogram', "Proxied upstream call latency, by upstream service")
+metrics.describe('gateway_cache_lookups_total', 'counter', "Response cache lookups, by result")
+metrics.describe('gateway_coalesced_requests_total', 'counter', "GETs served from another request's upstream fetch")
+metrics.describe('gateway_circuit_open', 'gauge', "1 while a service's circuit breaker is not closed")
+
+# Every request starts (or continues) a trace; upstream calls carry it on in
+# the traceparent header. The gateway is also the trace collector: services
+# POST their spans to /traces (TRACE_COLLECTOR_URL) and /traces/<trace_id>
+# rebuilds a request's timeline from TRACE_DIR
+TRACE_DIR = os.getenv('TRACE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'traces'))
+tracer = Tracer.from_env('api_gateway', directory=TRACE_DIR)
+tracer.instrument(app, new_traces=True, exclude=(
+    '/', '/status', '/config', '/config/reload', '/cache/stats', '/shadow/stats',
+    '/metrics', '/traces', '/traces/<trace_id>'
+))
+
 # Service Ports:
 # http://localhost:5000/ - User V1
 # http://localhost:5001/ - User V2
@@ -22,33 +64,91 @@ EVENT_SERVICE_URL = os.getenv('EVENT_SERVICE_URL', 'http://localhost:5003')
 
 # Configuration file path
 CONFIG_FILE = os.getenv('CONFIG_FILE', 'gateway_config.yaml')
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), CONFIG_FILE)
 
-def load_config():
-    """Load configuration from YAML file"""
+def load_config(strict=False, use_file=True):
+    """
+    Load configuration from YAML file. By default an unreadable file falls
+    back to the defaults; with strict=True the error is raised instead so
+    a reload can keep the running configuration. use_file=False returns
+    the defaults.
+    """
     default_config = {
         'strangler_pattern': {
             'enabled': True,
             'v1_percentage': 0,   # P percentage goes to V1
             'v2_percentage': 100  # (1-P) percentage goes to V2
         },
-        'timeout': 10
+        'timeout': 10,
+        'upstream_pool': {
+            'pool_size': 20,      # Keep-alive connections kept per service
+            'keep_alive': True,
+            'idle_timeout': 60    # Seconds before an idle service pool is closed
+        },
+        'response_cache': {
+            'enabled': True,
+            'max_entries': 1024,  # LRU bound per worker
+            'ttl': 30             # Seconds a cached GET stays fresh
+        },
+        'single_flight': {
+            'enabled': True,
+            'wait_timeout': 30    # Seconds a coalesced request waits before fetching itself
+        },
+        'health_check': {
+            'interval': 10,   # Seconds between background probe rounds
+            'timeout': 5      # Per-probe timeout (probes run concurrently)
+        },
+        'async_engine': {
+            'max_connections': 1000   # In-flight upstream requests per service (async mode)
+        },
+        'config_watch': {
+            'enabled': True,
+            'interval': 2     # Seconds between config file checks (every worker)
+        },
+        'circuit_breaker': {
+            'enabled': True,
+            'window': 20,             # Recent calls per service the failure rate is taken over
+            'min_calls': 10,          # Calls needed in the window before the breaker can open
+            'failure_rate': 0.5,      # Open at this fraction of failed calls (errors, timeouts, 5xx)
+            'open_seconds': 10,       # Fail fast this long before probing again
+            'half_open_probes': 1,    # Trial calls let through while half-open
+            'adaptive_timeout': True, # Per-service timeout from observed p99 latency
+            'multiplier': 3,          # Timeout = p99 x multiplier ...
+            'min_timeout': 1,         # ... but at least this (and at most `timeout`)
+            'samples': 200,           # Recent GET latencies kept per service
+            'min_samples': 20         # Samples needed before the timeout adapts
+        },
+        'shadow_traffic': {
+            'enabled': False,
+            'sample_rate': 0.1,   # Fraction of user reads mirrored to the other version
+            'queue_size': 1000,   # Mirrors waiting beyond this are dropped
+            'workers': 4,         # Threads replaying mirrors per worker
+            'timeout': 5          # Per-mirror upstream timeout
+        },
+        'logging': {
+            'level': 'INFO',
+            'structured': True,       # One JSON object per line instead of `format`
+            'format': "[%(asctime)s] %(levelname)s: %(message)s",
+            'debug_sample_rate': 0.0  # Fraction of requests that emit their DEBUG logs
+        }
     }
     
     try:
-        config_path = os.path.join(os.path.dirname(__file__), CONFIG_FILE)
-        if os.path.exists(config_path):
-            with open(config_path, 'r') as f:
+        if use_file and os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, 'r') as f:
                 config = yaml.safe_load(f)
-                print(f"✓ Loaded configuration from {CONFIG_FILE}")
+                logger.info("Loaded configuration from %s", CONFIG_FILE)
                 # Merge with defaults
                 for key in default_config:
                     if key not in config:
                         config[key] = default_config[key]
         else:
-            print(f"Config file not found, using defaults (V1: 0%, V2: 100%)")
+            logger.info("Config file not used, using defaults (V1: 0%, V2: 100%)")
             config = default_config
     except Exception as e:
-        print(f"Error loading config: {e}, using defaults")
+        if strict:
+            raise
+        logger.error("Error loading config: %s, using defaults", e)
         config = default_config
     
     # ALWAYS use environment variables for service URLs (override any YAML values)
@@ -60,49 +160,379 @@ def load_config():
         'event': EVENT_SERVICE_URL
     }
     
-    print(f"Service URLs configured:")
-    print(f"  User V1: {config['services']['user_v1']}")
-    print(f"  User V2: {config['services']['user_v2']}")
-    print(f"  Order: {config['services']['order']}")
-    print(f"  Event: {config['services']['event']}")
+    logger.info("Service URLs configured", extra={"services": config['services']})
     
     return config
 
 
-# Load initial configuration
+# Load initial configuration and compile it into a read-only snapshot;
+# request handling reads `snapshot` instead of walking the config dict
 config = load_config()
+try:
+    snapshot = GatewaySnapshot(config)
+except ValueError as e:
+    logger.error("Invalid configuration (%s), using defaults", e)
+    config = load_config(use_file=False)
+    snapshot = GatewaySnapshot(config)
+log_setup.configure(**config['logging'])
+
+# Precompiled strangler routing table (sticky per user_account_id)
+routing_table = RoutingTable(enabled=snapshot.strangler_enabled, weights=dict(snapshot.weights))
+
+# Shared keep-alive connection pools, one per backend service
+upstream_pool = UpstreamPool(**config['upstream_pool'])
+
+# Per-service circuit breakers and p99-based timeouts
+circuit_breakers = CircuitBreakers(**config['circuit_breaker'])
+
+
+# The config watcher and POST /config/reload can both reload at once
+reload_lock = threading.Lock()
 
 
 def reload_config():
-    """Reload configuration from file"""
-    global config
-    config = load_config()
-    return config
+    """
+    Reload configuration from file. The new file is validated and compiled
+    before anything changes; if it is invalid a ValueError (or the YAML
+    error) is raised and the running configuration stays in place. Only
+    components whose section changed are reconfigured, so an unrelated
+    edit keeps the upstream sessions and the response cache.
+    """
+    global config, snapshot
+    with reload_lock:
+        new_config = load_config(strict=True)
+        new_snapshot = GatewaySnapshot(new_config, version=snapshot.version + 1)
+        changed = {section for section in new_config if new_config[section] != config.get(section)}
+        routing_table.configure(new_snapshot.strangler_enabled, dict(new_snapshot.weights))
+        if 'upstream_pool' in changed:
+            upstream_pool.configure(**new_config['upstream_pool'])
+        if 'circuit_breaker' in changed:
+            circuit_breakers.configure(**new_config['circuit_breaker'])
+        if 'health_check' in changed:
+            health_checker.configure(**new_config['health_check'])
+        if 'response_cache' in changed:
+            response_cache.configure(**new_config['response_cache'])
+        if 'single_flight' in changed:
+            single_flight.configure(**new_config['single_flight'])
+        if 'config_watch' in changed:
+            config_watcher.interval = new_config['config_watch'].get('interval', 2)
+        if 'shadow_traffic' in changed:
+            shadow_mirror.configure(**new_config['shadow_traffic'])
+        if 'logging' in changed:
+            log_setup.configure(**new_config['logging'])
+        if changed:
+            logger.info("Configuration reloaded", extra={"version": new_snapshot.version,
+                                                         "sections": sorted(changed)})
+        config, snapshot = new_config, new_snapshot
+        return config
+
+
+def forward(service, method, path, guarded=True, **kwargs):
+    """
+    Send a request to a backend service through its pooled session. Guarded
+    calls go through the service's circuit breaker (CircuitOpenError, a
+    RequestException, while it is open); plain GETs also use and feed its
+    adaptive timeout.
+    """
+    current = snapshot
+    url = f"{current.urls[service]}{path}"
+    if not guarded:
+        kwargs.setdefault('timeout', current.timeout)
+        return upstream_pool.request(service, method, url, **kwargs)
+
+    breaker = circuit_breakers.get(service)
+    generation = breaker.allow()
+    adaptive = adapts(method, kwargs.get('stream', False))
+    timeout = kwargs.setdefault('timeout', breaker.timeout(current.timeout) if adaptive else current.timeout)
+    span = None
+    if tracer.current() is not None:
+        span = tracer.start_span(f"{method} {service}", kind='client', upstream=service, path=path)
+        kwargs['headers'] = tracer.inject(dict(kwargs.get('headers') or {}), span)
+    started = time.perf_counter()
+    try:
+        response = upstream_pool.request(service, method, url, **kwargs)
+    except Exception as e:
+        # A timed-out GET counts as a sample at its timeout so the p99 can grow
+        timed_out = adaptive and isinstance(e, requests.exceptions.Timeout)
+        breaker.record(False, timeout if timed_out else None, generation)
+        if span is not None:
+            span.end(error=e)
+        raise
+    elapsed = time.perf_counter() - started
+    breaker.record(response.status_code < 500, elapsed if adaptive else None, generation)
+    metrics.observe('gateway_upstream_duration_seconds', elapsed, upstream=service)
+    logger.debug("%s %s -> %s %s", method, path, service, response.status_code,
+                 extra={"upstream_ms": round(elapsed * 1000, 1)})
+    if span is not None:
+        span.set('status', response.status_code)
+        span.end()
+    return response
 
 
-def get_user_service_url():
+def relay_list(response):
+    """Relay a list endpoint's body; NDJSON streams are passed through unbuffered"""
+    if response.headers.get('Content-Type', '').startswith('application/x-ndjson'):
+        def generate():
+            try:
+                for chunk in response.iter_content(chunk_size=None):
+                    yield chunk
+            finally:
+                response.close()
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    return response.json()
+
+
+def get_user_service(user_account_id=None):
     """
-    Strangler Pattern: Determine which user service version to route to
-    Based on configured percentage P:
-    - P% of requests go to V1
-    - (100-P)% of requests go to V2
+    Strangler Pattern: Determine which user service version to route to.
+    The split (v1_percentage, or weights per version under `versions`) is
+    precompiled into a bucket table; requests for a user_account_id always
+    map to the same bucket, so each user sticks to one version.
     """
-    if not config['strangler_pattern']['enabled']:
-        return config['services'].get('user_v1', USER_V1_URL)
-    
-    v1_percentage = config['strangler_pattern']['v1_percentage']
-    
-    # Generate random number between 1-100
-    random_value = random.randint(1, 100)
-    
-    if random_value <= v1_percentage:
-        url = config['services'].get('user_v1', USER_V1_URL)
-        print(f"[Strangler] Routing to User V1 (random: {random_value}, threshold: {v1_percentage}%)")
-        return url
-    else:
-        url = config['services'].get('user_v2', USER_V2_URL)
-        print(f"[Strangler] Routing to User V2 (random: {random_value}, threshold: {v1_percentage}%)")
-        return url
+    service = routing_table.route(user_account_id)
+    logger.debug("Routed user request to %s", service, extra={"user_account_id": user_account_id})
+    return service
+
+
+# Health checking ----------------------------------
+
+SERVICE_NAMES = {
+    'user_v1': "User V1",
+    'user_v2': "User V2",
+    'order': "Order Service",
+    'event': "Event Service"
+}
+
+# Probes every service concurrently in the background; /status reads its cache.
+# Probes bypass the circuit breakers so /status shows the real service state
+health_checker = HealthChecker(
+    probe=lambda service, timeout: forward(service, 'GET', '/', guarded=False, timeout=timeout),
+    services=SERVICE_NAMES,
+    **config['health_check']
+)
+health_checker.start()
+
+
+def routing_status_report():
+    """Text lines with each user service version's traffic share and routed request counts"""
+    routing = routing_table.stats()
+    report = ""
+    for service, share in routing['shares'].items():
+        decisions = routing['decisions'].get(service, {"sticky": 0, "unkeyed": 0})
+        report += (f"{SERVICE_NAMES.get(service, service)} Traffic: {share:.1%} "
+                   f"({decisions['sticky']} sticky, {decisions['unkeyed']} unkeyed requests routed)\n")
+    return report
+
+
+def breaker_status_report():
+    """Text lines with each upstream's breaker state, recent failure rate and current timeout"""
+    stats = circuit_breakers.stats(snapshot.timeout)
+    report = (f"Breakers: {'Enabled' if stats['enabled'] else 'Disabled'}, "
+              f"adaptive timeouts: {'Enabled' if stats['adaptive_timeouts'] else 'Disabled'}\n")
+    for service, s in stats['services'].items():
+        p99 = f"{s['p99_ms']} ms" if s['p99_ms'] is not None else "n/a"
+        report += (f"{SERVICE_NAMES.get(service, service)}: {s['state'].upper()}, "
+                   f"failure rate {s['window_failure_rate']:.0%} of last {s['window_calls']} calls, "
+                   f"p99 {p99}, timeout {s['timeout']}s, {s['rejected']} rejected, opened {s['opened']} times\n")
+    return report
+
+
+def service_status_report():
+    """Render the health checker's cached state, one line per service"""
+    now = time.time()
+    report = ""
+    for service, state in health_checker.snapshot().items():
+        url = snapshot.urls.get(service)
+        detail = 'Error' if state['status'] == 'error' else state['detail']
+        if state['checked_at'] is not None:
+            detail += f" [{state['latency_ms']} ms, checked {now - state['checked_at']:.0f}s ago]"
+        report += f"{SERVICE_NAMES[service]} ({url}): {detail}\n"
+    return report
+
+
+# Response cache ----------------------------------
+
+# Cached GET responses, invalidated by proxied writes and user.* events
+response_cache = ResponseCache(**config['response_cache'])
+
+# Identical GETs that miss the cache at the same time share one upstream fetch
+single_flight = SingleFlight(**config['single_flight'])
+
+
+def gateway_metrics():
+    """Cache, coalescing and breaker counters the components already keep (read on scrape)"""
+    cache_stats = response_cache.stats()
+    yield 'gateway_cache_lookups_total', {'result': 'hit'}, cache_stats['hits']
+    yield 'gateway_cache_lookups_total', {'result': 'miss'}, cache_stats['misses']
+    yield 'gateway_coalesced_requests_total', {}, single_flight.stats()['coalesced']
+    for service, state in circuit_breakers.stats(snapshot.timeout)['services'].items():
+        yield 'gateway_circuit_open', {'upstream': service}, int(state['state'] != 'closed')
+
+
+metrics.add_collector(gateway_metrics)
+
+# Cached resources whose data changes when a user event is published
+# (orders follow user email/address changes through the order service sync)
+EVENT_INVALIDATIONS = {
+    'created': ('users', 'events'),
+    'email_updated': ('users', 'orders', 'events'),
+    'address_updated': ('users', 'orders', 'events')
+}
+
+
+def cached_get(resource):
+    """
+    Serve a GET route from the response cache, filling it on a miss.
+    Concurrent misses for the same key are coalesced into one upstream
+    fetch; streamed (NDJSON) responses cannot be shared, so a request
+    that waited on one fetches its own.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = f"{request.path}?{urlencode(sorted(request.args.items(multi=True)))}"
+            cached = response_cache.get(key)
+            if cached is not None:
+                data, mimetype = cached
+                return Response(data, status=200, mimetype=mimetype)
+            generation = response_cache.generation(resource)
+
+            def fetch():
+                response = app.make_response(view(*args, **kwargs))
+                if response.is_streamed:
+                    return response
+                return response.get_data(), response.status_code, response.mimetype
+
+            # The generation is part of the flight key, so a request that
+            # arrives after a write never joins a fetch that started before it
+            result, shared = single_flight.do(f"{resource}@{generation} {key}", fetch, label=request.url_rule.rule)
+            if shared and isinstance(result, Response):
+                result = fetch()
+            if isinstance(result, Response):
+                return result
+            data, status, mimetype = result
+            if status == 200 and not shared:
+                response_cache.put(key, resource, (data, mimetype), generation)
+            return Response(data, status=status, mimetype=mimetype)
+        return wrapper
+    return decorator
+
+
+def invalidates(*resources):
+    """Drop cached reads of the given resources after a proxied write"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                return view(*args, **kwargs)
+            finally:
+                response_cache.invalidate(*resources)
+        return wrapper
+    return decorator
+
+
+def start_cache_invalidation_subscriber():
+    """Invalidate cached reads whenever a user.* event is published"""
+
+    def subscriber():
+        while True:
+            try:
+                rabbitmq_url = os.getenv('RABBITMQ_URL')
+                if not rabbitmq_url:
+                    logger.warning("RABBITMQ_URL not set, cache relies on TTL and gateway writes only")
+                    return
+
+                params = pika.URLParameters(rabbitmq_url)
+                params.socket_timeout = 10
+                params.connection_attempts = 3
+                params.heartbeat = 600
+                params.blocked_connection_timeout = 300
+
+                connection = pika.BlockingConnection(params)
+                channel = connection.channel()
+
+                channel.exchange_declare(
+                    exchange='user_events', 
+                    exchange_type='topic', 
+                    durable=True
+                )
+
+                # Private queue per gateway worker: each worker holds its own cache
+                result = channel.queue_declare(queue='', exclusive=True, auto_delete=True)
+                queue_name = result.method.queue
+                channel.queue_bind(exchange='user_events', queue=queue_name, routing_key='user.*')
+
+                def callback(ch, method, properties, body):
+                    metrics.inc('rabbitmq_consumed_total', queue='gateway_cache')
+                    try:
+                        event_type = json.loads(body.decode()).get("event_type")
+                    except ValueError:
+                        event_type = None
+                    response_cache.invalidate(*EVENT_INVALIDATIONS.get(event_type, ('users', 'events')))
+
+                channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
+
+                logger.info("Gateway cache subscribed to user.* events")
+                channel.start_consuming()
+
+            except Exception as e:
+                logger.error("Cache invalidation subscriber error: %s; retrying in 5 seconds", e)
+                time.sleep(5)
+
+    thread = threading.Thread(target=subscriber, daemon=True)
+    thread.start()
+    return thread
+
+
+if config['response_cache']['enabled']:
+    start_cache_invalidation_subscriber()
+
+
+# Config hot reload ----------------------------------
+
+# Each worker polls the config file and swaps in a validated snapshot, so
+# an edit reaches every worker without POST /config/reload
+config_watcher = ConfigWatcher(CONFIG_PATH, reload_config, interval=config['config_watch'].get('interval', 2))
+
+
+# Shadow traffic ----------------------------------
+
+# Sampled user reads are replayed against the other user version off the
+# request path and compared with the response the client got. Replays skip
+# the circuit breakers and upstream metrics, so shadow failures and
+# latencies never affect real traffic; they only show in the mirror's stats
+shadow_mirror = ShadowMirror(
+    send=lambda service, method, path, params, timeout: forward(service, method, path, guarded=False,
+                                                                 params=params, timeout=timeout),
+    **config['shadow_traffic']
+)
+
+# Started only now: a reload reconfigures every component created above
+if config['config_watch'].get('enabled', True):
+    config_watcher.start()
+
+
+def mirror_read(route, service, path, response, body, latency, params=None):
+    """
+    Offer a served user read to the shadow mirror (returns immediately).
+    latency covers the request through the parsed body, as the replay is timed
+    """
+    shadow_mirror.submit(route, service, path, params, response.status_code, body, latency)
+
+
+def shadow_status_report():
+    """Text lines with match ratios and latency deltas of mirrored user reads"""
+    stats = shadow_mirror.stats()
+    if not stats['enabled'] and not stats['routes']:
+        return "Disabled\n"
+    report = (f"{'Enabled' if stats['enabled'] else 'Disabled'}: sampling {stats['sample_rate']:.0%}, "
+              f"{stats['queued']}/{stats['queue_size']} queued, {stats['dropped']} dropped\n")
+    for route, directions in stats['routes'].items():
+        for direction, s in directions.items():
+            report += (f"{route} {direction}: {s['mirrored']} mirrored, {s['matches']} match, "
+                       f"{s['status_mismatches']} status diffs, {s['body_mismatches']} body diffs, {s['errors']} errors, "
+                       f"delta p50 {s['delta_ms_p50']} ms / p95 {s['delta_ms_p95']} ms\n")
+    return report
 
 
 # Gateway endpoints ----------------------------------
@@ -113,46 +543,45 @@ def hello_world():
     """Simple health check - returns immediately"""
     return "API Gateway is running!" 
 
-# Detailed status check (checks all services) - use /status instead
+# Detailed status check (served from the background health checker's cache)
 @app.route('/status', methods=['GET'])
 def detailed_status():
-    """Detailed status check - checks all services (may be slow)"""
+    """Detailed status check - reports the last cached probe of every service"""
     response = "\n=== API Gateway Status ===\n"
-    response += f"Strangler Pattern: {'Enabled' if config['strangler_pattern']['enabled'] else 'Disabled'}\n"
-    response += f"V1 Traffic: {config['strangler_pattern']['v1_percentage']}%\n"
-    response += f"V2 Traffic: {config['strangler_pattern']['v2_percentage']}%\n"
+    response += f"Config version: {snapshot.version}\n"
+    response += f"Strangler Pattern: {'Enabled' if snapshot.strangler_enabled else 'Disabled'}\n"
+    response += routing_status_report()
     response += "\n=== Service Status ===\n"
+    response += service_status_report()
     
-    timeout = 5  # Short timeout for status checks
-    
-    user_v1_url = config['services'].get('user_v1', USER_V1_URL)
-    user_v2_url = config['services'].get('user_v2', USER_V2_URL)
-    order_url = config['services'].get('order', ORDER_SERVICE_URL)
-    event_url = config['services'].get('event', EVENT_SERVICE_URL)
+    response += "\n=== Circuit Breakers ===\n"
+    response += breaker_status_report()
     
-    try:
-        res1 = requests.get(f"{user_v1_url}/", timeout=timeout)
-        response += f"User V1 ({user_v1_url}): {res1.text if res1.status_code == 200 else 'Error'}\n"
-    except Exception as e:
-        response += f"User V1 ({user_v1_url}): Unavailable - {str(e)[:50]}\n"
+    cache_stats = response_cache.stats()
+    response += "\n=== Response Cache ===\n"
+    response += (f"{'Enabled' if cache_stats['enabled'] else 'Disabled'}: {cache_stats['entries']}/{cache_stats['max_entries']} entries, "
+                 f"{cache_stats['hits']} hits, {cache_stats['misses']} misses (hit ratio {cache_stats['hit_ratio']:.1%}), "
+                 f"{cache_stats['invalidations']} invalidated, {cache_stats['evictions']} evicted\n")
     
-    try:
-        res2 = requests.get(f"{user_v2_url}/", timeout=timeout)
-        response += f"User V2 ({user_v2_url}): {res2.text if res2.status_code == 200 else 'Error'}\n"
-    except Exception as e:
-        response += f"User V2 ({user_v2_url}): Unavailable - {str(e)[:50]}\n"
+    flight_stats = single_flight.stats()
+    response += "\n=== Single-flight ===\n"
+    response += (f"{'Enabled' if flight_stats['enabled'] else 'Disabled'}: {flight_stats['flights']} upstream fetches, "
+                 f"{flight_stats['coalesced']} requests coalesced ({flight_stats['coalesced_ratio']:.1%}), "
+                 f"{flight_stats['in_flight']} in flight\n")
+    for rule, stats in flight_stats['routes'].items():
+        response += (f"{rule}: {stats['flights']} fetches, {stats['coalesced']} coalesced, "
+                     f"max {stats['max_waiters']} waiting, {stats['wait_timeouts']} wait timeouts\n")
     
-    try:
-        res3 = requests.get(f"{order_url}/", timeout=timeout)
-        response += f"Order Service ({order_url}): {res3.text if res3.status_code == 200 else 'Error'}\n"
-    except Exception as e:
-        response += f"Order Service ({order_url}): Unavailable - {str(e)[:50]}\n"
+    pool_stats = upstream_pool.stats()
+    response += "\n=== Upstream Connection Pools ===\n"
+    response += f"Pool size: {pool_stats['pool_size']} per service, keep-alive: {pool_stats['keep_alive']}, idle timeout: {pool_stats['idle_timeout']}s\n"
+    for service, stats in pool_stats['services'].items():
+        response += (f"{service}: {stats['requests']} requests, {stats['errors']} errors, "
+                     f"{stats['connections_opened']} connections opened, {stats['idle_connections']} idle, "
+                     f"{stats['idle_evictions']} idle evictions\n")
     
-    try:
-        res4 = requests.get(f"{event_url}/", timeout=timeout)
-        response += f"Event Service ({event_url}): {res4.text if res4.status_code == 200 else 'Error'}\n"
-    except Exception as e:
-        response += f"Event Service ({event_url}): Unavailable - {str(e)[:50]}\n"
+    response += "\n=== Shadow Traffic ===\n"
+    response += shadow_status_report()
     
     return response
 
@@ -160,83 +589,141 @@ def detailed_status():
 @app.route('/config', methods=['GET'])
 def get_config():
     """Return current gateway configuration"""
+    current = snapshot
     return jsonify({
-        "strangler_pattern": config['strangler_pattern'],
-        "services": config['services'],
-        "timeout": config.get('timeout', 10)
+        "version": current.version,
+        "strangler_pattern": current.config['strangler_pattern'],
+        "services": dict(current.urls),
+        "timeout": current.timeout,
+        "upstream_pool": current.config['upstream_pool'],
+        "circuit_breaker": current.config['circuit_breaker'],
+        "routing": routing_table.stats(),
+        "config_watch": config_watcher.stats,
+        "shadow_traffic": current.config['shadow_traffic']
     })
 
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Return response cache hit/miss counters and single-flight coalescing counters"""
+    return jsonify({**response_cache.stats(), "single_flight": single_flight.stats()})
+
+@app.route('/shadow/stats', methods=['GET'])
+def get_shadow_stats():
+    """Return per-route diffs and latency deltas of mirrored user reads"""
+    return jsonify(shadow_mirror.stats())
+
 @app.route('/config/reload', methods=['POST'])
 def reload_configuration():
-    """Reload configuration from file"""
-    new_config = reload_config()
+    """Reload configuration from file (only this worker; the others pick the change up by polling)"""
+    try:
+        new_config = reload_config()
+    except Exception as e:
+        return jsonify({"status": "Configuration rejected", "error": str(e)}), 400
     return jsonify({
         "status": "Configuration reloaded",
+        "version": snapshot.version,
         "strangler_pattern": new_config['strangler_pattern']
     })
 
+# Trace collector ----------------------------------
+
+@app.route('/traces', methods=['POST'])
+def collect_spans():
+    """Store a batch of finished spans exported by a service ({"spans": [...]})"""
+    spans = (request.get_json(silent=True) or {}).get("spans")
+    if not isinstance(spans, list):
+        return jsonify({"status": "Expected a JSON object with a spans list"}), 400
+    tracer.write_spans([span for span in spans if isinstance(span, dict) and span.get("trace_id")])
+    return jsonify({"status": "Spans stored", "count": len(spans)})
+
+@app.route('/traces', methods=['GET'])
+def list_traces():
+    """Most recent traces (root spans), newest first"""
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({"traces": recent_traces(TRACE_DIR, limit), "exporter": tracer.stats})
+
+@app.route('/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """End-to-end timeline of one trace, across every service that reported spans"""
+    timeline = build_timeline(read_spans(TRACE_DIR, trace_id))
+    if timeline is None:
+        return jsonify({"status": "Trace not found " + trace_id}), 404
+    return jsonify(timeline)
+
 # User endpoints ----------------------------------
 
 @app.route('/users', methods=['GET'])
+@cached_get('users')
 def list_users():
     """List all users - routes through strangler pattern"""
-    url = get_user_service_url()
+    service = get_user_service()
     try:
-        response = requests.get(f"{url}/users", timeout=config.get('timeout', 10))
-        return response.json()
+        params = request.args.to_dict(flat=False)
+        started = time.perf_counter()
+        response = forward(service, 'GET', "/users", params=params, stream=True)
+        body = relay_list(response)
+        if not isinstance(body, Response):
+            # NDJSON streams are not buffered, so only JSON pages are mirrored
+            mirror_read('/users', service, "/users", response, body, time.perf_counter() - started, params)
+        return body
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/user/<user_account_id>', methods=['GET'])
+@cached_get('users')
 def see_user(user_account_id):
     """Get user by ID - routes through strangler pattern"""
-    url = get_user_service_url()
+    service = get_user_service(user_account_id)
     try:
-        response = requests.get(f"{url}/user/{user_account_id}", timeout=config.get('timeout', 10))
-        return response.json(), response.status_code
+        started = time.perf_counter()
+        response = forward(service, 'GET', f"/user/{user_account_id}")
+        body = response.json()
+        mirror_read('/user/<user_account_id>', service, f"/user/{user_account_id}", response, body,
+                    time.perf_counter() - started)
+        return body, response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/user', methods=['POST'])
+@invalidates('users')
 def create_user():
     """Create a new user - routes through strangler pattern"""
-    url = get_user_service_url()
+    service = get_user_service()
     try:
-        response = requests.post(f"{url}/user", json=request.get_json(), timeout=config.get('timeout', 10))
+        response = forward(service, 'POST', "/user", json=request.get_json())
         return jsonify({"status": "User created", "details": response.json().get("status")})
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/user/<user_id>/email', methods=['PUT'])
+@invalidates('users', 'orders')
 def update_user_email(user_id):
     """Update user email - routes through strangler pattern"""
-    url = get_user_service_url()
+    service = get_user_service(user_id)
     try:
-        response = requests.put(f"{url}/user/{user_id}/email", json=request.get_json(), timeout=config.get('timeout', 10))
+        response = forward(service, 'PUT', f"/user/{user_id}/email", json=request.get_json())
         return response.json(), response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/user/<user_id>/address', methods=['PUT'])
+@invalidates('users', 'orders')
 def update_user_address(user_id):
     """Update user address - routes through strangler pattern"""
-    url = get_user_service_url()
+    service = get_user_service(user_id)
     try:
-        response = requests.put(f"{url}/user/{user_id}/address", json=request.get_json(), timeout=config.get('timeout', 10))
+        response = forward(service, 'PUT', f"/user/{user_id}/address", json=request.get_json())
         return response.json(), response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/users/batch', methods=['POST'])
+@invalidates('users')
 def batch_create_users():
     """Batch create users - V2 exclusive feature, always routes to V2"""
     try:
         # Batch operations are a V2-only feature
-        response = requests.post(
-            f"{config['services'].get('user_v2', USER_V2_URL)}/users/batch", 
-            json=request.get_json(), 
-            timeout=config.get('timeout', 10)
-        )
+        response = forward('user_v2', 'POST', "/users/batch", json=request.get_json())
         return response.json(), response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
@@ -244,26 +731,22 @@ def batch_create_users():
 # Order endpoints ----------------------------------
 
 @app.route('/orders', methods=['GET'])
+@cached_get('orders')
 def list_orders():
     """List all orders"""
     try:
-        response = requests.get(
-            f"{config['services'].get('order', ORDER_SERVICE_URL)}/orders", 
-            timeout=config.get('timeout', 10)
-        )
-        return response.json()
+        response = forward('order', 'GET', "/orders", params=request.args.to_dict(flat=False), stream=True)
+        return relay_list(response)
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/orders/status/<status>', methods=['GET'])
+@cached_get('orders')
 def list_orders_by_status(status):
     """List orders by status"""
     try:
-        response = requests.get(
-            f"{config['services'].get('order', ORDER_SERVICE_URL)}/orders/status/{status}", 
-            timeout=config.get('timeout', 10)
-        )
-        return response.json()
+        response = forward('order', 'GET', f"/orders/status/{status}", params=request.args.to_dict(flat=False), stream=True)
+        return relay_list(response)
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
@@ -271,62 +754,47 @@ def list_orders_by_status(status):
 def see_order(order_id):
     """Get order by ID"""
     try:
-        response = requests.get(
-            f"{config['services'].get('order', ORDER_SERVICE_URL)}/order/{order_id}", 
-            timeout=config.get('timeout', 10)
-        )
+        response = forward('order', 'GET', f"/order/{order_id}")
         return response.json(), response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/order', methods=['POST'])
+@invalidates('orders')
 def create_order():
     """Create a new order"""
     try:
-        response = requests.post(
-            f"{config['services'].get('order', ORDER_SERVICE_URL)}/order", 
-            json=request.get_json(), 
-            timeout=config.get('timeout', 10)
-        )
+        response = forward('order', 'POST', "/order", json=request.get_json())
         return jsonify({"status": "Order created", "details": response.json()})
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/order/status/<order_id>', methods=['PUT'])
+@invalidates('orders')
 def update_order_status(order_id):
     """Update order status"""
     try:
-        response = requests.put(
-            f"{config['services'].get('order', ORDER_SERVICE_URL)}/order/{order_id}", 
-            json=request.get_json(), 
-            timeout=config.get('timeout', 10)
-        )
+        response = forward('order', 'PUT', f"/order/{order_id}", json=request.get_json())
         return response.json(), response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/order/<order_id>/email', methods=['PUT'])
+@invalidates('orders')
 def update_order_email(order_id):
     """Update order email"""
     try:
-        response = requests.put(
-            f"{config['services'].get('order', ORDER_SERVICE_URL)}/order/{order_id}/email", 
-            json=request.get_json(), 
-            timeout=config.get('timeout', 10)
-        )
+        response = forward('order', 'PUT', f"/order/{order_id}/email", json=request.get_json())
         return response.json(), response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/order/<order_id>/address', methods=['PUT'])
+@invalidates('orders')
 def update_order_address(order_id):
     """Update order address"""
     try:
-        response = requests.put(
-            f"{config['services'].get('order', ORDER_SERVICE_URL)}/order/{order_id}/address", 
-            json=request.get_json(), 
-            timeout=config.get('timeout', 10)
-        )
+        response = forward('order', 'PUT', f"/order/{order_id}/address", json=request.get_json())
         return response.json(), response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
@@ -335,24 +803,28 @@ def update_order_address(order_id):
 
 @app.route('/events', methods=['GET'])
 def list_events():
-    """List all events from event service"""
+    """List events from event service (since/until/after/limit are passed through)"""
     try:
-        response = requests.get(
-            f"{config['services'].get('event', EVENT_SERVICE_URL)}/events", 
-            timeout=config.get('timeout', 10)
-        )
-        return response.json()
+        response = forward('event', 'GET', "/events", params=request.args.to_dict(flat=False), stream=True)
+        return relay_list(response)
+    except requests.exceptions.RequestException as e:
+        return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
+
+@app.route('/events/export', methods=['GET'])
+def export_events():
+    """Stream events from event service as NDJSON"""
+    try:
+        response = forward('event', 'GET', "/events/export", params=request.args.to_dict(flat=False), stream=True)
+        return relay_list(response)
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
 
 @app.route('/events/count', methods=['GET'])
+@cached_get('events')
 def event_count():
     """Get event count from event service"""
     try:
-        response = requests.get(
-            f"{config['services'].get('event', EVENT_SERVICE_URL)}/events/count", 
-            timeout=config.get('timeout', 10)
-        )
+        response = forward('event', 'GET', "/events/count")
         return response.json()
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Service unavailable: {str(e)}"}), 503
@@ -361,8 +833,8 @@ if __name__ == '__main__':
     print("=" * 50)
     print("API GATEWAY STARTING")
     print("=" * 50)
-    print(f"Strangler Pattern: {'Enabled' if config['strangler_pattern']['enabled'] else 'Disabled'}")
-    print(f"V1 Traffic: {config['strangler_pattern']['v1_percentage']}%")
-    print(f"V2 Traffic: {config['strangler_pattern']['v2_percentage']}%")
+    print(f"Strangler Pattern: {'Enabled' if snapshot.strangler_enabled else 'Disabled'}")
+    for service, share in routing_table.shares().items():
+        print(f"{SERVICE_NAMES.get(service, service)} Traffic: {share:.1%}")
     print("=" * 50)
     app.run(host='0.0.0.0', port=8000, debug=True)
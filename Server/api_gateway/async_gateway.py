@@ -0,0 +1,389 @@
+"""
+Async (ASGI) engine for the API Gateway.
+
+Serves the route table in routes.py with the same strangler routing and
+configuration as api_gateway.py, but proxies through non-blocking httpx
+clients so a slow upstream only parks a coroutine instead of a whole
+worker. One process can hold thousands of in-flight proxied requests.
+/status is served from the same background health checker, sampled
+user reads are mirrored through the same shadow-traffic workers, and GETs
+go through the same response cache and single-flight coalescing (the
+`cache` column of the route table).
+
+Run locally:
+    uvicorn async_gateway:app --host 0.0.0.0 --port 8000
+Run in the container:
+    GATEWAY_MODE=async (see Dockerfile)
+"""
+import asyncio
+import contextlib
+import time
+from urllib.parse import urlencode
+
+import httpx
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import api_gateway
+from breaker import CircuitOpenError, adapts
+from tracing import TRACE_HEADER, build_timeline, parse_traceparent, read_spans, recent_traces
+from routes import ROUTES
+
+# One non-blocking client per backend service, created on first use and
+# rebuilt when the config snapshot changes (reload or file watcher)
+clients = {}
+clients_version = None
+
+# Per-service request counters for /status
+client_stats = {}
+
+# Pending close_later tasks; the loop only keeps weak references to tasks,
+# so without this one could be collected before the old clients are closed
+closing_tasks = set()
+
+
+def get_client(service):
+    """Return the shared async client for a backend service"""
+    client = clients.get(service)
+    if client is None:
+        config = api_gateway.snapshot.config
+        pool = config['upstream_pool']
+        limits = httpx.Limits(
+            max_connections=config['async_engine']['max_connections'],
+            max_keepalive_connections=pool['pool_size'] if pool['keep_alive'] else 0,
+            keepalive_expiry=pool['idle_timeout']
+        )
+        client = httpx.AsyncClient(limits=limits, timeout=config.get('timeout', 10))
+        clients[service] = client
+        client_stats.setdefault(service, {"requests": 0, "errors": 0, "in_flight": 0})
+    return client
+
+
+async def close_clients():
+    """Close every upstream client (on shutdown and config reload)"""
+    while clients:
+        _, client = clients.popitem()
+        await client.aclose()
+
+
+async def close_later(retired, delay):
+    """Close replaced clients once requests already running on them have had time to finish"""
+    await asyncio.sleep(delay)
+    for client in retired:
+        await client.aclose()
+
+
+def retire_clients(version):
+    """Start fresh clients for a new config snapshot; the old ones are closed after a grace period"""
+    global clients_version
+    retired = list(clients.values())
+    clients.clear()
+    clients_version = version
+    if retired:
+        task = asyncio.get_running_loop().create_task(close_later(retired, api_gateway.snapshot.timeout + 1))
+        closing_tasks.add(task)
+        task.add_done_callback(closing_tasks.discard)
+
+
+async def forward(service, method, path, stream=False, **kwargs):
+    """Send a request to a backend service without blocking the event loop (through its circuit breaker)"""
+    current = api_gateway.snapshot
+    if current.version != clients_version:
+        retire_clients(current.version)
+    breaker = api_gateway.circuit_breakers.get(service)
+    generation = breaker.allow()
+    adaptive = adapts(method, stream)
+    timeout = kwargs.setdefault('timeout', breaker.timeout(current.timeout) if adaptive else current.timeout)
+    url = f"{current.urls[service]}{path}"
+    client = get_client(service)
+    stats = client_stats[service]
+    stats["requests"] += 1
+    stats["in_flight"] += 1
+    span = None
+    tracer = api_gateway.tracer
+    if tracer.current() is not None:
+        span = tracer.start_span(f"{method} {service}", kind='client', upstream=service, path=path)
+        kwargs['headers'] = tracer.inject(dict(kwargs.get('headers') or {}), span)
+    started = asyncio.get_running_loop().time()
+    try:
+        response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+    except Exception as e:
+        # A timed-out GET counts as a sample at its timeout so the p99 can grow
+        timed_out = adaptive and isinstance(e, httpx.TimeoutException)
+        breaker.record(False, timeout if timed_out else None, generation)
+        if isinstance(e, httpx.HTTPError):
+            stats["errors"] += 1
+        if span is not None:
+            span.end(error=e)
+        raise
+    finally:
+        stats["in_flight"] -= 1
+    elapsed = asyncio.get_running_loop().time() - started
+    breaker.record(response.status_code < 500, elapsed if adaptive else None, generation)
+    api_gateway.metrics.observe('gateway_upstream_duration_seconds', elapsed, upstream=service)
+    api_gateway.logger.debug("%s %s -> %s %s", method, path, service, response.status_code,
+                             extra={"upstream_ms": round(elapsed * 1000, 1)})
+    if span is not None:
+        span.set('status', response.status_code)
+        span.end()
+    return response
+
+
+async def relay_list(response):
+    """Relay a list endpoint's body; NDJSON streams are passed through unbuffered"""
+    if response.headers.get('Content-Type', '').startswith('application/x-ndjson'):
+        return StreamingResponse(response.aiter_raw(), media_type='application/x-ndjson',
+                                 background=BackgroundTask(response.aclose))
+    await response.aread()
+    return JSONResponse(response.json())
+
+
+def shape_response(mode, response):
+    """Build the gateway response for a route's response mode"""
+    if mode == 'json':
+        return JSONResponse(response.json())
+    if mode == 'user_created':
+        return JSONResponse({"status": "User created", "details": response.json().get("status")})
+    if mode == 'order_created':
+        return JSONResponse({"status": "Order created", "details": response.json()})
+    return JSONResponse(response.json(), status_code=response.status_code)
+
+
+async def cached(request, rule, resource, handle):
+    """
+    Serve a GET from the response cache, filling it on a miss; concurrent
+    misses share one upstream fetch (the async counterpart of cached_get)
+    """
+    cache = api_gateway.response_cache
+    key = f"{request.url.path}?{urlencode(sorted(request.query_params.multi_items()))}"
+    entry = cache.get(key)
+    if entry is not None:
+        data, mimetype = entry
+        return Response(data, media_type=mimetype)
+    generation = cache.generation(resource)
+
+    async def fetch():
+        response = await handle(request)
+        if isinstance(response, StreamingResponse):
+            return response
+        return response.body, response.status_code, response.media_type
+
+    # Streamed (NDJSON) responses cannot be shared: a follower fetches its own
+    result, shared = await api_gateway.single_flight.do_async(f"{resource}@{generation} {key}", fetch, label=rule)
+    if shared and isinstance(result, StreamingResponse):
+        result = await fetch()
+    if isinstance(result, StreamingResponse):
+        return result
+    data, status, mimetype = result
+    if status == 200 and not shared:
+        cache.put(key, resource, (data, mimetype), generation)
+    return Response(data, status_code=status, media_type=mimetype)
+
+
+def make_endpoint(rule, method, target, upstream_path, mode, cache=None):
+    """Create the async handler for one route table entry"""
+    mirrored = target == 'user' and method == 'GET'
+
+    async def endpoint(request):
+        metrics = api_gateway.metrics
+        api_gateway.log_setup.sample()
+        started = time.perf_counter()
+        metrics.inc('http_requests_in_flight')
+        status = 500
+        span = api_gateway.tracer.start_span(f"{method} {rule}", parent=parse_traceparent(request.headers.get(TRACE_HEADER)),
+                                             kind='server', path=request.url.path)
+        try:
+            with span:
+                if method == 'GET' and cache:
+                    response = await cached(request, rule, cache, handle)
+                elif cache:
+                    try:
+                        response = await handle(request)
+                    finally:
+                        api_gateway.response_cache.invalidate(*cache)
+                else:
+                    response = await handle(request)
+                status = response.status_code
+                span.set('status', status)
+            response.headers[TRACE_HEADER] = span.traceparent()
+            return response
+        finally:
+            metrics.inc('http_requests_in_flight', -1)
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - started, route=rule, method=method)
+            metrics.inc('http_requests_total', route=rule, method=method, status=str(status))
+
+    async def handle(request):
+        if target == 'user':
+            params = request.path_params
+            service = api_gateway.get_user_service(params.get('user_account_id', params.get('user_id')))
+        else:
+            service = target
+        path = upstream_path.format(**request.path_params)
+        kwargs = {}
+        if method == 'GET':
+            kwargs['params'] = request.query_params.multi_items()
+        if method in ('POST', 'PUT'):
+            try:
+                kwargs['json'] = await request.json()
+            except ValueError:
+                kwargs['json'] = None
+        started = time.perf_counter()
+        try:
+            if mode == 'json':
+                response = await forward(service, method, path, stream=True, **kwargs)
+                relayed = await relay_list(response)
+                if mirrored and api_gateway.shadow_mirror.enabled and not isinstance(relayed, StreamingResponse):
+                    api_gateway.mirror_read(rule, service, path, response, response.json(),
+                                            time.perf_counter() - started, kwargs['params'])
+                return relayed
+            response = await forward(service, method, path, **kwargs)
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            return JSONResponse({"error": f"Service unavailable: {str(e)}"}, status_code=503)
+        if mirrored and api_gateway.shadow_mirror.enabled:
+            body = response.json()
+            api_gateway.mirror_read(rule, service, path, response, body,
+                                    time.perf_counter() - started, kwargs['params'])
+        return shape_response(mode, response)
+
+    return endpoint
+
+
+def starlette_path(rule):
+    """Convert a Flask rule (/user/<id>) to a Starlette path (/user/{id})"""
+    return rule.replace('<', '{').replace('>', '}')
+
+
+# Gateway endpoints ----------------------------------
+
+async def hello_world(request):
+    """Simple health check - returns immediately"""
+    return PlainTextResponse("API Gateway (async) is running!")
+
+
+async def detailed_status(request):
+    """Detailed status check - reports the last cached probe of every service"""
+    current = api_gateway.snapshot
+    config = current.config
+    response = "\n=== API Gateway Status (async) ===\n"
+    response += f"Config version: {current.version}\n"
+    response += f"Strangler Pattern: {'Enabled' if current.strangler_enabled else 'Disabled'}\n"
+    response += api_gateway.routing_status_report()
+    response += "\n=== Service Status ===\n"
+    response += api_gateway.service_status_report()
+
+    response += "\n=== Circuit Breakers ===\n"
+    response += api_gateway.breaker_status_report()
+
+    response += "\n=== Upstream Clients ===\n"
+    response += f"Max connections: {config['async_engine']['max_connections']} per service\n"
+    for service, stats in client_stats.items():
+        response += f"{service}: {stats['requests']} requests, {stats['errors']} errors, {stats['in_flight']} in flight\n"
+
+    response += "\n=== Shadow Traffic ===\n"
+    response += api_gateway.shadow_status_report()
+    return PlainTextResponse(response)
+
+
+async def get_config(request):
+    """Return current gateway configuration"""
+    current = api_gateway.snapshot
+    config = current.config
+    return JSONResponse({
+        "version": current.version,
+        "strangler_pattern": config['strangler_pattern'],
+        "services": dict(current.urls),
+        "timeout": current.timeout,
+        "upstream_pool": config['upstream_pool'],
+        "async_engine": config['async_engine'],
+        "circuit_breaker": config['circuit_breaker'],
+        "routing": api_gateway.routing_table.stats(),
+        "config_watch": api_gateway.config_watcher.stats,
+        "shadow_traffic": config['shadow_traffic']
+    })
+
+
+async def get_metrics(request):
+    """Prometheus text exposition of this worker's metrics"""
+    return Response(api_gateway.metrics.exposition(), media_type='text/plain; version=0.0.4')
+
+
+async def get_cache_stats(request):
+    """Return response cache hit/miss counters and single-flight coalescing counters"""
+    return JSONResponse({**api_gateway.response_cache.stats(), "single_flight": api_gateway.single_flight.stats()})
+
+
+async def get_shadow_stats(request):
+    """Return per-route diffs and latency deltas of mirrored user reads"""
+    return JSONResponse(api_gateway.shadow_mirror.stats())
+
+
+async def collect_spans(request):
+    """Store a batch of finished spans exported by a service ({"spans": [...]})"""
+    try:
+        spans = (await request.json()).get("spans")
+    except (ValueError, AttributeError):
+        spans = None
+    if not isinstance(spans, list):
+        return JSONResponse({"status": "Expected a JSON object with a spans list"}, status_code=400)
+    spans = [span for span in spans if isinstance(span, dict) and span.get("trace_id")]
+    await asyncio.to_thread(api_gateway.tracer.write_spans, spans)
+    return JSONResponse({"status": "Spans stored", "count": len(spans)})
+
+
+async def list_traces(request):
+    """Most recent traces (root spans), newest first"""
+    limit = int(request.query_params.get('limit', 20))
+    traces = await asyncio.to_thread(recent_traces, api_gateway.TRACE_DIR, limit)
+    return JSONResponse({"traces": traces, "exporter": api_gateway.tracer.stats})
+
+
+async def get_trace(request):
+    """End-to-end timeline of one trace, across every service that reported spans"""
+    trace_id = request.path_params['trace_id']
+    timeline = build_timeline(await asyncio.to_thread(read_spans, api_gateway.TRACE_DIR, trace_id))
+    if timeline is None:
+        return JSONResponse({"status": "Trace not found " + trace_id}, status_code=404)
+    return JSONResponse(timeline)
+
+
+async def reload_configuration(request):
+    """Reload configuration from file (clients are rebuilt on the next proxied request)"""
+    try:
+        new_config = api_gateway.reload_config()
+    except Exception as e:
+        return JSONResponse({"status": "Configuration rejected", "error": str(e)}, status_code=400)
+    return JSONResponse({
+        "status": "Configuration reloaded",
+        "version": api_gateway.snapshot.version,
+        "strangler_pattern": new_config['strangler_pattern']
+    })
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await close_clients()
+
+
+routes = [
+    Route('/', hello_world, methods=['GET']),
+    Route('/status', detailed_status, methods=['GET']),
+    Route('/config', get_config, methods=['GET']),
+    Route('/config/reload', reload_configuration, methods=['POST']),
+    Route('/cache/stats', get_cache_stats, methods=['GET']),
+    Route('/shadow/stats', get_shadow_stats, methods=['GET']),
+    Route('/metrics', get_metrics, methods=['GET']),
+    Route('/traces', collect_spans, methods=['POST']),
+    Route('/traces', list_traces, methods=['GET']),
+    Route('/traces/{trace_id}', get_trace, methods=['GET']),
+]
+for rule, method, target, upstream_path, mode, cache in ROUTES:
+    routes.append(Route(
+        starlette_path(rule),
+        make_endpoint(rule, method, target, upstream_path, mode, cache),
+        methods=[method]
+    ))
+
+app = Starlette(routes=routes, lifespan=lifespan)
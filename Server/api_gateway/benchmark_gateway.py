@@ -0,0 +1,184 @@
+"""
+Benchmark: Flask (sync) gateway vs async (ASGI) gateway.
+
+Starts a stub upstream that answers every request after a fixed delay
+(standing in for a slow Mongo-backed service), runs both gateway engines
+against it, and drives the same concurrent load through each one.
+
+Usage:
+    python benchmark_gateway.py [--requests 2000] [--concurrency 200]
+                                [--delay 0.05] [--path /orders] [--json out.json]
+
+Requires gunicorn, uvicorn and httpx (see requirements.txt).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STUB_PORT = 9100
+SYNC_PORT = 9101
+ASYNC_PORT = 9102
+
+
+# Stub upstream ----------------------------------
+
+def make_stub_app(delay):
+    """Upstream stand-in that sleeps `delay` seconds before answering"""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, PlainTextResponse
+    from starlette.routing import Route
+
+    async def health(request):
+        return PlainTextResponse("Stub upstream is running!")
+
+    async def anything(request):
+        await asyncio.sleep(delay)
+        return JSONResponse({"status": [{"path": request.url.path}]})
+
+    return Starlette(routes=[
+        Route('/', health),
+        Route('/{path:path}', anything, methods=['GET', 'POST', 'PUT']),
+    ])
+
+
+def serve_stub(port, delay):
+    import uvicorn
+    uvicorn.run(make_stub_app(delay), host='127.0.0.1', port=port, log_level='warning')
+
+
+# Process management ----------------------------------
+
+def start_processes(delay, sync_workers):
+    upstream = f"http://127.0.0.1:{STUB_PORT}"
+    env = dict(os.environ,
+               USER_V1_URL=upstream, USER_V2_URL=upstream,
+               ORDER_SERVICE_URL=upstream, EVENT_SERVICE_URL=upstream,
+               PYTHONUNBUFFERED='1')
+    quiet = {'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL, 'cwd': HERE, 'env': env}
+    return [
+        subprocess.Popen([sys.executable, __file__, '--serve-stub', '--delay', str(delay)], **quiet),
+        subprocess.Popen([sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{SYNC_PORT}',
+                          '--workers', str(sync_workers), '--timeout', '120', 'api_gateway:app'], **quiet),
+        subprocess.Popen([sys.executable, '-m', 'uvicorn', 'async_gateway:app', '--host', '127.0.0.1',
+                          '--port', str(ASYNC_PORT), '--log-level', 'warning'], **quiet),
+    ]
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+# Load generation ----------------------------------
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def drive(base_url, path, total, concurrency):
+    """Send `total` GETs with at most `concurrency` in flight"""
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.05, help='upstream latency in seconds')
+    parser.add_argument('--path', default='/orders')
+    parser.add_argument('--sync-workers', type=int, default=2)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--serve-stub', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_stub:
+        serve_stub(STUB_PORT, args.delay)
+        return
+
+    processes = start_processes(args.delay, args.sync_workers)
+    try:
+        for port in (STUB_PORT, SYNC_PORT, ASYNC_PORT):
+            if not wait_until_up(port):
+                print(f"✗ Nothing listening on port {port}, aborting")
+                return 1
+
+        results = {
+            "settings": {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "upstream_delay_s": args.delay,
+                "path": args.path,
+                "sync_workers": args.sync_workers
+            },
+            "flask_sync": asyncio.run(drive(f"http://127.0.0.1:{SYNC_PORT}", args.path, args.requests, args.concurrency)),
+            "asgi_async": asyncio.run(drive(f"http://127.0.0.1:{ASYNC_PORT}", args.path, args.requests, args.concurrency)),
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    print(f"{'engine':<12}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for engine in ('flask_sync', 'asgi_async'):
+        r = results[engine]
+        print(f"{engine:<12}{r['throughput_rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errors']:>8}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✓ Results written to {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
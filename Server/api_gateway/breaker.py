@@ -0,0 +1,232 @@
+"""
+Per-upstream circuit breakers and adaptive timeouts for the API Gateway.
+
+Every backend service gets a CircuitBreaker that remembers the outcome of
+its last `window` calls (connection errors, timeouts and 5xx responses
+are failures). Once at least `min_calls` are recorded and the failure
+rate reaches `failure_rate`, the breaker opens: calls to that service
+fail immediately with CircuitOpenError (a requests RequestException, so
+the routes answer 503 as for any unreachable service) instead of tying
+up gateway workers. After `open_seconds` the breaker goes half-open and
+lets `half_open_probes` calls through; a success closes it, a failure
+opens it again. Every state change starts a new generation, and allow()
+hands out the generation a call was admitted in: a late result from an
+older generation (a slow call from before the breaker opened, or a probe
+that was given up on) is counted but cannot move the state.
+
+The same breaker keeps the latencies of recent plain GETs. With adaptive
+timeouts on, such a call's timeout is the observed p99 latency times
+`multiplier`, never below `min_timeout` and never above the configured
+gateway timeout, so a degraded service is abandoned long before the
+fixed 10 s. A GET that times out is kept as a sample at its timeout, so
+an upstream that gets slower raises the p99 instead of timing out every
+call with nothing new to learn from. Writes and streamed responses
+always get the configured timeout (see adapts()): a write cut off early
+may already have been applied, and a large list or export takes as long
+as its size, not as long as the service's typical read.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Recompute the p99 after this many new latency samples
+TIMEOUT_REFRESH = 10
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling a service whose breaker is open"""
+
+
+def adapts(method, stream=False):
+    """Whether a call uses (and feeds) the adaptive timeout: only non-streamed GETs"""
+    return method == 'GET' and not stream
+
+
+class CircuitBreaker:
+    """Failure-rate breaker and latency tracker for one upstream service"""
+
+    def __init__(self, service, registry):
+        self.service = service
+        self._registry = registry
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = None
+        self.probed_at = None
+        self.changed_at = time.time()
+        self._outcomes = deque(maxlen=registry.window)
+        self._latencies = deque(maxlen=registry.samples)
+        self._probes = 0
+        self._generation = 0
+        self._timeout = None
+        self._fresh_samples = 0
+        self.counters = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def resize(self):
+        """Apply new window/sample sizes, keeping the most recent history"""
+        with self._lock:
+            self._outcomes = deque(self._outcomes, maxlen=self._registry.window)
+            self._latencies = deque(self._latencies, maxlen=self._registry.samples)
+            self._timeout = None
+
+    def _set_state(self, state):
+        self.state = state
+        self._generation += 1
+        self.changed_at = time.time()
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.counters["opened"] += 1
+            logger.warning("Circuit opened for %s", self.service)
+        elif state == CLOSED:
+            self._outcomes.clear()
+            logger.info("Circuit closed for %s", self.service)
+
+    def allow(self):
+        """
+        Raise CircuitOpenError unless a call to this service may go ahead;
+        returns the generation to pass back to record() with its outcome
+        """
+        registry = self._registry
+        if not registry.enabled:
+            return self._generation
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < registry.open_seconds:
+                    self.counters["rejected"] += 1
+                    raise CircuitOpenError(f"circuit open for {self.service}")
+                self._set_state(HALF_OPEN)
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= registry.half_open_probes:
+                    if time.monotonic() - self.probed_at < registry.open_seconds:
+                        self.counters["rejected"] += 1
+                        raise CircuitOpenError(f"circuit half-open for {self.service}, probe in progress")
+                    # The probes never reported back (cancelled); let new ones through
+                    # and ignore whatever the old ones report later
+                    self._probes = 0
+                    self._generation += 1
+                self._probes += 1
+                self.probed_at = time.monotonic()
+            return self._generation
+
+    def record(self, success, latency=None, generation=None):
+        """
+        Record the outcome of a call admitted in `generation`. latency, if
+        given, becomes a timeout sample: pass it for adaptive calls that
+        completed or timed out (at the timeout they were given)
+        """
+        with self._lock:
+            self.counters["calls"] += 1
+            if latency is not None:
+                self._latencies.append(latency)
+                self._fresh_samples += 1
+            if not success:
+                self.counters["failures"] += 1
+
+            if not self._registry.enabled:
+                return
+            if generation is not None and generation != self._generation:
+                # Admitted before the last state change: too late to count
+                return
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                self._set_state(CLOSED if success else OPEN)
+                return
+            if self.state == OPEN:
+                # A call that started before the breaker opened (untagged)
+                return
+            self._outcomes.append(success)
+            calls = len(self._outcomes)
+            if calls >= self._registry.min_calls:
+                failures = calls - sum(self._outcomes)
+                if failures / calls >= self._registry.failure_rate:
+                    self._set_state(OPEN)
+
+    def p99(self):
+        """p99 of recent adaptive call latencies (seconds), None until enough samples"""
+        with self._lock:
+            if len(self._latencies) < self._registry.min_samples:
+                return None
+            if self._timeout is None or self._fresh_samples >= TIMEOUT_REFRESH:
+                ordered = sorted(self._latencies)
+                self._timeout = ordered[int(0.99 * (len(ordered) - 1))]
+                self._fresh_samples = 0
+            return self._timeout
+
+    def timeout(self, default):
+        """Timeout for the next call: p99 x multiplier within [min_timeout, default]"""
+        registry = self._registry
+        if not registry.adaptive:
+            return default
+        p99 = self.p99()
+        if p99 is None:
+            return default
+        return min(default, max(registry.min_timeout, p99 * registry.multiplier))
+
+    def stats(self, default_timeout):
+        p99 = self.p99()
+        timeout = self.timeout(default_timeout)
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                "state": self.state,
+                "since": self.changed_at,
+                "window_calls": calls,
+                "window_failure_rate": round((calls - sum(self._outcomes)) / calls, 3) if calls else 0.0,
+                "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+                "timeout": round(timeout, 3),
+                **self.counters
+            }
+
+
+class CircuitBreakers:
+    """One CircuitBreaker per upstream service, sharing one set of settings"""
+
+    def __init__(self, enabled=True, window=20, min_calls=10, failure_rate=0.5, open_seconds=10,
+                 half_open_probes=1, adaptive_timeout=True, multiplier=3, min_timeout=1, samples=200, min_samples=20):
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self.configure(enabled, window, min_calls, failure_rate, open_seconds,
+                       half_open_probes, adaptive_timeout, multiplier, min_timeout, samples, min_samples)
+
+    def configure(self, enabled=True, window=20, min_calls=10, failure_rate=0.5, open_seconds=10,
+                  half_open_probes=1, adaptive_timeout=True, multiplier=3, min_timeout=1, samples=200, min_samples=20):
+        """Apply new settings; breaker state and history are kept"""
+        self.enabled = enabled
+        self.window = int(window)
+        self.min_calls = int(min_calls)
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = int(half_open_probes)
+        self.adaptive = adaptive_timeout
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.samples = int(samples)
+        self.min_samples = int(min_samples)
+        with self._lock:
+            for breaker in self._breakers.values():
+                breaker.resize()
+
+    def get(self, service):
+        breaker = self._breakers.get(service)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(service, CircuitBreaker(service, self))
+        return breaker
+
+    def stats(self, default_timeout):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            "enabled": self.enabled,
+            "adaptive_timeouts": self.adaptive,
+            "services": {service: breaker.stats(default_timeout) for service, breaker in breakers.items()}
+        }
@@ -0,0 +1,132 @@
+"""
+Validated, read-only gateway configuration snapshots.
+
+A GatewaySnapshot is compiled once from a loaded gateway_config.yaml:
+validate_config() rejects a file that would break routing or the
+per-service components, and the values read on every request (upstream
+URLs, timeout, strangler split) are resolved into flat attributes.
+Snapshots cannot be modified; a reload builds a new one and rebinds the
+module-level reference in one assignment, so a request that read the
+snapshot once sees one consistent configuration throughout.
+"""
+import time
+from types import MappingProxyType
+
+from logs import parse_level
+from routing import build_table, strangler_weights
+
+# Section -> fields that must be positive numbers (ttl may be 0: cache off by expiry)
+NUMERIC_FIELDS = {
+    'upstream_pool': ('pool_size', 'idle_timeout'),
+    'response_cache': ('max_entries', 'ttl'),
+    'single_flight': ('wait_timeout',),
+    'health_check': ('interval', 'timeout'),
+    'async_engine': ('max_connections',),
+    'config_watch': ('interval',),
+    'shadow_traffic': ('queue_size', 'workers', 'timeout'),
+    'circuit_breaker': ('window', 'min_calls', 'open_seconds', 'half_open_probes',
+                        'multiplier', 'min_timeout', 'samples', 'min_samples')
+}
+ZERO_ALLOWED = {('response_cache', 'ttl')}
+# (section, field) -> fraction that must lie in [0, 1]
+FRACTION_FIELDS = (('shadow_traffic', 'sample_rate'), ('circuit_breaker', 'failure_rate'),
+                   ('logging', 'debug_sample_rate'))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_config(config):
+    """Raise ValueError listing every problem in a loaded config"""
+    if not isinstance(config, dict):
+        raise ValueError("configuration must be a mapping")
+    errors = []
+
+    strangler = config.get('strangler_pattern')
+    if not isinstance(strangler, dict):
+        errors.append("strangler_pattern must be a mapping")
+    else:
+        if not isinstance(strangler.get('enabled', True), bool):
+            errors.append("strangler_pattern.enabled must be true or false")
+        versions = strangler.get('versions')
+        if versions is not None:
+            if not isinstance(versions, dict) or not versions:
+                errors.append("strangler_pattern.versions must map services to weights")
+            else:
+                for service, weight in versions.items():
+                    if service not in config.get('services', {}):
+                        errors.append(f"strangler_pattern.versions: unknown service {service}")
+                    if not _is_number(weight) or weight < 0:
+                        errors.append(f"strangler_pattern.versions.{service} must be a non-negative number")
+        else:
+            v1_percentage = strangler.get('v1_percentage', 0)
+            if not _is_number(v1_percentage) or not 0 <= v1_percentage <= 100:
+                errors.append("strangler_pattern.v1_percentage must be a number between 0 and 100")
+        if not errors and strangler.get('enabled', True):
+            try:
+                build_table(strangler_weights(strangler))
+            except ValueError as e:
+                errors.append(str(e))
+
+    timeout = config.get('timeout', 10)
+    if not _is_number(timeout) or timeout <= 0:
+        errors.append("timeout must be a positive number")
+
+    for section, fields in NUMERIC_FIELDS.items():
+        values = config.get(section)
+        if values is None:
+            continue
+        if not isinstance(values, dict):
+            errors.append(f"{section} must be a mapping")
+            continue
+        for field in fields:
+            if field not in values:
+                continue
+            value = values[field]
+            zero_allowed = (section, field) in ZERO_ALLOWED
+            if not _is_number(value) or value < 0 or (value == 0 and not zero_allowed):
+                errors.append(f"{section}.{field} must be a {'non-negative' if zero_allowed else 'positive'} number")
+
+    for section, field in FRACTION_FIELDS:
+        values = config.get(section)
+        if isinstance(values, dict) and field in values:
+            if not _is_number(values[field]) or not 0 <= values[field] <= 1:
+                errors.append(f"{section}.{field} must be a number between 0 and 1")
+
+    logging_config = config.get('logging')
+    if logging_config is not None:
+        if not isinstance(logging_config, dict):
+            errors.append("logging must be a mapping")
+        elif 'level' in logging_config:
+            try:
+                parse_level(logging_config['level'])
+            except ValueError as e:
+                errors.append(f"logging.level: {e}")
+
+    if errors:
+        raise ValueError("; ".join(errors))
+
+
+class GatewaySnapshot:
+    """Immutable compiled view of one configuration version"""
+
+    __slots__ = ('config', 'version', 'loaded_at', 'urls', 'timeout', 'strangler_enabled', 'weights')
+
+    def __init__(self, config, version=1):
+        validate_config(config)
+        strangler = config['strangler_pattern']
+        values = {
+            'config': config,
+            'version': version,
+            'loaded_at': time.time(),
+            'urls': MappingProxyType(dict(config['services'])),
+            'timeout': config.get('timeout', 10),
+            'strangler_enabled': strangler.get('enabled', True),
+            'weights': MappingProxyType(strangler_weights(strangler))
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GatewaySnapshot is read-only; compile a new one instead")
@@ -0,0 +1,69 @@
+"""
+Config file watcher for the API Gateway.
+
+Every gunicorn worker runs its own watcher thread, which polls the config
+file's mtime, size and inode (so edits, rewrites and the atomic renames
+used by ConfigMap-style mounts are all detected) and calls on_change()
+when any of them moves. A change that fails to load or validate is
+reported and leaves the running configuration in place; the watcher
+retries on the next modification.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher:
+    """Polls one file and calls on_change() after it changes"""
+
+    def __init__(self, path, on_change, interval=2):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._signature = self._stat()
+        self._thread = None
+        self.stats = {"checks": 0, "reloads": 0, "rejected": 0, "last_error": None, "last_reload_at": None}
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def check(self):
+        """Reload if the file changed since the last check; True if a new config was applied"""
+        self.stats["checks"] += 1
+        signature = self._stat()
+        if signature == self._signature or signature is None:
+            return False
+        self._signature = signature
+        try:
+            self.on_change()
+        except Exception as e:
+            self.stats["rejected"] += 1
+            self.stats["last_error"] = str(e)
+            logger.error("Rejected config change in %s: %s", self.path, e)
+            return False
+        self.stats["reloads"] += 1
+        self.stats["last_error"] = None
+        self.stats["last_reload_at"] = time.time()
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("Config watcher error: %s", e)
+
+    def start(self):
+        """Start the polling thread (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+            self._thread.start()
+        return self._thread
@@ -0,0 +1,94 @@
+"""
+Background health checking for the API Gateway.
+
+A daemon thread probes every backend service concurrently on a fixed
+interval and caches each service's last state and latency, so /status
+reads a snapshot instead of waiting on the services.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class HealthChecker:
+    """Concurrent, cached health probes for a set of services"""
+
+    def __init__(self, probe, services, interval=10, timeout=5):
+        # probe(service, timeout) -> response with .status_code and .text
+        self.probe = probe
+        self.services = list(services)
+        self.interval = interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._state = {service: self._unknown() for service in self.services}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.services)),
+                                            thread_name_prefix='health-probe')
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _unknown():
+        return {
+            "status": "unknown",
+            "detail": "Not checked yet",
+            "latency_ms": None,
+            "checked_at": None,
+            "consecutive_failures": 0
+        }
+
+    def configure(self, interval=10, timeout=5):
+        """Apply new probe settings and re-check immediately"""
+        self.interval = interval
+        self.timeout = timeout
+        self._wakeup.set()
+
+    def _check(self, service):
+        started = time.perf_counter()
+        try:
+            response = self.probe(service, self.timeout)
+            healthy = response.status_code == 200
+            status = "up" if healthy else "error"
+            detail = response.text if healthy else f"HTTP {response.status_code}"
+        except Exception as e:
+            healthy = False
+            status = "down"
+            detail = f"Unavailable - {str(e)[:50]}"
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        with self._lock:
+            previous = self._state.get(service, self._unknown())
+            self._state[service] = {
+                "status": status,
+                "detail": detail,
+                "latency_ms": latency_ms,
+                "checked_at": time.time(),
+                "consecutive_failures": 0 if healthy else previous["consecutive_failures"] + 1
+            }
+
+    def check_all(self):
+        """Probe every service concurrently and wait for all results"""
+        list(self._executor.map(self._check, self.services))
+
+    def _run(self):
+        while True:
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error("Health check error: %s", e)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Start the background probe loop (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='health-checker', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def snapshot(self):
+        """Last known state of every service"""
+        with self._lock:
+            return {service: dict(state) for service, state in self._state.items()}
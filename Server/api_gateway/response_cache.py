@@ -0,0 +1,96 @@
+"""
+Bounded LRU/TTL response cache for gateway GETs.
+
+Entries are keyed by route and query parameters and tagged with the
+resource they read ('users', 'orders', 'events'). Writes proxied through
+the gateway and user.* events from RabbitMQ invalidate a whole resource.
+Each resource carries a generation number so a fetch that started before
+an invalidation never stores its (now stale) result.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with per-entry TTL and resource invalidation"""
+
+    def __init__(self, enabled=True, max_entries=1024, ttl=30):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, resource, value)
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.configure(enabled, max_entries, ttl)
+
+    def configure(self, enabled=True, max_entries=1024, ttl=30):
+        """Apply new settings, dropping every cached entry"""
+        with self._lock:
+            self.enabled = bool(enabled)
+            self.max_entries = int(max_entries)
+            self.ttl = float(ttl)
+            self._entries.clear()
+
+    def generation(self, resource):
+        """Current generation of a resource; pass it back to put()"""
+        with self._lock:
+            return self._generations.get(resource, 0)
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, resource, value, generation):
+        """Store value unless the resource was invalidated since `generation`"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self._generations.get(resource, 0) != generation:
+                return False
+            self._entries[key] = (time.monotonic() + self.ttl, resource, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, *resources):
+        """Drop every entry for the given resources"""
+        with self._lock:
+            for resource in resources:
+                self._generations[resource] = self._generations.get(resource, 0) + 1
+            stale = [key for key, entry in self._entries.items() if entry[1] in resources]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def stats(self):
+        """Hit/miss counters and occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,42 @@
+"""
+Gateway route table.
+
+Every proxied route served by the API Gateway, in the same order as the
+handlers in api_gateway.py. The async engine (async_gateway.py) builds its
+routes from this table so both engines expose the same API.
+
+Each entry: (gateway rule, method, upstream service, upstream path, response mode, cache)
+- upstream service 'user' is resolved per request by the strangler pattern
+- response modes:
+    json           upstream JSON body, always 200
+    json_status    upstream JSON body and status code
+    user_created   {"status": "User created", "details": <upstream status>}
+    order_created  {"status": "Order created", "details": <upstream body>}
+- cache: for a GET, the response-cache resource it is cached (and
+  coalesced) under; for a write, the resources it invalidates; None for
+  neither. Matches @cached_get / @invalidates on the sync handlers.
+"""
+
+ROUTES = [
+    # User endpoints
+    ('/users', 'GET', 'user', '/users', 'json', 'users'),
+    ('/user/<user_account_id>', 'GET', 'user', '/user/{user_account_id}', 'json_status', 'users'),
+    ('/user', 'POST', 'user', '/user', 'user_created', ('users',)),
+    ('/user/<user_id>/email', 'PUT', 'user', '/user/{user_id}/email', 'json_status', ('users', 'orders')),
+    ('/user/<user_id>/address', 'PUT', 'user', '/user/{user_id}/address', 'json_status', ('users', 'orders')),
+    ('/users/batch', 'POST', 'user_v2', '/users/batch', 'json_status', ('users',)),
+
+    # Order endpoints
+    ('/orders', 'GET', 'order', '/orders', 'json', 'orders'),
+    ('/orders/status/<status>', 'GET', 'order', '/orders/status/{status}', 'json', 'orders'),
+    ('/order/<order_id>', 'GET', 'order', '/order/{order_id}', 'json_status', None),
+    ('/order', 'POST', 'order', '/order', 'order_created', ('orders',)),
+    ('/order/status/<order_id>', 'PUT', 'order', '/order/{order_id}', 'json_status', ('orders',)),
+    ('/order/<order_id>/email', 'PUT', 'order', '/order/{order_id}/email', 'json_status', ('orders',)),
+    ('/order/<order_id>/address', 'PUT', 'order', '/order/{order_id}/address', 'json_status', ('orders',)),
+
+    # Event service endpoints
+    ('/events', 'GET', 'event', '/events', 'json', None),
+    ('/events/export', 'GET', 'event', '/events/export', 'json', None),
+    ('/events/count', 'GET', 'event', '/events/count', 'json', 'events'),
+]
@@ -0,0 +1,109 @@
+"""
+Strangler-pattern routing engine.
+
+The traffic split is compiled once (at startup and on config reload) into
+a table of BUCKETS entries, each naming the user service version that
+owns that bucket. Buckets are apportioned to the configured weights by
+largest remainder and laid out as contiguous ranges in config order, so
+moving the split only reassigns the buckets at the boundary. Routing a
+request is then one table lookup: requests that carry a user_account_id
+use crc32(id) as the bucket, so a user always reaches the same version
+for a given split, while requests without one (listing or creating
+users) step through the table with a stride coprime to its size, which
+spreads them across versions in proportion. Decisions are counted per
+version instead of being printed.
+"""
+import itertools
+import threading
+import zlib
+
+BUCKETS = 1000
+# Coprime with BUCKETS, so unkeyed requests visit every bucket once per cycle
+ROTATION_STRIDE = 619
+
+
+def strangler_weights(strangler):
+    """{service: weight} from a strangler_pattern config block"""
+    if strangler.get('versions'):
+        return {service: float(weight) for service, weight in strangler['versions'].items()}
+    v1_percentage = float(strangler.get('v1_percentage', 0))
+    return {'user_v1': v1_percentage, 'user_v2': 100 - v1_percentage}
+
+
+def build_table(weights, buckets=BUCKETS):
+    """Bucket -> service tuple apportioned to weights, one contiguous range per service"""
+    weights = {service: weight for service, weight in weights.items() if weight > 0}
+    total = sum(weights.values())
+    if not total:
+        raise ValueError("strangler_pattern needs at least one version with a positive weight")
+
+    # Largest remainder apportionment of the buckets
+    quotas = {service: weight * buckets / total for service, weight in weights.items()}
+    shares = {service: int(quota) for service, quota in quotas.items()}
+    leftover = buckets - sum(shares.values())
+    for service in sorted(quotas, key=lambda s: quotas[s] - shares[s], reverse=True)[:leftover]:
+        shares[service] += 1
+    return tuple(service for service, share in shares.items() for _ in range(share))
+
+
+class RoutingTable:
+    """Precomputed sticky routing over weighted user service versions"""
+
+    def __init__(self, enabled=True, weights=None, default='user_v1', buckets=BUCKETS):
+        self.default = default
+        self.buckets = buckets
+        self._rotation = itertools.count()
+        self._lock = threading.Lock()
+        self._counts = {}
+        self.configure(enabled, weights)
+
+    @classmethod
+    def from_config(cls, strangler):
+        return cls(enabled=strangler.get('enabled', True), weights=strangler_weights(strangler))
+
+    def configure(self, enabled=True, weights=None):
+        """Recompile the table for a new split; decision counters are kept"""
+        weights = dict(weights or {self.default: 100})
+        table = build_table(weights, self.buckets) if enabled else ()
+        # One tuple, rebound in one step, so a concurrent route() never sees a half-built split
+        self._compiled = (enabled, weights, table)
+
+    @property
+    def enabled(self):
+        return self._compiled[0]
+
+    @property
+    def weights(self):
+        return self._compiled[1]
+
+    def route(self, key=None):
+        """Service for a request; key is the user_account_id when the request has one"""
+        enabled, _, table = self._compiled
+        if not enabled:
+            service, sticky = self.default, key is not None
+        elif key is None:
+            service, sticky = table[next(self._rotation) * ROTATION_STRIDE % len(table)], False
+        else:
+            service, sticky = table[zlib.crc32(str(key).encode()) % len(table)], True
+        with self._lock:
+            counts = self._counts.setdefault(service, {"sticky": 0, "unkeyed": 0})
+            counts["sticky" if sticky else "unkeyed"] += 1
+        return service
+
+    def shares(self):
+        """Fraction of the bucket table owned by each service"""
+        enabled, weights, table = self._compiled
+        if not enabled:
+            return {self.default: 1.0}
+        return {service: table.count(service) / len(table) for service in weights if service in table}
+
+    def stats(self):
+        with self._lock:
+            counts = {service: dict(c) for service, c in self._counts.items()}
+        return {
+            "enabled": self.enabled,
+            "buckets": len(self._compiled[2]),
+            "weights": self.weights,
+            "shares": self.shares(),
+            "decisions": counts
+        }
@@ -0,0 +1,177 @@
+"""
+Shadow-traffic mirroring between user service versions.
+
+After the gateway has answered a user read from the version the strangler
+routing picked (the primary), a sampled copy of the same request can be
+handed to ShadowMirror. It is put on a bounded queue without waiting
+(when the queue is full the copy is dropped and counted), and a small
+pool of worker threads replays it against the other version. The client
+never waits on the shadow call. Each replay is compared with the primary
+response (status code and JSON body) and the latency difference is
+recorded, per route and direction, with the most recent mismatches kept
+as samples.
+"""
+import queue
+import random
+import statistics
+import threading
+import time
+from collections import deque
+
+# How many latency deltas per route are kept for percentiles
+DELTA_SAMPLES = 500
+# How many recent mismatches are kept for inspection
+DIFF_SAMPLES = 20
+# Differing paths reported per mismatch
+MAX_DIFF_PATHS = 10
+
+
+def other_version(service):
+    return 'user_v2' if service == 'user_v1' else 'user_v1'
+
+
+def diff_paths(primary, shadow, path="", found=None):
+    """JSON paths where two decoded bodies differ (first MAX_DIFF_PATHS)"""
+    found = [] if found is None else found
+    if len(found) >= MAX_DIFF_PATHS:
+        return found
+    if isinstance(primary, dict) and isinstance(shadow, dict):
+        for key in sorted(set(primary) | set(shadow), key=str):
+            if key not in primary or key not in shadow:
+                found.append(f"{path}.{key}")
+            else:
+                diff_paths(primary[key], shadow[key], f"{path}.{key}", found)
+            if len(found) >= MAX_DIFF_PATHS:
+                break
+    elif isinstance(primary, list) and isinstance(shadow, list):
+        if len(primary) != len(shadow):
+            found.append(f"{path}[] length {len(primary)} != {len(shadow)}")
+        for i, (a, b) in enumerate(zip(primary, shadow)):
+            diff_paths(a, b, f"{path}[{i}]", found)
+            if len(found) >= MAX_DIFF_PATHS:
+                break
+    elif primary != shadow:
+        found.append(path or ".")
+    return found
+
+
+class ShadowMirror:
+    """Bounded, sampled, asynchronous replay of user reads against the other version"""
+
+    def __init__(self, send, enabled=False, sample_rate=0.1, queue_size=1000, workers=4, timeout=5):
+        # send(service, method, path, params, timeout) -> requests-style response
+        self.send = send
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._workers = []
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._diffs = deque(maxlen=DIFF_SAMPLES)
+        self.dropped = 0
+        self.configure(enabled, sample_rate, queue_size, workers, timeout)
+
+    def configure(self, enabled=False, sample_rate=0.1, queue_size=1000, workers=4, timeout=5):
+        """Apply new settings; extra workers are started, existing ones keep running"""
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.timeout = timeout
+        self._queue.maxsize = queue_size
+        if enabled:
+            while len(self._workers) < workers:
+                thread = threading.Thread(target=self._work, name=f'shadow-{len(self._workers)}', daemon=True)
+                thread.start()
+                self._workers.append(thread)
+
+    def submit(self, route, service, path, params, status, body, latency):
+        """Maybe queue a shadow replay of a primary read; never blocks"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return False
+        try:
+            self._queue.put_nowait((route, service, path, params, status, body, latency))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _route_stats(self, route, direction):
+        key = (route, direction)
+        stats = self._routes.get(key)
+        if stats is None:
+            stats = self._routes[key] = {
+                "mirrored": 0, "matches": 0, "status_mismatches": 0, "body_mismatches": 0, "errors": 0,
+                "primary_ms_total": 0.0, "shadow_ms_total": 0.0, "deltas": deque(maxlen=DELTA_SAMPLES)
+            }
+        return stats
+
+    def _work(self):
+        while True:
+            route, service, path, params, status, body, latency = self._queue.get()
+            shadow_service = other_version(service)
+            direction = f"{service}->{shadow_service}"
+            started = time.perf_counter()
+            try:
+                response = self.send(shadow_service, 'GET', path, params, self.timeout)
+                try:
+                    shadow_body = response.json()
+                except ValueError:
+                    shadow_body = response.text
+                # Timed like the primary: request through the parsed body
+                shadow_latency = time.perf_counter() - started
+            except Exception as e:
+                with self._lock:
+                    self._route_stats(route, direction)["errors"] += 1
+                    self._diffs.append({"route": route, "path": path, "direction": direction,
+                                        "error": str(e)[:200], "at": time.time()})
+                continue
+            finally:
+                self._queue.task_done()
+
+            paths = [] if response.status_code != status else diff_paths(body, shadow_body)
+            with self._lock:
+                stats = self._route_stats(route, direction)
+                stats["mirrored"] += 1
+                stats["primary_ms_total"] += latency * 1000
+                stats["shadow_ms_total"] += shadow_latency * 1000
+                stats["deltas"].append((shadow_latency - latency) * 1000)
+                if response.status_code != status:
+                    stats["status_mismatches"] += 1
+                elif paths:
+                    stats["body_mismatches"] += 1
+                else:
+                    stats["matches"] += 1
+                if response.status_code != status or paths:
+                    self._diffs.append({
+                        "route": route, "path": path, "direction": direction,
+                        "primary_status": status, "shadow_status": response.status_code,
+                        "differences": paths, "at": time.time()
+                    })
+
+    def stats(self):
+        """Per route and direction: outcomes, mean latencies and shadow-minus-primary deltas"""
+        with self._lock:
+            routes = {}
+            for (route, direction), stats in self._routes.items():
+                mirrored = stats["mirrored"]
+                deltas = sorted(stats["deltas"])
+                routes.setdefault(route, {})[direction] = {
+                    "mirrored": mirrored,
+                    "matches": stats["matches"],
+                    "status_mismatches": stats["status_mismatches"],
+                    "body_mismatches": stats["body_mismatches"],
+                    "errors": stats["errors"],
+                    "match_ratio": round(stats["matches"] / mirrored, 4) if mirrored else None,
+                    "primary_ms_avg": round(stats["primary_ms_total"] / mirrored, 1) if mirrored else None,
+                    "shadow_ms_avg": round(stats["shadow_ms_total"] / mirrored, 1) if mirrored else None,
+                    "delta_ms_p50": round(statistics.median(deltas), 1) if deltas else None,
+                    "delta_ms_p95": round(deltas[int(0.95 * (len(deltas) - 1))], 1) if deltas else None
+                }
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "queued": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "workers": len(self._workers),
+                "dropped": self.dropped,
+                "routes": routes,
+                "recent_differences": list(self._diffs)
+            }
@@ -0,0 +1,163 @@
+"""
+Single-flight coalescing of identical gateway reads.
+
+While one thread is fetching a key (route + query parameters), other
+threads asking for the same key wait for that fetch and reuse its result
+instead of sending their own upstream request. A burst of N identical
+GETs therefore costs the backend one query. The flight ends as soon as
+the fetch returns; the next request starts a new one. Followers that
+wait longer than wait_timeout give up and fetch on their own.
+
+do_async() is the same for coroutines on the async engine's event loop:
+followers await the leader's future instead of blocking a thread. Both
+share one set of settings and per-route stats.
+"""
+import asyncio
+import threading
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class _AsyncFlight:
+    __slots__ = ('future', 'waiters')
+
+    def __init__(self, future):
+        self.future = future   # resolves to (True, result), (False, error) or (None, None) if abandoned
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one call"""
+
+    def __init__(self, enabled=True, wait_timeout=30):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._async_flights = {}
+        self._stats = {}
+        self.configure(enabled, wait_timeout)
+
+    def configure(self, enabled=True, wait_timeout=30):
+        self.enabled = bool(enabled)
+        self.wait_timeout = wait_timeout
+
+    def _label_stats(self, label):
+        stats = self._stats.get(label)
+        if stats is None:
+            stats = self._stats[label] = {"flights": 0, "coalesced": 0, "max_waiters": 0, "wait_timeouts": 0}
+        return stats
+
+    def do(self, key, fn, label=None):
+        """
+        Return (result, shared): fn()'s result, computed by this thread
+        (shared=False) or by a concurrent call with the same key
+        (shared=True). An exception raised by the leading call is raised
+        in every follower as well.
+        """
+        if not self.enabled:
+            return fn(), False
+
+        with self._lock:
+            stats = self._label_stats(label)
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                stats["flights"] += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                stats["max_waiters"] = max(stats["max_waiters"], flight.waiters)
+                leader = False
+
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.done.set()
+            return flight.result, False
+
+        if not flight.done.wait(self.wait_timeout):
+            with self._lock:
+                stats["wait_timeouts"] += 1
+            return fn(), False
+        if flight.error is not None:
+            raise flight.error
+        with self._lock:
+            stats["coalesced"] += 1
+        return flight.result, True
+
+    async def do_async(self, key, fn, label=None):
+        """
+        do() for a coroutine function: return (await fn(), shared). If the
+        leading call is cancelled, its followers fetch on their own.
+        """
+        if not self.enabled:
+            return await fn(), False
+
+        with self._lock:
+            stats = self._label_stats(label)
+            flight = self._async_flights.get(key)
+            if flight is None:
+                flight = self._async_flights[key] = _AsyncFlight(asyncio.get_running_loop().create_future())
+                stats["flights"] += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                stats["max_waiters"] = max(stats["max_waiters"], flight.waiters)
+                leader = False
+
+        if leader:
+            outcome = (None, None)
+            try:
+                result = await fn()
+                outcome = (True, result)
+                return result, False
+            except Exception as e:
+                outcome = (False, e)
+                raise
+            finally:
+                with self._lock:
+                    self._async_flights.pop(key, None)
+                flight.future.set_result(outcome)
+
+        try:
+            completed, value = await asyncio.wait_for(asyncio.shield(flight.future), self.wait_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                stats["wait_timeouts"] += 1
+            return await fn(), False
+        if completed is None:
+            return await fn(), False
+        if not completed:
+            raise value
+        with self._lock:
+            stats["coalesced"] += 1
+        return value, True
+
+    def stats(self):
+        """Per-label flight and coalescing counters, plus flights in progress"""
+        with self._lock:
+            labels = {label: dict(stats) for label, stats in self._stats.items()}
+            in_flight = len(self._flights) + len(self._async_flights)
+        flights = sum(stats["flights"] for stats in labels.values())
+        coalesced = sum(stats["coalesced"] for stats in labels.values())
+        return {
+            "enabled": self.enabled,
+            "in_flight": in_flight,
+            "flights": flights,
+            "coalesced": coalesced,
+            "coalesced_ratio": round(coalesced / (flights + coalesced), 4) if flights + coalesced else 0.0,
+            "routes": labels
+        }
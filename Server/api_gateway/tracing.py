@@ -0,0 +1,413 @@
+"""
+Distributed tracing across the gateway, the user services, RabbitMQ and
+the order and event services.
+
+Trace context travels as a W3C `traceparent` header
+(00-<trace id>-<span id>-<flags>) on proxied HTTP requests and in the
+AMQP message headers of user events. The gateway starts a trace for every
+request (sampled at TRACE_SAMPLE_RATE) and each service records spans
+into it:
+
+- instrument(app) opens a server span per Flask request, continuing the
+  caller's trace when a traceparent header is present
+- client spans around the gateway's upstream calls carry the context on
+- mongo_listener() times Mongo commands issued inside a span
+- the user services' outbox stores the context with each event and
+  records the relay (outbox wait + publish) as a producer span; the
+  consumers record broker queueing and their own processing
+
+Finished spans are queued (dropped when the queue is full) and written by
+a background thread as JSON lines to TRACE_DIR/<service>-<pid>.jsonl
+and/or POSTed in batches to TRACE_COLLECTOR_URL. The gateway is the
+collector: POST /traces stores spans from the other services in its
+TRACE_DIR, and GET /traces/<trace_id> rebuilds one request's end-to-end
+timeline from every file there.
+
+Maintained in Server/shared/: edit it there and run sync_shared.py to
+update the copy in each service.
+"""
+import contextvars
+import glob
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from flask import g, request
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = 'traceparent'
+
+# Export batching and file rotation
+EXPORT_BATCH = 500
+EXPORT_INTERVAL = 1.0
+TRACE_FILE_BYTES = 16 * 1024 * 1024
+
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class SpanContext(namedtuple('SpanContext', 'trace_id span_id sampled')):
+    """Identifies one span within a trace"""
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value):
+    """SpanContext from a traceparent header value, or None if absent or malformed"""
+    if not value or not isinstance(value, str):
+        return None
+    parts = value.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    return SpanContext(parts[1], parts[2], bool(flags & 1))
+
+
+def _new_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """One timed operation; use as a context manager to make it the current span"""
+
+    __slots__ = ('tracer', 'name', 'context', 'parent_id', 'kind', 'start', 'attributes', 'error', '_token', '_ended')
+
+    def __init__(self, tracer, name, context, parent_id, kind, start, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start = start
+        self.attributes = attributes
+        self.error = None
+        self._token = None
+        self._ended = False
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def traceparent(self):
+        return self.context.traceparent()
+
+    def end(self, end=None, error=None):
+        if self._ended:
+            return
+        self._ended = True
+        if error is not None:
+            self.error = str(error)[:200]
+        if self.context.sampled:
+            self.tracer.export({
+                "trace_id": self.context.trace_id,
+                "span_id": self.context.span_id,
+                "parent_id": self.parent_id,
+                "service": self.tracer.service,
+                "name": self.name,
+                "kind": self.kind,
+                "start": self.start,
+                "duration_ms": round(((end or time.time()) - self.start) * 1000, 3),
+                "attributes": self.attributes,
+                "error": self.error
+            })
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.end(error=exc)
+        return False
+
+
+class Tracer:
+    """Creates spans for one service and exports the sampled ones in the background"""
+
+    def __init__(self, service, directory=None, collector_url=None, sample_rate=1.0, queue_size=10000):
+        self.service = service
+        self.directory = directory
+        self.collector_url = collector_url
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._write_lock = threading.Lock()
+        self._pending = {}   # Mongo command request_id -> (start, parent span)
+        self.stats = {"exported": 0, "dropped": 0, "export_errors": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, service, directory=None):
+        """Tracer configured by TRACE_DIR, TRACE_COLLECTOR_URL and TRACE_SAMPLE_RATE"""
+        return cls(
+            service,
+            directory=os.getenv('TRACE_DIR', directory),
+            collector_url=os.getenv('TRACE_COLLECTOR_URL'),
+            sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+        )
+
+    # Spans ----------------------------------
+
+    @staticmethod
+    def current():
+        """The span running in this thread/task, or None"""
+        return _current.get()
+
+    def traceparent(self):
+        """traceparent of the current span, or None outside a trace"""
+        span = _current.get()
+        return span.traceparent() if span is not None else None
+
+    def start_span(self, name, parent=None, kind='internal', start=None, **attributes):
+        """
+        Start a span under `parent` (a Span, a SpanContext or a traceparent
+        string); without one it continues the current span, or starts a
+        new (sampled) trace when there is none.
+        """
+        if parent is None:
+            parent = _current.get()
+        if isinstance(parent, str):
+            parent = parse_traceparent(parent)
+        if isinstance(parent, Span):
+            parent = parent.context
+        if parent is None:
+            context = SpanContext(_new_id(128), _new_id(64), random.random() < self.sample_rate)
+            parent_id = None
+        else:
+            context = SpanContext(parent.trace_id, _new_id(64), parent.sampled)
+            parent_id = parent.span_id
+        return Span(self, name, context, parent_id, kind, start if start is not None else time.time(), attributes)
+
+    def record(self, name, parent, start, end, kind='internal', **attributes):
+        """Export a span whose start and end are already known; returns it"""
+        span = self.start_span(name, parent=parent, kind=kind, start=start, **attributes)
+        span.end(end)
+        return span
+
+    def inject(self, headers, span=None):
+        """Add the traceparent of `span` (default: the current span) to a headers dict"""
+        span = span or _current.get()
+        if span is not None:
+            headers[TRACE_HEADER] = span.traceparent()
+        return headers
+
+    # Export ----------------------------------
+
+    def export(self, span):
+        if not (self.directory or self.collector_url):
+            return
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return
+        self.start()
+
+    def _file_path(self):
+        return os.path.join(self.directory, f"{self.service}-{os.getpid()}.jsonl")
+
+    def write_spans(self, spans):
+        """Append spans to this process's trace file, rotating it at TRACE_FILE_BYTES"""
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+        path = self._file_path()
+        with self._write_lock:
+            with open(path, 'a') as f:
+                f.write(lines)
+                size = f.tell()
+            if size > TRACE_FILE_BYTES:
+                os.replace(path, path + '.1')
+
+    def _flush(self, batch):
+        if self.directory:
+            try:
+                self.write_spans(batch)
+            except OSError as e:
+                self.stats["export_errors"] += 1
+                logger.error("Trace file export error: %s", e)
+        if self.collector_url:
+            try:
+                requests.post(self.collector_url, json={"spans": batch}, timeout=5)
+            except requests.exceptions.RequestException as e:
+                self.stats["export_errors"] += 1
+                logger.error("Trace collector export error: %s", e)
+        self.stats["exported"] += len(batch)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < EXPORT_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def start(self):
+        """Start the export thread (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    # Instrumentation ----------------------------------
+
+    def instrument(self, app, new_traces=False, exclude=()):
+        """
+        Open a server span for every request of a Flask app that carries a
+        traceparent header. With new_traces=True (the gateway) requests
+        without one start a new trace. Routes in `exclude` are not traced.
+        """
+
+        @app.before_request
+        def start_server_span():
+            rule = request.url_rule.rule if request.url_rule is not None else request.path
+            parent = parse_traceparent(request.headers.get(TRACE_HEADER))
+            if rule in exclude or (parent is None and not new_traces):
+                return
+            span = self.start_span(f"{request.method} {rule}", parent=parent, kind='server', path=request.path)
+            g.trace_span = span
+            g.trace_previous = _current.set(span)
+
+        @app.after_request
+        def tag_response(response):
+            span = g.get('trace_span')
+            if span is not None:
+                span.set('status', response.status_code)
+                response.headers[TRACE_HEADER] = span.traceparent()
+            return response
+
+        @app.teardown_request
+        def end_server_span(exc):
+            span = g.pop('trace_span', None)
+            if span is not None:
+                try:
+                    _current.reset(g.pop('trace_previous'))
+                except ValueError:
+                    _current.set(None)
+                span.end(error=exc)
+
+        return app
+
+    def mongo_listener(self):
+        """pymongo command listener that records commands run inside a span"""
+        return MongoCommandSpans(self)
+
+
+class MongoCommandSpans(monitoring.CommandListener):
+    """Records MongoDB commands as child spans of the current span"""
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def started(self, event):
+        parent = _current.get()
+        if parent is not None:
+            collection = event.command.get(event.command_name)
+            self.tracer._pending[event.request_id] = (
+                time.time(), parent, collection if isinstance(collection, str) else None
+            )
+
+    def _finish(self, event, error=None):
+        pending = self.tracer._pending.pop(event.request_id, None)
+        if pending is None:
+            return
+        start, parent, collection = pending
+        span = self.tracer.start_span(f"mongo {event.command_name}", parent=parent, kind='client',
+                                      start=start, database=event.database_name, collection=collection)
+        span.end(start + event.duration_micros / 1e6, error=error)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, error=event.failure)
+
+
+# Collector ----------------------------------
+
+def read_spans(directory, trace_id=None):
+    """Every exported span in a trace directory (optionally only one trace)"""
+    spans = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.jsonl*'))):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if trace_id is not None and trace_id not in line:
+                        continue
+                    try:
+                        span = json.loads(line)
+                    except ValueError:
+                        continue
+                    if trace_id is None or span.get("trace_id") == trace_id:
+                        spans.append(span)
+        except OSError:
+            continue
+    return spans
+
+
+def build_timeline(spans):
+    """Order one trace's spans by start time with offsets from the trace start and tree depth"""
+    if not spans:
+        return None
+    by_id = {span["span_id"]: span for span in spans}
+
+    def depth(span):
+        level, seen = 0, set()
+        while span.get("parent_id") in by_id and span["span_id"] not in seen:
+            seen.add(span["span_id"])
+            span = by_id[span["parent_id"]]
+            level += 1
+        return level
+
+    trace_start = min(span["start"] for span in spans)
+    trace_end = max(span["start"] + span["duration_ms"] / 1000 for span in spans)
+    ordered = sorted(spans, key=lambda span: (span["start"], depth(span)))
+    return {
+        "trace_id": spans[0]["trace_id"],
+        "started_at": trace_start,
+        "duration_ms": round((trace_end - trace_start) * 1000, 3),
+        "services": sorted({span["service"] for span in spans}),
+        "span_count": len(spans),
+        "spans": [{
+            "offset_ms": round((span["start"] - trace_start) * 1000, 3),
+            "duration_ms": span["duration_ms"],
+            "depth": depth(span),
+            "service": span["service"],
+            "name": span["name"],
+            "kind": span.get("kind"),
+            "span_id": span["span_id"],
+            "parent_id": span.get("parent_id"),
+            "attributes": span.get("attributes", {}),
+            "error": span.get("error")
+        } for span in ordered]
+    }
+
+
+def recent_traces(directory, limit=20):
+    """Newest root spans (one per trace) found in a trace directory"""
+    roots = [span for span in read_spans(directory) if span.get("parent_id") is None]
+    roots.sort(key=lambda span: span["start"], reverse=True)
+    return [{
+        "trace_id": span["trace_id"],
+        "service": span["service"],
+        "name": span["name"],
+        "started_at": span["start"],
+        "duration_ms": span["duration_ms"],
+        "status": span.get("attributes", {}).get("status")
+    } for span in roots[:limit]]
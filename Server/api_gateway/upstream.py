@@ -0,0 +1,137 @@
+"""
+Upstream connection pooling for the API Gateway.
+
+Each backend service (user_v1, user_v2, order, event) gets its own
+keep-alive requests.Session backed by a bounded urllib3 connection pool,
+shared by every gateway route in the worker. Pools that sit idle longer
+than idle_timeout are closed and rebuilt on the next request.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class UpstreamPool:
+    """Per-service pooled HTTP sessions with idle eviction"""
+
+    def __init__(self, pool_size=20, keep_alive=True, idle_timeout=60):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._stats = {}
+        self.configure(pool_size, keep_alive, idle_timeout)
+
+    def configure(self, pool_size=20, keep_alive=True, idle_timeout=60):
+        """Apply new pool settings; existing sessions are rebuilt lazily"""
+        with self._lock:
+            self.pool_size = int(pool_size)
+            self.keep_alive = bool(keep_alive)
+            self.idle_timeout = float(idle_timeout)
+            for service in list(self._sessions):
+                self._close_locked(service)
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=False
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def _service_stats(self, service):
+        stats = self._stats.get(service)
+        if stats is None:
+            stats = {
+                "requests": 0,
+                "errors": 0,
+                "in_flight": 0,
+                "sessions_created": 0,
+                "idle_evictions": 0,
+                "last_used": None
+            }
+            self._stats[service] = stats
+        return stats
+
+    def _close_locked(self, service):
+        entry = self._sessions.pop(service, None)
+        if entry is not None:
+            entry[0].close()
+
+    def _evict_idle_locked(self, now):
+        for service, (session, last_used) in list(self._sessions.items()):
+            if self._stats[service]["in_flight"] == 0 and now - last_used > self.idle_timeout:
+                self._close_locked(service)
+                self._stats[service]["idle_evictions"] += 1
+
+    def session(self, service):
+        """Return the pooled session for a service, creating it if needed"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle_locked(now)
+            stats = self._service_stats(service)
+            entry = self._sessions.get(service)
+            if entry is None:
+                entry = (self._new_session(), now)
+                stats["sessions_created"] += 1
+            self._sessions[service] = (entry[0], now)
+            stats["last_used"] = time.time()
+            return entry[0]
+
+    def request(self, service, method, url, **kwargs):
+        """Send a request to a backend service over its pooled session"""
+        session = self.session(service)
+        with self._lock:
+            stats = self._service_stats(service)
+            stats["requests"] += 1
+            stats["in_flight"] += 1
+        try:
+            return session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                stats["in_flight"] -= 1
+
+    def stats(self):
+        """Snapshot of pool settings and per-service connection counters"""
+        with self._lock:
+            services = {}
+            for service, stats in self._stats.items():
+                snapshot = dict(stats)
+                snapshot.update(self._connection_counts(service))
+                services[service] = snapshot
+            return {
+                "pool_size": self.pool_size,
+                "keep_alive": self.keep_alive,
+                "idle_timeout": self.idle_timeout,
+                "services": services
+            }
+
+    def _connection_counts(self, service):
+        entry = self._sessions.get(service)
+        counts = {"active": entry is not None, "connections_opened": 0, "idle_connections": 0}
+        if entry is None:
+            return counts
+        adapter = entry[0].get_adapter('http://')
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            counts["connections_opened"] += pool.num_connections
+            counts["idle_connections"] += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return counts
+
+    def close(self):
+        """Close every pooled session"""
+        with self._lock:
+            for service in list(self._sessions):
+                self._close_locked(service)
@@ -1,18 +1,88 @@
 import os
 from dotenv import load_dotenv
-from flask import Flask, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import json
+import logging
+import math
 import pika
 import threading
 import time
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
+from functools import partial
+from event_log import SegmentLog
+from event_store import EventStore
+from event_rates import EventRates
+from shared_stats import SharedEventStats
+from metrics import Metrics
+from tracing import Tracer
+from logs import StructuredLogging
 
 load_dotenv()
 
 app = Flask(__name__)
 
-# In-memory event log
-events_log = []
+# JSON logs written by a background thread (LOG_LEVEL, LOG_DEBUG_SAMPLE_RATE);
+# consumed events draw their own debug sample
+log_setup = StructuredLogging.from_env('event')
+log_setup.instrument(app)
+logger = logging.getLogger('event')
+
+# Request latency and RabbitMQ counters at /metrics. The consumer may run in
+# its own process (EVENT_ROLE=consumer), so logged-event counts are read from
+# the shared stats on scrape rather than counted by the web workers
+metrics = Metrics('event')
+metrics.instrument(app)
+metrics.describe('events_logged', 'gauge', "Events in the durable log since the last clear, by event type")
+metrics.describe('event_log_end_offset', 'gauge', "Offset the next logged event will get")
+
+# Request spans, plus broker queueing and log append spans for traced user events
+tracer = Tracer.from_env('event')
+tracer.instrument(app)
+
+# Durable event log on disk, shared by every process; one process is elected
+# to consume the queue and append to it, all of them read it
+EVENT_LOG_DIR = os.getenv('EVENT_LOG_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'event-log'))
+event_log = SegmentLog(
+    EVENT_LOG_DIR,
+    segment_bytes=int(os.getenv('EVENT_LOG_SEGMENT_BYTES', 16 * 1024 * 1024)),
+    flush_interval=float(os.getenv('EVENT_LOG_FLUSH_INTERVAL', 0.05)),
+    flush_batch=int(os.getenv('EVENT_LOG_FLUSH_BATCH', 500))
+)
+
+# Counts per event type and source, kept by the log writer in SQLite (WAL)
+# so every worker reports the same numbers
+event_stats = SharedEventStats(os.path.join(EVENT_LOG_DIR, 'event_stats.db'))
+
+# Process roles: "all" consumes and serves (python event.py), "web" only
+# serves and "consumer" only consumes (see gunicorn.conf.py)
+EVENT_ROLE = os.getenv('EVENT_ROLE', 'all')
+
+# Recent events in memory (bounded ring buffer indexed by event type),
+# filled from the durable log by each worker's follower thread
+events_log = EventStore(capacity=int(os.getenv('EVENT_STORE_CAPACITY', 10000)))
+
+# Rolling per-second/minute/hour rates and consumer lag, maintained by each
+# worker's follower as events arrive from the log
+event_rates = EventRates(max_keys=int(os.getenv('EVENT_RATES_MAX_KEYS', 100)))
+
+
+def event_metrics():
+    """Logged-event and consumed-message counts shared by every process (read on scrape)"""
+    for event_type, count in event_stats.counts()['by_type'].items():
+        yield 'events_logged', {'event_type': event_type}, count
+    yield 'event_log_end_offset', {}, event_log.end_offset()
+    # Counted by the consumer process, which does not serve /metrics
+    for queue, count in event_stats.consumer_counts().items():
+        yield 'rabbitmq_consumed_total', {'queue': queue}, count
+
+
+metrics.add_collector(event_metrics)
+
+
+# Unacked deliveries the consumer may hold while their batch waits for fsync
+CONSUMER_PREFETCH = int(os.getenv('EVENT_CONSUMER_PREFETCH', 500))
+FOLLOW_INTERVAL = float(os.getenv('EVENT_LOG_FOLLOW_INTERVAL', 0.2))
 
 
 def get_rabbitmq_connection():
@@ -20,7 +90,7 @@ def get_rabbitmq_connection():
     rabbitmq_url = os.getenv('RABBITMQ_URL')
     
     if not rabbitmq_url:
-        print("✗ RABBITMQ_URL not set")
+        logger.error("RABBITMQ_URL not set")
         return None
     
     try:
@@ -29,26 +99,42 @@ def get_rabbitmq_connection():
         params.connection_attempts = 3
         
         connection = pika.BlockingConnection(params)
-        print("✓ Connected to RabbitMQ (CloudAMQP)")
+        logger.info("Connected to RabbitMQ (CloudAMQP)")
         return connection
     except Exception as e:
-        print(f"✗ RabbitMQ Connection Error: {e}")
+        logger.error("RabbitMQ Connection Error: %s", e)
         return None
 
 
+def become_log_writer():
+    """Take the log writer role; the writer also keeps the shared counters current"""
+    if event_log.writer:
+        return True
+    if not event_log.acquire_writer():
+        return False
+    event_stats.catch_up(event_log)
+    event_log.add_listener(lambda durable_offset: event_stats.catch_up(event_log))
+    return True
+
+
 def start_event_subscriber():
     """Start RabbitMQ event subscriber in a separate thread"""
 
     def subscriber():
         while True:
             try:
+                if not become_log_writer():
+                    # Another process owns the log and consumes the queue; take over if it exits
+                    time.sleep(5)
+                    continue
+
                 rabbitmq_url = os.getenv('RABBITMQ_URL')
                 if not rabbitmq_url:
-                    print("✗ RABBITMQ_URL not set, cannot start subscriber")
+                    logger.error("RABBITMQ_URL not set, cannot start subscriber")
                     time.sleep(10)
                     continue
 
-                print("🔄 Event service connecting to RabbitMQ...")
+                logger.info("Event service connecting to RabbitMQ...")
 
                 params = pika.URLParameters(rabbitmq_url)
                 params.socket_timeout = 10
@@ -77,45 +163,126 @@ def start_event_subscriber():
                     routing_key='user.*'
                 )
 
-                print("✓ Event service subscribed to user.* events")
+                channel.basic_qos(prefetch_count=CONSUMER_PREFETCH)
+
+                logger.info("Event service subscribed to user.* events")
+
+                # (offset, delivery_tag) of events not yet fsynced; acked once durable
+                unacked = deque()
+                unacked_lock = threading.Lock()
+
+                def ack_durable(durable_offset):
+                    """Ack every delivery whose event the log has fsynced (runs on the flusher thread)"""
+                    last_tag = None
+                    with unacked_lock:
+                        while unacked and unacked[0][0] < durable_offset:
+                            last_tag = unacked.popleft()[1]
+                    if last_tag is not None:
+                        connection.add_callback_threadsafe(
+                            partial(channel.basic_ack, delivery_tag=last_tag, multiple=True)
+                        )
+
+                event_log.add_listener(ack_durable)
 
                 def callback(ch, method, properties, body):
                     """Log all incoming events"""
+                    received_at = time.time()
+                    log_setup.sample()
+                    headers = properties.headers or {}
                     try:
-                        event_data = json.loads(body.decode())
-                        routing_key = method.routing_key
-                        
-                        # Create event record
-                        event_record = {
-                            "timestamp": datetime.utcnow().isoformat(),
-                            "routing_key": routing_key,
-                            "event_type": event_data.get("event_type"),
-                            "source": event_data.get("source"),
-                            "data": event_data.get("data", {})
-                        }
-                        
-                        events_log.append(event_record)
-                        print(f" [x] Logged event: {routing_key} - {event_data.get('event_type')}")
-                        
+                        event_data = parse_event(body)
+                    except ValueError as e:
+                        # A malformed message would fail forever if requeued: drop it
+                        logger.error("Error processing event (dropped): %s", e)
                         ch.basic_ack(delivery_tag=method.delivery_tag)
-                        
-                    except Exception as e:
-                        print(f"Error processing event: {e}")
+                        return
+                    routing_key = method.routing_key
+
+                    # Create event record
+                    logged_at = datetime.now(timezone.utc)
+                    event_record = {
+                        "timestamp": logged_at.replace(tzinfo=None).isoformat(),
+                        "routing_key": routing_key,
+                        "event_type": event_data.get("event_type"),
+                        "source": event_data.get("source"),
+                        "data": event_data.get("data", {}),
+                        # Set by the user services' outbox relay when it publishes
+                        "published_at": header_time(headers.get("published_at"))
+                    }
+
+                    try:
+                        with unacked_lock:
+                            offset = event_log.append(event_record, timestamp=logged_at.timestamp())
+                            unacked.append((offset, method.delivery_tag))
+                    except Exception:
+                        # A storage error is usually transient: the redelivery appends it
+                        logger.exception("Error storing event (requeued)")
                         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                        return
+                    event_stats.consumed(queue_name)
+
+                    traceparent = headers.get("traceparent")
+                    if traceparent:
+                        if event_record["published_at"] is not None:
+                            tracer.record(f"rabbitmq queue {queue_name}", traceparent,
+                                          event_record["published_at"], received_at, kind='consumer')
+                        tracer.record("event log append", traceparent, received_at, time.time(), offset=offset)
+                    logger.debug("Logged event %s", routing_key,
+                                 extra={"event_type": event_record["event_type"], "offset": offset})
 
                 channel.basic_consume(queue=queue_name, on_message_callback=callback)
 
-                print("✓ Event service waiting for events...")
-                channel.start_consuming()
+                logger.info("Event service waiting for events...")
+                try:
+                    channel.start_consuming()
+                finally:
+                    # Unacked deliveries are redelivered on the next connection
+                    event_log.remove_listener(ack_durable)
 
             except Exception as e:
-                print(f"RabbitMQ subscriber error: {e}")
-                print("Retrying in 5 seconds...")
+                logger.error("RabbitMQ subscriber error: %s; retrying in 5 seconds", e)
                 time.sleep(5)
 
     thread = threading.Thread(target=subscriber, daemon=True)
     thread.start()
-    print("✓ Event service RabbitMQ subscriber thread started")
+    logger.info("Event service RabbitMQ subscriber thread started")
+    return thread
+
+
+def start_event_follower():
+    """Keep this worker's in-memory recent events in step with the durable log"""
+
+    def follow():
+        start = event_log.start_offset()
+        # Warm up with the newest events that fit in memory
+        position = max(start, event_log.end_offset() - events_log.capacity)
+        while True:
+            try:
+                log_start = event_log.start_offset()
+                if log_start != start:
+                    # Some worker cleared the log
+                    events_log.clear()
+                    event_rates.clear()
+                    start = log_start
+                    position = max(position, start)
+                for offset, record in event_log.iter_records(position):
+                    try:
+                        events_log.append(record)
+                        event_rates.record(
+                            record.get("event_type"),
+                            record.get("source"),
+                            logged_time(record),
+                            record.get("published_at")
+                        )
+                    finally:
+                        # A record that cannot be applied is skipped, not re-read every poll
+                        position = offset + 1
+            except Exception as e:
+                logger.error("Event log follower error: %s", e)
+            time.sleep(FOLLOW_INTERVAL)
+
+    thread = threading.Thread(target=follow, name='event-log-follower', daemon=True)
+    thread.start()
     return thread
 
 
@@ -128,18 +295,51 @@ def greetings():
 
 @app.route('/events', methods=['GET'])
 def get_all_events():
-    """Get all logged events"""
+    """
+    Get logged events from the durable log, oldest first. Optional filters:
+    - since / until: ISO-8601 (UTC unless an offset is given) or epoch
+      seconds; events logged at or after since and before until
+    - after: only events with a larger offset
+    - limit: page size (default DEFAULT_PAGE_SIZE, capped at MAX_PAGE_SIZE);
+      next_after is set when the page is full. /events/export streams
+      the whole range instead.
+    """
+    try:
+        start, end, limit = event_range(paged=True)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    events = event_log.read(start, end, limit)
+    next_after = events[-1]["offset"] if len(events) == limit else None
     return jsonify({
         "status": "success",
-        "count": len(events_log),
-        "events": events_log
+        "count": len(events),
+        "events": events,
+        "next_after": next_after
     })
 
 
+@app.route('/events/export', methods=['GET'])
+def export_events():
+    """Stream logged events as NDJSON straight from the log (same filters as /events)"""
+    try:
+        start, end, limit = event_range()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    def generate():
+        sent = 0
+        for _, record in event_log.iter_records(start, end):
+            if limit is not None and sent >= limit:
+                break
+            yield json.dumps(record) + "\n"
+            sent += 1
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.route('/events/type/<event_type>', methods=['GET'])
 def get_events_by_type(event_type):
-    """Get events filtered by type"""
-    filtered = [e for e in events_log if e.get("event_type") == event_type]
+    """Get recent events (up to EVENT_STORE_CAPACITY) filtered by type"""
+    filtered = events_log.by_type(event_type)
     return jsonify({
         "status": "success",
         "count": len(filtered),
@@ -152,37 +352,126 @@ def get_event_count():
     """Get count of all events"""
     return jsonify({
         "status": "success",
-        "total_events": len(events_log)
+        "total_events": event_log.count()
     })
 
 
 @app.route('/events/stats', methods=['GET'])
 def get_event_stats():
-    """Get event statistics by type"""
-    stats = {}
-    for event in events_log:
-        event_type = event.get("event_type", "unknown")
-        stats[event_type] = stats.get(event_type, 0) + 1
-    
+    """Get event statistics by type and source (shared by all workers) and log statistics"""
     return jsonify({
         "status": "success",
-        "total_events": len(events_log),
-        "by_type": stats
+        **event_stats.counts(),
+        "recent": events_log.stats(),
+        "log": event_log.stats()
+    })
+
+
+@app.route('/events/rates', methods=['GET'])
+def get_event_rates():
+    """
+    Get rolling event rates (last 60 seconds, 60 minutes and 24 hours)
+    overall, per event type and per source, plus consumer lag between the
+    outbox relay publishing an event and this service logging it.
+    Pass series=true for the per-bucket counts.
+    """
+    include_series = request.args.get('series', '').lower() in ('1', 'true', 'yes')
+    return jsonify({
+        "status": "success",
+        **event_rates.snapshot(include_series=include_series)
     })
 
 
 @app.route('/events/clear', methods=['DELETE'])
 def clear_events():
     """Clear all logged events"""
-    global events_log
-    count = len(events_log)
-    events_log = []
+    count = event_stats.clear(event_log)
+    events_log.clear()
     return jsonify({
         "status": "success",
         "message": f"Cleared {count} events"
     })
 
 
+# Query helpers --------------------------------
+
+def parse_time(value):
+    """Epoch seconds or ISO-8601 (naive values are UTC, like stored timestamps) -> epoch seconds"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def parse_event(body):
+    """
+    Decode a message body into an event object, or raise ValueError: it
+    must be a JSON object whose data (if any) is an object and whose
+    event_type and source are strings or missing
+    """
+    event = json.loads(body.decode())
+    if not isinstance(event, dict) or not isinstance(event.get("data", {}), dict):
+        raise ValueError("expected an object with object data")
+    for key in ("event_type", "source"):
+        if not isinstance(event.get(key), (str, type(None))):
+            raise ValueError(f"{key} is not a string")
+    return event
+
+
+def header_time(value):
+    """Epoch seconds from a producer-set header, or None if it is not a finite number"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def logged_time(record):
+    """Epoch seconds of a record's (naive UTC) timestamp"""
+    try:
+        return datetime.fromisoformat(record["timestamp"]).replace(tzinfo=timezone.utc).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+
+
+def event_range(paged=False):
+    """
+    (start offset, end offset, limit) from the since/until/after/limit
+    query parameters; paged=True always returns a limit (a page)
+    """
+    start = end = limit = None
+    if request.args.get('after') is not None:
+        try:
+            start = int(request.args['after']) + 1
+        except ValueError:
+            raise ValueError("after must be an integer offset")
+    if request.args.get('since'):
+        since = event_log.offset_for_time(parse_time(request.args['since']))
+        start = since if start is None else max(start, since)
+    if request.args.get('until'):
+        end = event_log.offset_for_time(parse_time(request.args['until']))
+    if request.args.get('limit') is not None:
+        try:
+            limit = max(int(request.args['limit']), 1)
+        except ValueError:
+            raise ValueError("limit must be an integer")
+    if paged:
+        limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    return start, end, limit
+
+
 @app.route('/rabbitmq/status', methods=['GET'])
 def rabbitmq_status():
     """Check RabbitMQ connection status"""
@@ -222,8 +511,12 @@ print("=" * 50)
 print("Event Service STARTING")
 print("=" * 50)
 
-# Start the RabbitMQ subscriber thread when module loads
-start_event_subscriber()
+# Start the RabbitMQ subscriber thread when module loads (unless a
+# dedicated consumer process owns it) and follow the log when serving
+if EVENT_ROLE in ('all', 'consumer'):
+    subscriber_thread = start_event_subscriber()
+if EVENT_ROLE in ('all', 'web'):
+    start_event_follower()
 
 
 if __name__ == '__main__':
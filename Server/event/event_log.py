@@ -0,0 +1,404 @@
+"""
+Durable append-only segment log for consumed events.
+
+Events are stored as JSON lines in segment files named after the offset
+of their first event (00000000000000000000.log, ...). Next to each
+segment, a dense offset index (.index) holds one 8-byte file position
+per event, so any offset is found with a bisect over segment bases and
+one index lookup. A dense time index (.timeindex) holds each event's
+timestamp in milliseconds, kept non-decreasing (a clock step backwards
+is recorded as the previous high-water mark), so the first offset at or
+after a time is a binary search. A new segment is started once the
+active one reaches segment_bytes.
+
+Only one process writes: acquire_writer() takes an exclusive flock on
+writer.lock, then recovers the active segment by cutting any torn tail.
+append() only queues the event and assigns its offset. A flusher thread
+writes queued events in batches and fsyncs each batch once (group
+commit), then tells listeners how far the log is durable. The offset
+index is written after the data and time index, so any offset present in
+it is readable.
+
+Every process can read: segments are memory-mapped and re-mapped as they
+grow, so history is served from the page cache rather than kept in RAM.
+clear() does not delete anything in place. It moves the log start offset
+(stored atomically in the start_offset file), which all readers honour;
+the writer then deletes segments that lie entirely before it.
+"""
+import bisect
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+POSITION = struct.Struct('>Q')
+TIMESTAMP = struct.Struct('>Q')
+
+# Events decoded per read-lock hold while iterating
+READ_CHUNK = 1000
+
+
+class SegmentLog:
+    """Segmented, indexed, fsync-batched event log shared through the filesystem"""
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, flush_interval=0.05, flush_batch=500):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        os.makedirs(directory, exist_ok=True)
+
+        self.writer = False
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = []            # (encoded event, timestamp ms) not yet written
+        self._last_timestamp = 0      # time index high-water mark (writer)
+        self._next_offset = 0         # offset of the next appended event (writer)
+        self._durable_offset = 0      # events below this offset are fsynced (writer)
+        self._active = None           # [base, log, time index, offset index, size] of the writer's segment
+        self._listeners = []
+        self._flusher = None
+
+        self._read_lock = threading.Lock()
+        self._bases = []
+        self._maps = {}               # base -> (log mmap, index mmap, time index mmap, log size, index size)
+        self.stats_counters = {"appended": 0, "flushes": 0, "fsynced": 0, "segments_rolled": 0}
+
+    # Paths and log start --------------------------------
+
+    def _path(self, base, suffix):
+        return os.path.join(self.directory, f"{base:020d}.{suffix}")
+
+    def _list_bases(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                      if name.endswith('.log') and name[:-4].isdigit())
+
+    def start_offset(self):
+        """First offset that has not been cleared"""
+        try:
+            with open(os.path.join(self.directory, 'start_offset')) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_start_offset(self, offset):
+        path = os.path.join(self.directory, 'start_offset')
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    # Writer --------------------------------
+
+    def acquire_writer(self):
+        """Become the single writer if no other process holds writer.lock"""
+        if self.writer:
+            return True
+        lock_file = open(os.path.join(self.directory, 'writer.lock'), 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self._recover()
+        self.writer = True
+        self._flusher = threading.Thread(target=self._flush_loop, name='event-log-flusher', daemon=True)
+        self._flusher.start()
+        logger.info("Event log writer for %s (next offset %d)", self.directory, self._next_offset)
+        return True
+
+    def _recover(self):
+        """Open the last segment for appending, cutting a record the previous writer left half-written"""
+        bases = self._list_bases()
+        base = bases[-1] if bases else self.start_offset()
+        for suffix in ('log', 'timeindex', 'index'):
+            with open(self._path(base, suffix), 'ab'):
+                pass
+        log_size = os.path.getsize(self._path(base, 'log'))
+        count = min(os.path.getsize(self._path(base, 'index')) // POSITION.size,
+                    os.path.getsize(self._path(base, 'timeindex')) // TIMESTAMP.size)
+        end = 0
+        with open(self._path(base, 'log'), 'rb') as log, open(self._path(base, 'index'), 'rb') as index:
+            while count:
+                index.seek((count - 1) * POSITION.size)
+                position = POSITION.unpack(index.read(POSITION.size))[0]
+                log.seek(position)
+                line = log.readline()
+                if position < log_size and line.endswith(b'\n'):
+                    end = position + len(line)
+                    break
+                count -= 1
+        os.truncate(self._path(base, 'index'), count * POSITION.size)
+        os.truncate(self._path(base, 'timeindex'), count * TIMESTAMP.size)
+        os.truncate(self._path(base, 'log'), end)
+        if count:
+            with open(self._path(base, 'timeindex'), 'rb') as times:
+                times.seek((count - 1) * TIMESTAMP.size)
+                self._last_timestamp = TIMESTAMP.unpack(times.read(TIMESTAMP.size))[0]
+        self._open_active(base, end)
+        self._next_offset = self._durable_offset = base + count
+
+    def _open_active(self, base, size):
+        self._active = [base] + [open(self._path(base, suffix), 'ab')
+                                 for suffix in ('log', 'timeindex', 'index')] + [size]
+
+    def add_listener(self, listener):
+        """listener(durable_offset) is called from the flusher after every fsynced batch"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def append(self, record, timestamp=None):
+        """Queue one event (timestamp in epoch seconds, default now) for the next flush; returns its offset"""
+        if not self.writer:
+            raise RuntimeError("Event log is read-only in this process")
+        encoded = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+        timestamp_ms = int((time.time() if timestamp is None else timestamp) * 1000)
+        with self._lock:
+            offset = self._next_offset
+            self._last_timestamp = max(self._last_timestamp, timestamp_ms)
+            self._pending.append((encoded, self._last_timestamp))
+            self._next_offset += 1
+            if len(self._pending) >= self.flush_batch:
+                self._wakeup.set()
+        return offset
+
+    def flush(self):
+        """Write and fsync everything queued so far; returns the durable offset"""
+        with self._flush_lock:
+            return self._flush_locked()
+
+    def _flush_locked(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            base, log, times, index, size = self._active
+            first = self._durable_offset
+            data, timestamps, positions = bytearray(), bytearray(), bytearray()
+            for i, (encoded, timestamp_ms) in enumerate(batch):
+                if size >= self.segment_bytes and positions:
+                    # Close out the current segment before starting the next one
+                    self._write_segment(data, timestamps, positions)
+                    data, timestamps, positions = bytearray(), bytearray(), bytearray()
+                if size >= self.segment_bytes:
+                    self._roll(first + i)
+                    base, log, times, index, size = self._active
+                positions += POSITION.pack(size)
+                timestamps += TIMESTAMP.pack(timestamp_ms)
+                data += encoded
+                size += len(encoded)
+            self._write_segment(data, timestamps, positions)
+            self._active[4] = size
+            self._durable_offset = first + len(batch)
+            self.stats_counters["appended"] += len(batch)
+            self.stats_counters["flushes"] += 1
+            for listener in list(self._listeners):
+                try:
+                    listener(self._durable_offset)
+                except Exception as e:
+                    logger.error("Event log listener error: %s", e)
+        return self._durable_offset
+
+    def _write_segment(self, data, timestamps, positions):
+        # Data and timestamps first, then offsets: readers treat the offset index as the end of the log
+        files = self._active[1:4]
+        for f, chunk in zip(files, (data, timestamps, positions)):
+            f.write(chunk)
+            f.flush()
+        for f in files:
+            os.fsync(f.fileno())
+        self.stats_counters["fsynced"] += 1
+
+    def _roll(self, base):
+        for f in self._active[1:4]:
+            f.close()
+        self._open_active(base, 0)
+        self.stats_counters["segments_rolled"] += 1
+        self._delete_cleared_segments()
+
+    def _delete_cleared_segments(self):
+        """Remove sealed segments that lie entirely before the log start"""
+        start = self.start_offset()
+        bases = self._list_bases()
+        for base, next_base in zip(bases, bases[1:]):
+            if next_base <= start and base != self._active[0]:
+                for suffix in ('log', 'timeindex', 'index'):
+                    try:
+                        os.remove(self._path(base, suffix))
+                    except FileNotFoundError:
+                        pass
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Event log flush error: %s", e)
+                time.sleep(1)
+
+    # Readers --------------------------------
+
+    def _segment_map(self, base):
+        """mmaps of one segment, re-mapped if the files grew since the last read"""
+        # Offset index first: every entry it holds points at data and timestamps already written
+        index_size = os.path.getsize(self._path(base, 'index'))
+        index_size -= index_size % POSITION.size
+        log_size = os.path.getsize(self._path(base, 'log'))
+        cached = self._maps.get(base)
+        if cached and cached[3] == log_size and cached[4] == index_size:
+            return cached
+        if cached:
+            self._close_maps(cached)
+        count = index_size // POSITION.size
+        maps = []
+        for suffix, size in (('log', log_size), ('index', index_size), ('timeindex', count * TIMESTAMP.size)):
+            if size:
+                with open(self._path(base, suffix), 'rb') as f:
+                    maps.append(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ))
+            else:
+                maps.append(None)
+        entry = (maps[0], maps[1], maps[2], log_size, index_size)
+        self._maps[base] = entry
+        return entry
+
+    @staticmethod
+    def _close_maps(entry):
+        for m in entry[:3]:
+            if m is not None:
+                m.close()
+
+    def _refresh_locked(self):
+        self._bases = self._list_bases()
+        for base in list(self._maps):
+            if base not in self._bases:
+                self._close_maps(self._maps.pop(base))
+
+    def end_offset(self):
+        """Offset after the last event visible to readers"""
+        with self._read_lock:
+            self._refresh_locked()
+            if not self._bases:
+                return self.start_offset()
+            base = self._bases[-1]
+            return base + os.path.getsize(self._path(base, 'index')) // POSITION.size
+
+    def read(self, start=None, end=None, limit=None):
+        """Events with offsets in [start, end), oldest first, each with its "offset" added"""
+        records = []
+        for offset, record in self.iter_records(start, end):
+            records.append(record)
+            if limit is not None and len(records) >= limit:
+                break
+        return records
+
+    def iter_records(self, start=None, end=None):
+        """Yield (offset, event) for offsets in [start, end), reading segments through mmap"""
+        log_start = self.start_offset()
+        start = log_start if start is None else max(start, log_start)
+        end = self.end_offset() if end is None else min(end, self.end_offset())
+        offset = start
+        while offset < end:
+            with self._read_lock:
+                i = bisect.bisect_right(self._bases, offset) - 1
+                if i < 0:
+                    if not self._bases:
+                        return
+                    offset = self._bases[0]
+                    continue
+                base = self._bases[i]
+                try:
+                    log_map, index_map, _, _, index_size = self._segment_map(base)
+                except FileNotFoundError:
+                    # Deleted by the writer after a clear
+                    self._refresh_locked()
+                    offset = max(offset, self.start_offset())
+                    continue
+                count = index_size // POSITION.size
+                stop = min(end, base + count, offset + READ_CHUNK)
+                batch = []
+                for current in range(offset, stop):
+                    slot = current - base
+                    position = POSITION.unpack_from(index_map, slot * POSITION.size)[0]
+                    if slot + 1 < count:
+                        next_position = POSITION.unpack_from(index_map, (slot + 1) * POSITION.size)[0]
+                    else:
+                        next_position = log_map.find(b'\n', position) + 1
+                    record = json.loads(log_map[position:next_position])
+                    record["offset"] = current
+                    batch.append((current, record))
+            yield from batch
+            if stop == offset:
+                if i + 1 >= len(self._bases):
+                    return
+                stop = self._bases[i + 1]
+            offset = stop
+
+    def offset_for_time(self, timestamp):
+        """First offset whose event was logged at or after timestamp (epoch seconds)"""
+        timestamp_ms = int(timestamp * 1000)
+        start = self.start_offset()
+        with self._read_lock:
+            self._refresh_locked()
+            for base in self._bases:
+                try:
+                    _, _, time_map, _, index_size = self._segment_map(base)
+                except FileNotFoundError:
+                    continue
+                count = index_size // POSITION.size
+                if not count or TIMESTAMP.unpack_from(time_map, (count - 1) * TIMESTAMP.size)[0] < timestamp_ms:
+                    continue
+                low, high = 0, count - 1
+                while low < high:
+                    middle = (low + high) // 2
+                    if TIMESTAMP.unpack_from(time_map, middle * TIMESTAMP.size)[0] < timestamp_ms:
+                        low = middle + 1
+                    else:
+                        high = middle
+                return max(start, base + low)
+        return max(start, self.end_offset())
+
+    def count(self):
+        """Events between the log start and the end of the log"""
+        return max(0, self.end_offset() - self.start_offset())
+
+    def clear(self):
+        """Move the log start past every event written so far; returns how many were cleared"""
+        end = self.end_offset()
+        if self.writer:
+            with self._lock:
+                end = self._next_offset
+        cleared = max(0, end - self.start_offset())
+        self._write_start_offset(end)
+        return cleared
+
+    def stats(self):
+        """Offsets, segment count and writer counters"""
+        end = self.end_offset()
+        with self._read_lock:
+            segments = len(self._bases)
+        stats = {
+            "start_offset": self.start_offset(),
+            "end_offset": end,
+            "segments": segments,
+            "writer": self.writer
+        }
+        if self.writer:
+            with self._lock:
+                stats["pending"] = len(self._pending)
+            stats.update(self.stats_counters)
+        return stats
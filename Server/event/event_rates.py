@@ -0,0 +1,173 @@
+"""
+Rolling event-rate counters for the event service.
+
+Each counter is a fixed-size circular array of time buckets (60 one-second
+buckets, 60 one-minute buckets, 24 one-hour buckets). A bucket is reset
+lazily when its slot is reused for a newer period, so recording an event
+is O(1) per window and memory never grows. Rates are kept overall, per
+event_type and per source; only the first max_keys distinct types and
+sources get their own counters, later ones are counted under "other" so
+a producer inventing names cannot grow the tables. Consumer lag (time between the outbox relay
+publishing an event and the event service logging it) is kept in
+one-second buckets of (count, sum, max) over the last minute.
+"""
+import math
+import threading
+import time
+
+# name -> (bucket width in seconds, number of buckets)
+WINDOWS = {
+    "second": (1, 60),
+    "minute": (60, 60),
+    "hour": (3600, 24)
+}
+
+# Key the types and sources beyond max_keys are counted under
+OTHER = "other"
+
+
+class RateWindow:
+    """Event counts in `slots` consecutive buckets of `width` seconds"""
+
+    def __init__(self, width, slots):
+        self.width = width
+        self.slots = slots
+        self.counts = [0] * slots
+        self.buckets = [-1] * slots   # which period each slot currently holds
+
+    def add(self, timestamp, count=1):
+        bucket = int(timestamp // self.width)
+        slot = bucket % self.slots
+        if self.buckets[slot] != bucket:
+            if self.buckets[slot] > bucket:
+                # Older than the period already in this slot: outside the window
+                return
+            self.buckets[slot] = bucket
+            self.counts[slot] = 0
+        self.counts[slot] += count
+
+    def series(self, now):
+        """Counts of the last `slots` periods, oldest first (current period last)"""
+        current = int(now // self.width)
+        return [self.counts[bucket % self.slots] if self.buckets[bucket % self.slots] == bucket else 0
+                for bucket in range(current - self.slots + 1, current + 1)]
+
+    def summary(self, now, include_series=False):
+        series = self.series(now)
+        summary = {
+            "current": series[-1],
+            "previous": series[-2] if self.slots > 1 else 0,
+            "total": sum(series),
+            "per_second": round(sum(series[:-1]) / (self.width * (self.slots - 1)), 3) if self.slots > 1 else 0
+        }
+        if include_series:
+            summary["series"] = series
+        return summary
+
+
+class LagWindow:
+    """Count, sum and max of lag samples in one-second buckets over the last minute"""
+
+    def __init__(self, slots=60):
+        self.slots = slots
+        self.buckets = [-1] * slots
+        self.counts = [0] * slots
+        self.sums = [0.0] * slots
+        self.maxima = [0.0] * slots
+        self.last = None
+
+    def add(self, timestamp, lag):
+        bucket = int(timestamp)
+        slot = bucket % self.slots
+        if self.buckets[slot] != bucket:
+            if self.buckets[slot] > bucket:
+                return
+            self.buckets[slot] = bucket
+            self.counts[slot] = 0
+            self.sums[slot] = 0.0
+            self.maxima[slot] = 0.0
+        self.counts[slot] += 1
+        self.sums[slot] += lag
+        self.maxima[slot] = max(self.maxima[slot], lag)
+        self.last = lag
+
+    def summary(self, now):
+        current = int(now)
+        live = [bucket % self.slots for bucket in range(current - self.slots + 1, current + 1)
+                if self.buckets[bucket % self.slots] == bucket]
+        samples = sum(self.counts[slot] for slot in live)
+        return {
+            "window_seconds": self.slots,
+            "samples": samples,
+            "avg_ms": round(sum(self.sums[slot] for slot in live) / samples * 1000, 1) if samples else None,
+            "max_ms": round(max(self.maxima[slot] for slot in live) * 1000, 1) if samples else None,
+            "last_ms": round(self.last * 1000, 1) if self.last is not None else None
+        }
+
+
+class EventRates:
+    """Per-second/minute/hour event rates overall, per event_type and per source, plus consumer lag"""
+
+    def __init__(self, max_keys=100):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._reset()
+
+    @staticmethod
+    def _windows():
+        return {name: RateWindow(width, slots) for name, (width, slots) in WINDOWS.items()}
+
+    def _reset(self):
+        self._all = self._windows()
+        self._by_type = {}
+        self._by_source = {}
+        self._lag = LagWindow()
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _keyed(self, table, key):
+        """Windows for key, folded into OTHER once the table holds max_keys keys"""
+        windows = table.get(key)
+        if windows is None:
+            if len(table) - (OTHER in table) >= self.max_keys:
+                key = OTHER
+            windows = table.setdefault(key, self._windows())
+        return windows
+
+    def record(self, event_type, source, timestamp, published_at=None):
+        """
+        Count one event logged at `timestamp` (epoch seconds). event_type,
+        source and published_at come from producers as-is: keys that are
+        not strings count as "unknown" and a published_at that is not a
+        finite number gives no lag sample
+        """
+        try:
+            published_at = float(published_at)
+        except (TypeError, ValueError):
+            published_at = None
+        with self._lock:
+            for windows in (self._all,
+                            self._keyed(self._by_type, event_type if isinstance(event_type, str) and event_type else "unknown"),
+                            self._keyed(self._by_source, source if isinstance(source, str) and source else "unknown")):
+                for window in windows.values():
+                    window.add(timestamp)
+            if published_at is not None and math.isfinite(published_at):
+                self._lag.add(timestamp, max(0.0, timestamp - published_at))
+
+    def snapshot(self, now=None, include_series=False):
+        now = time.time() if now is None else now
+
+        def summarize(windows):
+            return {name: window.summary(now, include_series) for name, window in windows.items()}
+
+        with self._lock:
+            return {
+                "windows": {name: {"bucket_seconds": width, "buckets": slots}
+                            for name, (width, slots) in WINDOWS.items()},
+                "all": summarize(self._all),
+                "by_type": {key: summarize(windows) for key, windows in self._by_type.items()},
+                "by_source": {key: summarize(windows) for key, windows in self._by_source.items()},
+                "lag": self._lag.summary(now)
+            }
@@ -0,0 +1,93 @@
+"""
+Bounded in-memory event store for the event service.
+
+Events live in a fixed-size ring buffer; once it is full each new event
+overwrites the oldest one. Every event gets a sequence number, and a
+per-type index keeps the sequence numbers of each event type in arrival
+order, so a type query touches only matching events. Per-type counts are
+maintained on append and eviction, so counts and stats are O(1) (O(types)
+for the breakdown) instead of rescanning the log.
+"""
+import threading
+from collections import deque
+
+
+class EventStore:
+    """Ring buffer of event records with a per-type index and counters"""
+
+    def __init__(self, capacity=10000):
+        self.capacity = max(1, int(capacity))
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._slots = [None] * self.capacity
+        self._next_seq = 0            # sequence number of the next event
+        self._by_type = {}            # event_type -> deque of sequence numbers
+        self._counts = {}             # event_type -> events currently stored
+        self.received = 0             # events appended since start/clear
+        self.evicted = 0              # events overwritten by newer ones
+
+    def _oldest_seq(self):
+        return max(0, self._next_seq - self.capacity)
+
+    def append(self, record):
+        """Store one event record, evicting the oldest when full"""
+        event_type = record.get("event_type")
+        with self._lock:
+            seq = self._next_seq
+            slot = seq % self.capacity
+            old = self._slots[slot]
+            if old is not None:
+                old_type = old.get("event_type")
+                # The evicted event is always the oldest of its type
+                self._by_type[old_type].popleft()
+                self._counts[old_type] -= 1
+                if not self._counts[old_type]:
+                    del self._counts[old_type]
+                    del self._by_type[old_type]
+                self.evicted += 1
+            self._slots[slot] = record
+            self._by_type.setdefault(event_type, deque()).append(seq)
+            self._counts[event_type] = self._counts.get(event_type, 0) + 1
+            self._next_seq = seq + 1
+            self.received += 1
+        return seq
+
+    def all(self):
+        """Stored events, oldest first"""
+        with self._lock:
+            return [self._slots[seq % self.capacity]
+                    for seq in range(self._oldest_seq(), self._next_seq)]
+
+    def by_type(self, event_type):
+        """Stored events of one type, oldest first"""
+        with self._lock:
+            return [self._slots[seq % self.capacity]
+                    for seq in self._by_type.get(event_type, ())]
+
+    def count(self, event_type=None):
+        """Number of stored events, overall or of one type"""
+        with self._lock:
+            if event_type is None:
+                return self._next_seq - self._oldest_seq()
+            return self._counts.get(event_type, 0)
+
+    def stats(self):
+        """Stored events per type plus ring-buffer counters"""
+        with self._lock:
+            return {
+                "total_events": self._next_seq - self._oldest_seq(),
+                "by_type": {(event_type or "unknown"): count
+                            for event_type, count in self._counts.items()},
+                "capacity": self.capacity,
+                "received": self.received,
+                "evicted": self.evicted
+            }
+
+    def clear(self):
+        """Drop every stored event; returns how many were stored"""
+        with self._lock:
+            count = self._next_seq - self._oldest_seq()
+            self._reset()
+            return count
@@ -0,0 +1,55 @@
+"""
+Gunicorn settings for the event service.
+
+Workers only serve HTTP (EVENT_ROLE=web) and read the shared event log
+and counters. The queue is consumed by one dedicated consumer process
+that the master starts once it is ready and restarts if it exits, so
+adding workers scales reads without adding consumers.
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+bind = "0.0.0.0:5003"
+workers = int(os.getenv('EVENT_WORKERS', 2))
+timeout = 120
+
+# Inherited by the workers the master forks
+os.environ.setdefault('EVENT_ROLE', 'web')
+
+CONSUMER_COMMAND = [sys.executable, '-c', 'import event; event.subscriber_thread.join()']
+
+consumer = None
+stopping = threading.Event()
+
+
+def supervise_consumer(log):
+    global consumer
+    while not stopping.is_set():
+        consumer = subprocess.Popen(
+            CONSUMER_COMMAND,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=dict(os.environ, EVENT_ROLE='consumer'),
+            start_new_session=True
+        )
+        log.info("Started event consumer process %s", consumer.pid)
+        exit_code = consumer.wait()
+        if not stopping.is_set():
+            log.warning("Event consumer process exited (%s), restarting in 5 seconds", exit_code)
+            time.sleep(5)
+
+
+def when_ready(server):
+    threading.Thread(target=supervise_consumer, args=(server.log,), name='event-consumer-supervisor', daemon=True).start()
+
+
+def on_exit(server):
+    stopping.set()
+    if consumer is not None and consumer.poll() is None:
+        consumer.terminate()
+        try:
+            consumer.wait(5)
+        except subprocess.TimeoutExpired:
+            consumer.kill()
@@ -0,0 +1,148 @@
+"""
+Event counters shared by every event-service process.
+
+Counts per event type and per source live in a SQLite database in WAL
+mode next to the event log, so all gunicorn workers read the same
+numbers (WAL readers never block the writer). The process that writes
+the log calls catch_up() after each fsynced batch: it counts the events
+between the last applied offset and the end of the log and commits the
+new counts together with that offset, so a crash or restart recounts
+nothing twice and misses nothing. clear() resets the counts and moves
+the log start in one write transaction, which serializes it with
+catch_up().
+
+The consumer also counts the messages it takes off each queue with
+consumed(); the counts are held in memory and committed by the next
+catch_up(), so the web workers can expose rabbitmq_consumed_total
+without the consumer process serving /metrics itself.
+"""
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS event_counts (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS consumer_counts (
+    queue TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class SharedEventStats:
+    """Per-type and per-source event counts in a shared SQLite (WAL) database"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        self._consumed = {}   # queue -> messages not yet committed
+        self._consumed_lock = threading.Lock()
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connection(self):
+        # sqlite3 connections are per thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _write(self, work):
+        """Run work(connection) in an immediate (write-locked) transaction"""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(connection)
+            connection.execute("COMMIT")
+            return result
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def consumed(self, queue, count=1):
+        """Count messages consumed from queue; committed by the next catch_up()"""
+        with self._consumed_lock:
+            self._consumed[queue] = self._consumed.get(queue, 0) + count
+
+    def _take_consumed(self):
+        with self._consumed_lock:
+            consumed, self._consumed = self._consumed, {}
+        return consumed
+
+    def catch_up(self, event_log):
+        """Count events logged since the last call; returns how many were counted"""
+        consumed = self._take_consumed()
+
+        def work(connection):
+            connection.executemany(
+                "INSERT INTO consumer_counts (queue, count) VALUES (?, ?) "
+                "ON CONFLICT (queue) DO UPDATE SET count = count + excluded.count",
+                list(consumed.items())
+            )
+            row = connection.execute("SELECT value FROM meta WHERE name = 'applied_offset'").fetchone()
+            start = max(row[0] if row else 0, event_log.start_offset())
+            end = event_log.end_offset()
+            if end <= start:
+                return 0
+            deltas = {}
+            for _, record in event_log.iter_records(start, end):
+                for kind in ('event_type', 'source'):
+                    key = (kind, str(record.get(kind) or "unknown"))
+                    deltas[key] = deltas.get(key, 0) + 1
+            connection.executemany(
+                "INSERT INTO event_counts (kind, key, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (kind, key) DO UPDATE SET count = count + excluded.count",
+                [(kind, key, count) for (kind, key), count in deltas.items()]
+            )
+            connection.execute(
+                "INSERT INTO meta (name, value) VALUES ('applied_offset', ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+                (end,)
+            )
+            return end - start
+
+        try:
+            return self._write(work)
+        except Exception:
+            # Keep the consumed counts for the next attempt
+            for queue, count in consumed.items():
+                self.consumed(queue, count)
+            raise
+
+    def clear(self, event_log):
+        """Clear the log and reset the counts together; returns how many events were cleared"""
+
+        def work(connection):
+            cleared = event_log.clear()
+            connection.execute("DELETE FROM event_counts")
+            return cleared
+
+        return self._write(work)
+
+    def counts(self):
+        """{"by_type": {...}, "by_source": {...}, "total_events": n} as last committed"""
+        rows = self._connection().execute("SELECT kind, key, count FROM event_counts").fetchall()
+        by_type = {key: count for kind, key, count in rows if kind == 'event_type'}
+        by_source = {key: count for kind, key, count in rows if kind == 'source'}
+        return {
+            "total_events": sum(by_type.values()),
+            "by_type": by_type,
+            "by_source": by_source
+        }
+
+    def consumer_counts(self):
+        """{queue: messages consumed} as last committed"""
+        return dict(self._connection().execute("SELECT queue, count FROM consumer_counts").fetchall())
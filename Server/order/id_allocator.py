@@ -0,0 +1,62 @@
+"""
+Atomic ID allocation backed by a MongoDB counters collection.
+
+Each counter is one document {_id: <name>, seq: <last issued id>} bumped
+with find_one_and_update/$inc, so concurrent Gunicorn workers never hand
+out the same ID and an insert no longer scans the whole collection.
+With block_size > 1 a worker reserves a block of IDs in one round trip
+and hands them out locally (IDs stay unique but may leave gaps).
+
+Maintained in Server/shared/: edit it there and run sync_shared.py to
+update the copy in each service.
+"""
+import threading
+
+from pymongo import ReturnDocument
+
+
+class IdAllocator:
+    """Hands out unique, increasing integer IDs for one counter"""
+
+    def __init__(self, counters_collection, name, block_size=1):
+        self.counters = counters_collection
+        self.name = name
+        self.block_size = max(1, int(block_size))
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def reserve(self, count):
+        """Atomically reserve `count` consecutive IDs and return the first one"""
+        counter = self.counters.find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"] - count + 1
+
+    def next_id(self):
+        """Next ID from this worker's pre-allocated block"""
+        with self._lock:
+            if self._next >= self._end:
+                first = self.reserve(self.block_size)
+                self._next, self._end = first, first + self.block_size
+            new_id = self._next
+            self._next += 1
+            return new_id
+
+    def seed(self, collection, field):
+        """Raise the counter to the collection's current max ID (idempotent)"""
+        latest = collection.find_one(
+            {field: {"$type": "number"}},
+            sort=[(field, -1)],
+            projection={field: 1}
+        )
+        current_max = int(latest[field]) if latest else 0
+        self.counters.update_one(
+            {"_id": self.name},
+            {"$max": {"seq": current_max}},
+            upsert=True
+        )
+        return current_max
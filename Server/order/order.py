@@ -2,23 +2,47 @@ import os
 from urllib.parse import quote_plus
 import certifi
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-from pymongo import MongoClient
+from flask import Flask, Response, request, jsonify, stream_with_context
+from pymongo import MongoClient, UpdateMany
 import json
+import logging
 import pika
 import ssl
 import threading
 import time
+from collections import deque
+from id_allocator import IdAllocator
+from indexes import IndexManager, start_index_reconciliation
+from metrics import Metrics
+from tracing import Tracer
+from logs import StructuredLogging
 
 load_dotenv()
 
 app = Flask(__name__)
 
+# JSON logs written by a background thread (LOG_LEVEL, LOG_DEBUG_SAMPLE_RATE);
+# event batches draw their own debug sample
+log_setup = StructuredLogging.from_env('order')
+log_setup.instrument(app)
+logger = logging.getLogger('order')
+
+# Request latency, Mongo command timings and RabbitMQ counters at /metrics
+metrics = Metrics('order')
+metrics.instrument(app)
+metrics.describe('order_event_batch_duration_seconds', 'histogram', "Time to apply one batch of user events")
+metrics.describe('order_event_batches_failed_total', 'counter', "User event batches nacked for redelivery")
+
+# Request and Mongo spans, plus queueing and batch spans for traced user events
+tracer = Tracer.from_env('order')
+tracer.instrument(app)
+
 # Order statuses: "under process", "shipping", "delivered"
 
 # MongoDB Connection ------------------------------
 
 orders_collection = None
+order_ids = None
 
 try:
     username = quote_plus(os.getenv('MONGODB_USER', ''))
@@ -31,18 +55,51 @@ try:
             mongo_uri,
             tlsCAFile=certifi.where(),
             serverSelectionTimeoutMS=5000,
-            connectTimeoutMS=10000
+            connectTimeoutMS=10000,
+            event_listeners=[metrics.mongo_listener(), tracer.mongo_listener()]
         )
 
         client.admin.command('ping')
 
         db = client[os.getenv('MONGODB_ORDER_DB', 'order_database')]
         orders_collection = db['orders']
-        print("✓ Connected to MongoDB - Order Database")
+        logger.info("Connected to MongoDB - Order Database")
+
+        # Atomic order_id allocation (seeded from the current max on startup)
+        order_ids = IdAllocator(db['counters'], 'order_id', os.getenv('ID_BLOCK_SIZE', 1))
+        order_ids.seed(orders_collection, 'order_id')
     else:
-        print("✗ MongoDB credentials not set")
+        logger.error("MongoDB credentials not set")
 except Exception as e:
-    print(f"✗ MongoDB Connection Error: {e}")
+    logger.error("MongoDB Connection Error: %s", e)
+
+# Indexes ------------------------------
+
+# order_id lookups and paging, per-user lookups and contact syncs, and status
+# lists (paged by order_id) each get an index; order_id is unique so an ID
+# allocation race fails loudly instead of creating a duplicate order
+index_managers = []
+
+if orders_collection is not None:
+    index_managers = [
+        IndexManager(
+            orders_collection,
+            indexes=[
+                {"keys": [("order_id", 1)], "unique": True},
+                {"keys": [("user_id", 1)]},
+                {"keys": [("status", 1), ("order_id", 1)]}
+            ],
+            queries={
+                "get_order_by_id": {"filter": ["order_id"]},
+                "list_orders_paged": {"sort": ["order_id"]},
+                "seed_id_counter": {"sort": ["order_id"]},
+                "orders_of_user": {"filter": ["user_id"]},
+                "sync_user_contacts": {"filter": ["user_id"]},
+                "orders_by_status": {"filter": ["status"], "sort": ["order_id"]}
+            }
+        )
+    ]
+    start_index_reconciliation(index_managers)
 
 # RabbitMQ Connection ------------------------------
 
@@ -51,7 +108,7 @@ def get_rabbitmq_connection():
     rabbitmq_url = os.getenv('RABBITMQ_URL')
     
     if not rabbitmq_url:
-        print("✗ RABBITMQ_URL not set")
+        logger.error("RABBITMQ_URL not set")
         return None
     
     try:
@@ -60,13 +117,32 @@ def get_rabbitmq_connection():
         params.connection_attempts = 3
         
         connection = pika.BlockingConnection(params)
-        print("✓ Connected to RabbitMQ (CloudAMQP)")
+        logger.info("Connected to RabbitMQ (CloudAMQP)")
         return connection
     except Exception as e:
-        print(f"✗ RabbitMQ Connection Error: {e}")
+        logger.error("RabbitMQ Connection Error: %s", e)
         return None
 
 
+# Consumer tuning: prefetch bounds unacked deliveries, events are applied in
+# batches of up to CONSUMER_BATCH_SIZE or after CONSUMER_BATCH_WAIT seconds
+CONSUMER_PREFETCH = int(os.getenv('ORDER_CONSUMER_PREFETCH', 200))
+CONSUMER_BATCH_SIZE = int(os.getenv('ORDER_CONSUMER_BATCH_SIZE', 100))
+CONSUMER_BATCH_WAIT = float(os.getenv('ORDER_CONSUMER_BATCH_WAIT', 0.2))
+
+consumer_stats = {
+    "started_at": time.time(),
+    "messages": 0,
+    "batches": 0,
+    "coalesced": 0,
+    "orders_modified": 0,
+    "failed_batches": 0,
+    "last_batch_size": 0,
+    "last_batch_ms": 0.0
+}
+recent_messages = deque()  # (timestamp, messages) for the rolling rate
+
+
 def start_event_subscriber():
     """Start RabbitMQ event subscriber in a separate thread to handle user events"""
 
@@ -75,11 +151,11 @@ def start_event_subscriber():
             try:
                 rabbitmq_url = os.getenv('RABBITMQ_URL')
                 if not rabbitmq_url:
-                    print("✗ RABBITMQ_URL not set, cannot start subscriber")
+                    logger.error("RABBITMQ_URL not set, cannot start subscriber")
                     time.sleep(10)
                     continue
 
-                print("🔄 Order service connecting to RabbitMQ...")
+                logger.info("Order service connecting to RabbitMQ...")
 
                 params = pika.URLParameters(rabbitmq_url)
                 params.socket_timeout = 10
@@ -103,79 +179,150 @@ def start_event_subscriber():
                 channel.queue_bind(exchange='user_events', queue=queue_name, routing_key='user.address_updated')
                 channel.queue_bind(exchange='user_events', queue=queue_name, routing_key='user.created')
 
-                print("✓ Order service subscribed to user events")
-
-                def callback(ch, method, properties, body):
-                    try:
-                        event_data = json.loads(body.decode())
-                        routing_key = method.routing_key
-                        print(f" [x] Received event {routing_key}: {event_data}")
-                        
-                        event_type = event_data.get("event_type")
-                        data = event_data.get("data", {})
-                        
-                        if event_type == "email_updated":
-                            user_id = data.get("user_account_id")
-                            new_email = data.get("new_email")
-                            if user_id and new_email:
-                                count = sync_user_email(user_id, new_email)
-                                print(f"✓ Synchronized email for user {user_id} to {new_email} ({count} orders updated)")
-                        
-                        elif event_type == "address_updated":
-                            user_id = data.get("user_account_id")
-                            new_address = data.get("new_address")
-                            if user_id and new_address:
-                                count = sync_user_address(user_id, new_address)
-                                print(f"✓ Synchronized address for user {user_id} to {new_address} ({count} orders updated)")
-                        
-                        elif event_type == "created":
-                            print(f"✓ New user created: {data}")
-                        
-                        ch.basic_ack(delivery_tag=method.delivery_tag)
-                        
-                    except Exception as e:
-                        print(f"Error processing event: {e}")
-                        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
-                channel.basic_consume(queue=queue_name, on_message_callback=callback)
-
-                print("✓ Order service waiting for user events...")
-                channel.start_consuming()
+                channel.basic_qos(prefetch_count=CONSUMER_PREFETCH)
+
+                logger.info("Order service subscribed to user events (prefetch %d, batch %d)",
+                            CONSUMER_PREFETCH, CONSUMER_BATCH_SIZE)
+
+                pending = []
+                oldest = None
+                for method, properties, body in channel.consume(queue_name, inactivity_timeout=CONSUMER_BATCH_WAIT):
+                    if method is not None:
+                        if not pending:
+                            oldest = time.monotonic()
+                        pending.append((method.delivery_tag, body, properties.headers or {}, time.time()))
+                    if pending and (len(pending) >= CONSUMER_BATCH_SIZE
+                                    or time.monotonic() - oldest >= CONSUMER_BATCH_WAIT):
+                        process_event_batch(channel, pending)
+                        pending = []
 
             except Exception as e:
-                print(f"RabbitMQ subscriber error: {e}")
-                print("Retrying in 5 seconds...")
+                logger.error("RabbitMQ subscriber error: %s; retrying in 5 seconds", e)
                 time.sleep(5)
 
     thread = threading.Thread(target=subscriber, daemon=True)
     thread.start()
-    print("✓ Order service RabbitMQ subscriber thread started")
+    logger.info("Order service RabbitMQ subscriber thread started")
     return thread
 
 
+def process_event_batch(channel, deliveries):
+    """Apply a batch of user events with one bulk write, then ack it with multiple=True"""
+    log_setup.sample()
+    started = time.perf_counter()
+    batch_started_at = time.time()
+    last_tag = deliveries[-1][0]
+    events = []
+    for delivery_tag, body, _, _ in deliveries:
+        try:
+            event = json.loads(body.decode())
+        except ValueError as e:
+            # A malformed message would fail forever if requeued: drop it
+            logger.error("Error processing event (dropped): %s", e)
+            continue
+        if not isinstance(event, dict) or not isinstance(event.get("data", {}), dict):
+            logger.error("Error processing event (dropped): expected an object with object data")
+            continue
+        events.append(event)
+
+    try:
+        modified, coalesced = sync_user_contacts(events)
+    except Exception as e:
+        logger.exception("Error applying event batch")
+        consumer_stats["failed_batches"] += 1
+        metrics.inc('order_event_batches_failed_total')
+        channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+        return
+
+    channel.basic_ack(delivery_tag=last_tag, multiple=True)
+    metrics.inc('rabbitmq_consumed_total', len(deliveries), queue='order_service_queue')
+    metrics.observe('order_event_batch_duration_seconds', time.perf_counter() - started)
+    record_event_spans(deliveries, batch_started_at, modified)
+
+    now = time.time()
+    consumer_stats["messages"] += len(deliveries)
+    consumer_stats["batches"] += 1
+    consumer_stats["coalesced"] += coalesced
+    consumer_stats["orders_modified"] += modified
+    consumer_stats["last_batch_size"] = len(deliveries)
+    consumer_stats["last_batch_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    recent_messages.append((now, len(deliveries)))
+    while recent_messages and recent_messages[0][0] < now - 60:
+        recent_messages.popleft()
+    logger.debug("Applied %d user events", len(deliveries), extra={
+        "coalesced": coalesced, "orders_modified": modified, "batch_ms": consumer_stats["last_batch_ms"]})
+
+
+def record_event_spans(deliveries, batch_started_at, modified):
+    """
+    For each traced event: time in the broker (publish to delivery), time
+    waiting for its batch to fill, and the batch's bulk write, as children
+    of the outbox relay span that published it
+    """
+    finished = time.time()
+    for delivery_tag, body, headers, received_at in deliveries:
+        parent = headers.get("traceparent")
+        if not parent:
+            continue
+        published_at = headers.get("published_at")
+        if published_at is not None:
+            tracer.record("rabbitmq queue order_service_queue", parent, published_at, received_at, kind='consumer')
+        tracer.record("order batch wait", parent, received_at, batch_started_at)
+        tracer.record("order apply user events", parent, batch_started_at, finished,
+                      batch_size=len(deliveries), orders_modified=modified)
+
+
 # Synchronization helper functions --------------------------------
 
-def sync_user_email(user_id, new_email):
-    """Synchronize user email across all their orders"""
-    if orders_collection is not None:
-        result = orders_collection.update_many(
-            {"user_id": str(user_id)},
-            {"$set": {"user_email": new_email}}
-        )
-        print(f"Updated {result.modified_count} orders with new email for user {user_id}")
-        return result.modified_count
-    return 0
-
-def sync_user_address(user_id, new_address):
-    """Synchronize user address across all their orders"""
-    if orders_collection is not None:
-        result = orders_collection.update_many(
-            {"user_id": str(user_id)},
-            {"$set": {"user_address": new_address}}
-        )
-        print(f"Updated {result.modified_count} orders with new address for user {user_id}")
-        return result.modified_count
-    return 0
+# event_type -> (order field, event data key holding its new value)
+CONTACT_FIELDS = {
+    "email_updated": ("user_email", "new_email"),
+    "address_updated": ("user_address", "new_address")
+}
+
+
+def sync_user_contacts(events):
+    """
+    Coalesce email/address updates per user and apply them with one
+    unordered bulk_write. Events carry the user's contact_version: the
+    highest version per field wins, and orders already holding a newer
+    version are left alone, so an event re-published late by the outbox
+    relay cannot overwrite a newer update. Events without a version
+    (older publishers) are applied in arrival order.
+    Returns (orders modified, updates coalesced away).
+    """
+    latest = {}
+    updates = 0
+    for event in events:
+        event_type = event.get("event_type")
+        data = event.get("data", {})
+        user_id = data.get("user_account_id")
+        field, value = CONTACT_FIELDS.get(event_type, (None, None))
+        if field is None or not user_id or not data.get(value):
+            continue
+        updates += 1
+        version = data.get("version")
+        fields = latest.setdefault(str(user_id), {})
+        current = fields.get(field)
+        if current is None or version is None or current[1] is None or version > current[1]:
+            fields[field] = (data.get(value), version)
+
+    coalesced = updates - sum(len(fields) for fields in latest.values())
+    if not latest or orders_collection is None:
+        return 0, coalesced
+
+    operations = []
+    for user_id, fields in latest.items():
+        for field, (value, version) in fields.items():
+            if version is None:
+                operations.append(UpdateMany({"user_id": user_id}, {"$set": {field: value}}))
+            else:
+                operations.append(UpdateMany(
+                    {"user_id": user_id, f"{field}_version": {"$not": {"$gte": version}}},
+                    {"$set": {field: value, f"{field}_version": version}}
+                ))
+    result = orders_collection.bulk_write(operations, ordered=False)
+    return result.modified_count, coalesced
 
 
 # Endpoints ----------------------------------
@@ -184,10 +331,32 @@ def sync_user_address(user_id, new_address):
 def greetings():
     return 'Order Service is running!'
 
+@app.route('/subscriber/stats', methods=['GET'])
+def subscriber_stats():
+    """User event consumer throughput"""
+    now = time.time()
+    uptime = now - consumer_stats["started_at"]
+    window = sum(count for timestamp, count in recent_messages if timestamp >= now - 60)
+    return jsonify(dict(
+        consumer_stats,
+        prefetch=CONSUMER_PREFETCH,
+        batch_size=CONSUMER_BATCH_SIZE,
+        messages_per_sec=round(window / min(60, uptime), 2) if uptime else 0.0,
+        messages_per_sec_overall=round(consumer_stats["messages"] / uptime, 2) if uptime else 0.0
+    ))
+
+@app.route('/indexes', methods=['GET'])
+def index_report():
+    if orders_collection is None:
+        return jsonify({"status": "Database not connected"}), 503
+    return jsonify({manager.collection.name: manager.report() for manager in index_managers})
+
 @app.route('/orders', methods=['GET'])
 def list_orders():
     if orders_collection is None:
         return jsonify({"status": "Database not connected"}), 503
+    if is_paged_request():
+        return paged_list(orders_collection, {}, "order_id")
     orders = get_all_orders()
     if not orders:
         return jsonify({"status": "No orders found"})
@@ -200,6 +369,8 @@ def list_orders():
 def list_orders_by_status(status):
     if orders_collection is None:
         return jsonify({"status": "Database not connected"}), 503
+    if is_paged_request():
+        return paged_list(orders_collection, {"status": status}, "order_id")
     orders = get_orders_by_status(status)
     if not orders:
         return jsonify({"status": f"No orders found with status: {status}"})
@@ -320,11 +491,7 @@ def get_number_of_orders():
     return len(count)
 
 def find_new_order_id():
-    orders = get_all_orders()
-    if not orders:
-        return 1
-    max_id = max(order.get("order_id", 0) for order in orders)
-    return max_id + 1
+    return order_ids.next_id()
 
 def orderCreation(user_id, items, email, address):
     results = orders_collection.insert_one({
@@ -372,6 +539,61 @@ def userContactUpdate(user_id, email, address):
         return True
     return False
 
+# Paginated / streaming list helpers --------------------------------
+
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+
+def is_paged_request():
+    """True when a list endpoint was called with limit/after/fields/format"""
+    return any(arg in request.args for arg in ('limit', 'after', 'fields', 'format'))
+
+def paged_list(collection, query, id_field):
+    """
+    Serve a list endpoint with cursor pagination and projection:
+    - limit: page size (default DEFAULT_PAGE_SIZE, capped at MAX_PAGE_SIZE)
+    - after: only documents with id_field greater than this value
+    - fields: comma-separated projection (id_field is always included)
+    - format=ndjson: stream one JSON document per line straight from the
+      Mongo cursor (no limit unless one is given)
+    """
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    fields = request.args.get('fields')
+    stream = request.args.get('format') == 'ndjson'
+
+    if after is not None:
+        query = dict(query, **{id_field: {"$gt": after}})
+    projection = None
+    if fields:
+        projection = {field.strip(): 1 for field in fields.split(',') if field.strip()}
+        projection[id_field] = 1
+        projection.setdefault("_id", 0)
+    if limit is None and not stream:
+        limit = DEFAULT_PAGE_SIZE
+    if limit is not None:
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+    cursor = collection.find(query, projection).sort(id_field, 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    if stream:
+        def generate():
+            for document in cursor:
+                if "_id" in document:
+                    document["_id"] = str(document["_id"])
+                yield json.dumps(document) + "\n"
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    documents = []
+    for document in cursor:
+        if "_id" in document:
+            document["_id"] = str(document["_id"])
+        documents.append(document)
+    next_after = documents[-1][id_field] if len(documents) == limit else None
+    return jsonify({"status": documents, "count": len(documents), "next_after": next_after})
+
 
 # ============================================================
 # START RABBITMQ SUBSCRIBER AT MODULE LOAD
@@ -0,0 +1,167 @@
+"""
+Structured logging shared by the gateway and services.
+
+Log calls never write to stdout on the calling thread: the root logger's
+only handler puts records on an in-memory queue, and a QueueListener
+thread formats them (one JSON object per line, or a %-style format when
+structured output is off) and writes them out. Each record carries the
+service name and, inside a traced request, its trace and span IDs.
+
+Debug logs are sampled per unit of work: instrument(app) draws once per
+request (a consumer calls sample() per message or batch), and only the
+sampled requests emit their debug records, at debug_sample_rate. With
+the rate at 0 debug calls are discarded by the level check alone.
+
+Maintained in Server/shared/: edit it there and run sync_shared.py to
+update the copy in each service.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+from tracing import Tracer
+
+DEFAULT_FORMAT = "[%(asctime)s] %(levelname)s: %(message)s"
+
+# Client libraries whose INFO/DEBUG output would swamp sampled requests
+QUIET_LOGGERS = ('pika', 'urllib3', 'httpx', 'httpcore')
+
+_sampled = contextvars.ContextVar('debug_sampled', default=False)
+
+# LogRecord attributes that are not caller-supplied `extra` fields
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+def parse_level(level):
+    """Logging level number from a name (INFO) or number; ValueError if unknown"""
+    if isinstance(level, int) and not isinstance(level, bool):
+        return level
+    number = logging.getLevelName(str(level).upper())
+    if not isinstance(number, int):
+        raise ValueError(f"unknown log level {level!r}")
+    return number
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, service, logger, message, extras"""
+
+    converter = time.gmtime
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "time": f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """Drops unsampled records below the configured level and tags records with the trace"""
+
+    def __init__(self, level):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            if not _sampled.get():
+                return False
+            record.sampled = True
+        span = Tracer.current()
+        if span is not None:
+            record.trace_id = span.context.trace_id
+            record.span_id = span.context.span_id
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Renders message and traceback on the caller's thread, formats on the listener's"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class StructuredLogging:
+    """Queue-backed root logging for one service process"""
+
+    def __init__(self, service, level='INFO', structured=True, format=DEFAULT_FORMAT, debug_sample_rate=0.0):
+        self.service = service
+        self._queue = queue.SimpleQueue()
+        self._filter = _ContextFilter(logging.INFO)
+        self._handler = _QueueHandler(self._queue)
+        self._handler.addFilter(self._filter)
+        self._output = logging.StreamHandler(sys.stdout)
+        self._listener = logging.handlers.QueueListener(self._queue, self._output)
+        self.configure(level, structured, format, debug_sample_rate)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self._handler)
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+        self._listener.start()
+        atexit.register(self._listener.stop)
+
+    @classmethod
+    def from_env(cls, service):
+        """Settings from LOG_LEVEL, LOG_STRUCTURED and LOG_DEBUG_SAMPLE_RATE"""
+        return cls(
+            service,
+            level=os.getenv('LOG_LEVEL', 'INFO'),
+            structured=os.getenv('LOG_STRUCTURED', 'true').lower() in ('1', 'true', 'yes'),
+            debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.0))
+        )
+
+    def configure(self, level='INFO', structured=True, format=DEFAULT_FORMAT, debug_sample_rate=0.0):
+        """Apply new settings (also on a running process)"""
+        self.level = parse_level(level)
+        self.structured = bool(structured)
+        self.debug_sample_rate = float(debug_sample_rate)
+        self._filter.level = self.level
+        self._output.setFormatter(JsonFormatter(self.service) if self.structured
+                                  else logging.Formatter(format or DEFAULT_FORMAT))
+        # Debug records only need to be created when some of them will be kept
+        root_level = min(self.level, logging.DEBUG) if self.debug_sample_rate > 0 else self.level
+        logging.getLogger().setLevel(root_level)
+
+    def sample(self):
+        """Decide whether the current request/message emits debug logs"""
+        sampled = self.debug_sample_rate > 0 and random.random() < self.debug_sample_rate
+        _sampled.set(sampled)
+        return sampled
+
+    def instrument(self, app):
+        """Draw the debug sample once per Flask request"""
+
+        @app.before_request
+        def sample_request():
+            self.sample()
+
+        return app
@@ -0,0 +1,147 @@
+"""
+Transactional outbox for user events.
+
+Request handlers insert each event into the `outbox` collection inside
+the same Mongo transaction as the user write, so an event exists if and
+only if its write committed, and the request never waits on AMQP. A
+background relay thread drains the outbox to RabbitMQ in batches and
+deletes what the broker confirmed. Delivery is at-least-once: a relay
+that dies between publishing and deleting leaves the batch to be
+published again once its lease expires, so consumers must tolerate
+duplicates.
+
+Maintained in Server/shared/: edit it there and run sync_shared.py to
+update the copy in each service.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Writes events to the outbox collection and relays them to RabbitMQ"""
+
+    def __init__(self, collection, publisher, batch_size=100, poll_interval=1.0, lease_seconds=30, tracer=None):
+        self.collection = collection
+        self.publisher = publisher
+        self.tracer = tracer
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.stats = {"enqueued": 0, "relayed": 0, "batches": 0, "errors": 0}
+
+    def add(self, events, session=None):
+        """Insert (routing_key, body) events; pass the write's session to commit them together"""
+        documents = [{
+            "routing_key": routing_key,
+            "body": body,
+            "created_at": datetime.utcnow(),
+            "lease_until": None
+        } for routing_key, body in events]
+        traceparent = self.tracer.traceparent() if self.tracer is not None else None
+        if traceparent:
+            # The relay continues the request's trace when it publishes
+            for document in documents:
+                document["trace"] = {"traceparent": traceparent, "enqueued_at": time.time()}
+        if documents:
+            self.collection.insert_many(documents, session=session)
+            self.stats["enqueued"] += len(documents)
+        return len(documents)
+
+    def notify(self):
+        """Wake the relay after a commit instead of waiting for the next poll"""
+        self._wakeup.set()
+
+    def _claim_batch(self):
+        """Lease up to batch_size unclaimed (or expired) events to this relay"""
+        now = datetime.utcnow()
+        available = {"$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]}
+        candidates = [doc["_id"] for doc in self.collection.find(available, {"_id": 1})
+                      .sort("_id", 1).limit(self.batch_size)]
+        if not candidates:
+            return []
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        self.collection.update_many(
+            {"_id": {"$in": candidates}, **available},
+            {"$set": {"lease_until": lease_until, "lease_owner": self.owner}}
+        )
+        return list(self.collection.find(
+            {"_id": {"$in": candidates}, "lease_owner": self.owner, "lease_until": lease_until}
+        ).sort("_id", 1))
+
+    def drain_once(self):
+        """Publish one claimed batch and delete what reached the broker"""
+        batch = self._claim_batch()
+        if not batch:
+            return 0
+        published_at = time.time()
+        messages, spans = [], []
+        for doc in batch:
+            # published_at lets consumers measure lag from publish to consumption
+            headers = {"published_at": published_at}
+            span = None
+            trace = doc.get("trace")
+            if trace and self.tracer is not None:
+                # Outbox wait plus publish, as a child of the request that wrote the event
+                span = self.tracer.start_span(
+                    f"outbox relay {doc['routing_key']}", parent=trace["traceparent"], kind='producer',
+                    start=trace["enqueued_at"], routing_key=doc["routing_key"],
+                    outbox_wait_ms=round((published_at - trace["enqueued_at"]) * 1000, 3)
+                )
+                headers["traceparent"] = span.traceparent()
+            spans.append(span)
+            messages.append((doc["routing_key"], doc["body"], pika.BasicProperties(
+                delivery_mode=2,
+                content_type='application/json',
+                headers=headers
+            )))
+        sent = self.publisher.publish_batch(messages)
+        finished = time.time()
+        for index, span in enumerate(spans):
+            if span is not None:
+                span.end(finished, error=None if index < sent else "not published, retried in a later batch")
+        if sent:
+            self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in batch[:sent]]}})
+        if sent < len(batch):
+            # Hand the rest back so the next round (or another worker) retries it
+            self.collection.update_many(
+                {"_id": {"$in": [doc["_id"] for doc in batch[sent:]]}, "lease_owner": self.owner},
+                {"$set": {"lease_until": None}}
+            )
+        self.stats["relayed"] += sent
+        self.stats["batches"] += 1
+        return sent
+
+    def _relay(self):
+        while True:
+            try:
+                # Keep draining while full batches are coming back
+                while self.drain_once() == self.batch_size:
+                    pass
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error("Outbox relay error: %s", e)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Start the background relay thread (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._relay, name='outbox-relay', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def pending(self):
+        """Number of events not yet relayed"""
+        return self.collection.count_documents({})
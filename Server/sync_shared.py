@@ -0,0 +1,68 @@
+"""
+Keep the service copies of the shared modules identical.
+
+Modules more than one service uses (metrics, tracing and logs in every
+service; the outbox and event publisher in both user services; ID
+allocation and index management in the user and order services) are
+maintained once, in shared/. Each service image is built with its own directory as the
+Docker build context (azure_deploy.yml and the Azure auto-deploy
+workflows), so every service directory also holds a copy. Edit the
+module in shared/ and run this script to copy it out; --check (run in
+CI) fails when a copy differs from shared/.
+
+Usage:
+    python sync_shared.py            # copy shared/ modules into every service
+    python sync_shared.py --check    # exit 1 if any copy is out of date
+"""
+import filecmp
+import os
+import shutil
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SHARED_DIR = os.path.join(HERE, 'shared')
+
+SERVICES = ['api_gateway', 'user_V1', 'user_V2', 'order', 'event']
+USER_SERVICES = ['user_V1', 'user_V2']
+
+# module -> services that hold a copy
+SHARED_MODULES = {
+    'metrics.py': SERVICES,
+    'tracing.py': SERVICES,
+    'logs.py': SERVICES,
+    'outbox.py': USER_SERVICES,
+    'event_publisher.py': USER_SERVICES,
+    'id_allocator.py': USER_SERVICES + ['order'],
+    'indexes.py': USER_SERVICES + ['order'],
+}
+
+
+def stale_copies():
+    """(source, copy) pairs whose copy is missing or differs from shared/"""
+    stale = []
+    for module, services in SHARED_MODULES.items():
+        source = os.path.join(SHARED_DIR, module)
+        for service in services:
+            copy = os.path.join(HERE, service, module)
+            if not os.path.exists(copy) or not filecmp.cmp(source, copy, shallow=False):
+                stale.append((source, copy))
+    return stale
+
+
+def main():
+    stale = stale_copies()
+    if '--check' in sys.argv[1:]:
+        for _, copy in stale:
+            print(f"✗ {os.path.relpath(copy, HERE)} differs from shared/ (run python sync_shared.py)")
+        if not stale:
+            copies = sum(len(services) for services in SHARED_MODULES.values())
+            print(f"✓ {len(SHARED_MODULES)} shared modules identical in all {copies} service copies")
+        return 1 if stale else 0
+    for source, copy in stale:
+        shutil.copyfile(source, copy)
+        print(f"✓ Updated {os.path.relpath(copy, HERE)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
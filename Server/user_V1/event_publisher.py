@@ -0,0 +1,208 @@
+"""
+Long-lived RabbitMQ publisher for the user services.
+
+One connection and channel per process are reused for every publish and
+re-opened after failures. The exchange is declared once, and messages
+that cannot be sent right away wait in a bounded in-memory buffer (oldest
+dropped first) that is retried on the next publish and by a background
+keeper thread, which also services AMQP heartbeats while the publisher
+is idle. After a failed reconnect, publishes only buffer for
+retry_backoff seconds instead of blocking requests on connection
+attempts. pika's BlockingConnection is not thread-safe, so every channel
+operation happens under one lock.
+
+Batches (publish_batch) go out on a second channel of the same
+connection in AMQP transaction mode: every message is published without
+waiting, and one tx_commit round trip confirms the whole batch. A
+batch that fails before its commit is discarded by the broker, so
+retrying it does not duplicate any of its messages.
+
+Maintained in Server/shared/: edit it there and run sync_shared.py to
+update the copy in each service.
+"""
+import threading
+import time
+from collections import deque
+
+import pika
+
+
+class RabbitPublisher:
+    """Persistent, reconnecting publisher for one topic exchange"""
+
+    def __init__(self, connect, exchange='user_events', buffer_size=1000,
+                 confirm=True, keepalive_interval=5, retry_backoff=5):
+        # connect() -> open pika.BlockingConnection or None
+        self.connect = connect
+        self.exchange = exchange
+        self.confirm = confirm
+        self.keepalive_interval = keepalive_interval
+        self.retry_backoff = retry_backoff
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._channel = None
+        self._batch_channel = None
+        self._exchange_declared = False
+        self._buffer = deque(maxlen=max(1, int(buffer_size)))
+        self._keeper = None
+        self.stats = {
+            "published": 0,
+            "batches": 0,
+            "failed_attempts": 0,
+            "dropped": 0,
+            "connections_opened": 0
+        }
+
+    def _close_locked(self):
+        connection, self._connection, self._channel = self._connection, None, None
+        self._batch_channel = None
+        if connection is not None:
+            try:
+                if connection.is_open:
+                    connection.close()
+            except Exception:
+                pass
+
+    def _channel_locked(self):
+        if self._channel is not None and self._channel.is_open:
+            return self._channel
+        self._close_locked()
+        connection = self.connect()
+        if connection is None:
+            raise ConnectionError("RabbitMQ connection not established")
+        channel = connection.channel()
+        if not self._exchange_declared:
+            channel.exchange_declare(
+                exchange=self.exchange,
+                exchange_type='topic',
+                durable=True
+            )
+            self._exchange_declared = True
+        if self.confirm:
+            channel.confirm_delivery()
+        self._connection, self._channel = connection, channel
+        self.stats["connections_opened"] += 1
+        return channel
+
+    def _send_locked(self, routing_key, body, properties):
+        channel = self._channel_locked()
+        channel.basic_publish(
+            exchange=self.exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=properties
+        )
+
+    def _send_batch_locked(self, messages):
+        self._channel_locked()
+        channel = self._batch_channel
+        if channel is None or not channel.is_open:
+            channel = self._connection.channel()
+            channel.tx_select()
+            self._batch_channel = channel
+        for routing_key, body, properties in messages:
+            channel.basic_publish(
+                exchange=self.exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=properties
+            )
+        channel.tx_commit()
+
+    def _send_with_retry_locked(self, message):
+        """Send one message, reconnecting once if the cached channel is stale"""
+        if self._connection is None and time.monotonic() < self._retry_at:
+            # Broker was unreachable moments ago: fail fast instead of blocking the caller
+            return False
+        try:
+            self._send_locked(*message)
+        except Exception:
+            self.stats["failed_attempts"] += 1
+            self._close_locked()
+            try:
+                self._send_locked(*message)
+            except Exception:
+                self.stats["failed_attempts"] += 1
+                self._close_locked()
+                self._retry_at = time.monotonic() + self.retry_backoff
+                return False
+        self.stats["published"] += 1
+        return True
+
+    def _flush_locked(self):
+        """Send buffered messages in order; stop at the first failure"""
+        while self._buffer:
+            if not self._send_with_retry_locked(self._buffer[0]):
+                return False
+            self._buffer.popleft()
+        return True
+
+    def publish(self, routing_key, body, properties=None):
+        """Queue one message and flush; True once it has reached the broker"""
+        if properties is None:
+            properties = pika.BasicProperties(delivery_mode=2, content_type='application/json')
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.stats["dropped"] += 1
+            self._buffer.append((routing_key, body, properties))
+            sent = self._flush_locked()
+        self.start()
+        return sent
+
+    def publish_batch(self, messages):
+        """
+        Send (routing_key, body, properties) messages in order, in one
+        transaction, without buffering them; returns how many the broker
+        committed (all or none). Used by callers that keep their own
+        durable copy (the outbox relay).
+        """
+        messages = list(messages)
+        with self._lock:
+            if not messages or not self._flush_locked():
+                return 0
+            for attempt in range(2):
+                if self._connection is None and time.monotonic() < self._retry_at:
+                    return 0
+                try:
+                    self._send_batch_locked(messages)
+                    break
+                except Exception:
+                    # Uncommitted: the broker dropped the whole batch, so it can be resent
+                    self.stats["failed_attempts"] += 1
+                    self._close_locked()
+                    if attempt:
+                        self._retry_at = time.monotonic() + self.retry_backoff
+                        return 0
+            self.stats["published"] += len(messages)
+            self.stats["batches"] += 1
+        self.start()
+        return len(messages)
+
+    def buffered(self):
+        """Number of messages waiting for the broker"""
+        return len(self._buffer)
+
+    def _keep_alive(self):
+        while True:
+            time.sleep(self.keepalive_interval)
+            with self._lock:
+                try:
+                    if self._connection is not None and self._connection.is_open:
+                        self._connection.process_data_events(time_limit=0)
+                except Exception:
+                    self._close_locked()
+                if self._buffer:
+                    self._flush_locked()
+
+    def start(self):
+        """Start the heartbeat/retry thread (idempotent)"""
+        if self._keeper is None or not self._keeper.is_alive():
+            self._keeper = threading.Thread(target=self._keep_alive, name='rabbitmq-publisher', daemon=True)
+            self._keeper.start()
+
+    def close(self):
+        """Flush what can be sent and close the connection"""
+        with self._lock:
+            self._flush_locked()
+            self._close_locked()
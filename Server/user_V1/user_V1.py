@@ -1,20 +1,46 @@
 from urllib.parse import quote_plus
-from flask import Flask, json, request, jsonify
-from pymongo import MongoClient
+from flask import Flask, Response, json, request, jsonify, stream_with_context
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import OperationFailure
 import certifi
 import os
+import logging
 from dotenv import load_dotenv
 import pika
 import ssl
 import time
+from id_allocator import IdAllocator
+from event_publisher import RabbitPublisher
+from outbox import Outbox
+from indexes import IndexManager, start_index_reconciliation
+from metrics import Metrics
+from tracing import Tracer
+from logs import StructuredLogging
 
 load_dotenv()
 
 app = Flask(__name__)
 
+# JSON logs written by a background thread (LOG_LEVEL, LOG_DEBUG_SAMPLE_RATE)
+log_setup = StructuredLogging.from_env('user_v1')
+log_setup.instrument(app)
+logger = logging.getLogger('user_v1')
+
+# Request latency, Mongo command timings and RabbitMQ counters at /metrics
+metrics = Metrics('user_v1')
+metrics.instrument(app)
+metrics.describe('rabbitmq_publish_buffered', 'gauge', "Messages waiting in the publisher's retry buffer")
+metrics.describe('outbox_enqueued_total', 'counter', "Events written to the outbox")
+metrics.describe('outbox_relayed_total', 'counter', "Outbox events relayed to RabbitMQ")
+
+# Request, Mongo and outbox relay spans, continuing the gateway's trace
+tracer = Tracer.from_env('user_v1')
+tracer.instrument(app)
+
 # MongoDB Connection ------------------------------
 
 users_collection = None
+user_ids = None
 
 # Connect at module level
 try:
@@ -28,18 +54,23 @@ try:
             mongo_uri,
             tlsCAFile=certifi.where(),
             serverSelectionTimeoutMS=5000,
-            connectTimeoutMS=10000
+            connectTimeoutMS=10000,
+            event_listeners=[metrics.mongo_listener(), tracer.mongo_listener()]
         )
         
         client.admin.command('ping')
         
         db = client[os.getenv('MONGODB_USER_DB', 'user_database')]
         users_collection = db['users']
-        print("✓ Connected to MongoDB - User Database (V1)")
+        logger.info("Connected to MongoDB - User Database (V1)")
+
+        # Atomic user_account_id allocation (seeded from the current max on startup)
+        user_ids = IdAllocator(db['counters'], 'user_account_id', os.getenv('ID_BLOCK_SIZE', 1))
+        user_ids.seed(users_collection, 'user_account_id')
     else:
-        print("✗ MongoDB credentials not set")
+        logger.error("MongoDB credentials not set")
 except Exception as e:
-    print(f"✗ MongoDB Connection Error: {e}")
+    logger.error("MongoDB Connection Error: %s", e)
 
 # RabbitMQ Connection ------------------------------
 
@@ -48,7 +79,7 @@ def get_rabbitmq_connection():
     rabbitmq_url = os.getenv('RABBITMQ_URL')
     
     if not rabbitmq_url:
-        print("✗ RABBITMQ_URL not set")
+        logger.error("RABBITMQ_URL not set")
         return None
     
     try:
@@ -58,10 +89,10 @@ def get_rabbitmq_connection():
         params.connection_attempts = 3
         
         connection = pika.BlockingConnection(params)
-        print("✓ Connected to RabbitMQ (CloudAMQP)")
+        logger.info("Connected to RabbitMQ (CloudAMQP)")
         return connection
     except Exception as e:
-        print(f"✗ RabbitMQ Connection Error: {e}")
+        logger.error("RabbitMQ Connection Error: %s", e)
         return None
 
 
@@ -71,58 +102,117 @@ def wait_for_rabbitmq(max_retries=5, delay=3):
         try:
             connection = get_rabbitmq_connection()
             if connection and connection.is_open:
-                print("✓ RabbitMQ is ready")
+                logger.info("RabbitMQ is ready")
                 connection.close()
                 return True
         except Exception as e:
-            print(f"Attempt {attempt + 1}/{max_retries}: RabbitMQ not ready - {e}")
+            logger.warning("Attempt %d/%d: RabbitMQ not ready - %s", attempt + 1, max_retries, e)
         
         if attempt < max_retries - 1:
-            print(f"Retrying in {delay} seconds...")
+            logger.info("Retrying in %s seconds...", delay)
             time.sleep(delay)
     
-    print("✗ RabbitMQ not available, continuing without it")
+    logger.error("RabbitMQ not available, continuing without it")
     return False
 
 
-def rabbitmq_publisher(event_type, data):
-    """Publish events to RabbitMQ for synchronization"""
-    try:
-        connection = get_rabbitmq_connection()
-        if connection is None:
-            print("RabbitMQ connection not established. Skipping publish.")
-            return False
-            
-        channel = connection.channel()
-
-        channel.exchange_declare(
-            exchange='user_events', 
-            exchange_type='topic', 
-            durable=True
+# One persistent publisher per worker process (created on first publish)
+publisher = None
+
+def get_publisher():
+    """Return this process's long-lived RabbitMQ publisher"""
+    global publisher
+    if publisher is None:
+        publisher = RabbitPublisher(
+            get_rabbitmq_connection,
+            exchange='user_events',
+            buffer_size=int(os.getenv('RABBITMQ_BUFFER_SIZE', 1000))
         )
+    return publisher
 
-        event = {
-            "event_type": event_type,
-            "data": data,
-            "source": "user_v1"
-        }
 
-        channel.basic_publish(
-            exchange='user_events',
-            routing_key=f"user.{event_type}",
-            body=json.dumps(event),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  
-                content_type='application/json'
-            )
+# Transactional outbox ------------------------------
+
+# User events are written to the outbox together with the user write and
+# relayed to RabbitMQ by a background thread, off the request path
+outbox = None
+transactions_supported = True
+
+if users_collection is not None:
+    outbox = Outbox(
+        db['outbox'],
+        get_publisher(),
+        batch_size=int(os.getenv('OUTBOX_BATCH_SIZE', 100)),
+        poll_interval=float(os.getenv('OUTBOX_POLL_INTERVAL', 1.0)),
+        tracer=tracer
+    )
+    outbox.start()
+
+
+def rabbitmq_metrics():
+    """Publisher and outbox counters (kept by the components, read on scrape)"""
+    if publisher is not None:
+        yield 'rabbitmq_published_total', {'exchange': 'user_events'}, publisher.stats['published']
+        yield 'rabbitmq_publish_failures_total', {'exchange': 'user_events'}, publisher.stats['failed_attempts']
+        yield 'rabbitmq_publish_buffered', {'exchange': 'user_events'}, publisher.buffered()
+    if outbox is not None:
+        yield 'outbox_enqueued_total', {}, outbox.stats['enqueued']
+        yield 'outbox_relayed_total', {}, outbox.stats['relayed']
+
+
+metrics.add_collector(rabbitmq_metrics)
+
+
+# Indexes ------------------------------
+
+# Every hot query filters or pages on user_account_id; the unique index also
+# turns an ID allocation race into a DuplicateKeyError instead of a duplicate user
+index_managers = []
+
+if users_collection is not None:
+    index_managers = [
+        IndexManager(
+            users_collection,
+            indexes=[{"keys": [("user_account_id", 1)], "unique": True}],
+            queries={
+                "get_user_by_id": {"filter": ["user_account_id"]},
+                "list_users_paged": {"sort": ["user_account_id"]},
+                "seed_id_counter": {"sort": ["user_account_id"]}
+            }
+        ),
+        IndexManager(
+            db['outbox'],
+            indexes=[{"keys": [("lease_until", 1)]}],
+            queries={"claim_outbox_batch": {"filter": ["lease_until"]}}
         )
+    ]
+    start_index_reconciliation(index_managers)
 
-        connection.close()
-        print(f"✓ Published event to RabbitMQ: user.{event_type}")
-        return True
-    except Exception as e:
-        print(f"✗ RabbitMQ Publish Error: {e}")
-        return False
+
+def build_event(event_type, data):
+    """Routing key and JSON body of a user event"""
+    event = {
+        "event_type": event_type,
+        "data": data,
+        "source": "user_v1"
+    }
+    return f"user.{event_type}", json.dumps(event)
+
+
+def run_in_transaction(write):
+    """Run write(session) in a Mongo transaction so the user write and its outbox events commit together"""
+    global transactions_supported
+    if transactions_supported:
+        try:
+            with client.start_session() as session:
+                return session.with_transaction(write)
+        except OperationFailure as e:
+            # Standalone servers (local dev) reject transactions before anything is written
+            if e.code != 20:
+                raise
+            transactions_supported = False
+            logger.warning("MongoDB transactions unavailable, writing outbox events without a transaction")
+    return write(None)
 
 
 # Endpoints ----------------------------------
@@ -131,10 +221,18 @@ def rabbitmq_publisher(event_type, data):
 def entry():
     return "User V1 Service is running!"
 
+@app.route('/indexes', methods=['GET'])
+def index_report():
+    if users_collection is None:
+        return jsonify({"status": "Database not connected"}), 503
+    return jsonify({manager.collection.name: manager.report() for manager in index_managers})
+
 @app.route('/users', methods=['GET'])
 def list_users():
     if users_collection is None:
         return jsonify({"status": "Database not connected"}), 503
+    if is_paged_request():
+        return paged_list(users_collection, {}, "user_account_id")
     users = get_all_users()
     if not users:
         return jsonify({"status": "User V1 ZERO user found"})
@@ -163,13 +261,18 @@ def create_user():
     data = request.get_json()
     email = data.get("email")
     address = data.get("delivery_address")
-    result = userCreation(email, address)
     
-    rabbitmq_publisher("created", {
-        "user_account_id": result,
-        "email": email,
-        "delivery_address": address
-    })
+    def write(session):
+        new_id = userCreation(email, address, session=session)
+        outbox.add([build_event("created", {
+            "user_account_id": new_id,
+            "email": email,
+            "delivery_address": address
+        })], session=session)
+        return new_id
+    
+    run_in_transaction(write)
+    outbox.notify()
     
     return jsonify({"status": "User V1 created " + email})
 
@@ -185,14 +288,19 @@ def update_user_by_email(user_account_id):
     if user:
         old_email = user.get("email")
         address = user.get("delivery_address")
-        userUpdate(user["_id"], int(user_account_id), new_email, address)
         
-        rabbitmq_publisher("email_updated", {
-            "user_account_id": int(user_account_id),
-            "old_email": old_email,
-            "new_email": new_email,
-            "delivery_address": address
-        })
+        def write(session):
+            version = userUpdate(user["_id"], int(user_account_id), new_email, address, session=session)
+            outbox.add([build_event("email_updated", {
+                "user_account_id": int(user_account_id),
+                "old_email": old_email,
+                "new_email": new_email,
+                "delivery_address": address,
+                "version": version
+            })], session=session)
+        
+        run_in_transaction(write)
+        outbox.notify()
         
         user = users_collection.find_one({"user_account_id": int(user_account_id)})
         return jsonify({
@@ -214,14 +322,19 @@ def update_user_by_address(user_account_id):
     if user:
         email = user.get("email")
         old_address = user.get("delivery_address")
-        userUpdate(user["_id"], int(user_account_id), email, new_address)
         
-        rabbitmq_publisher("address_updated", {
-            "user_account_id": int(user_account_id),
-            "email": email,
-            "old_address": old_address,
-            "new_address": new_address
-        })
+        def write(session):
+            version = userUpdate(user["_id"], int(user_account_id), email, new_address, session=session)
+            outbox.add([build_event("address_updated", {
+                "user_account_id": int(user_account_id),
+                "email": email,
+                "old_address": old_address,
+                "new_address": new_address,
+                "version": version
+            })], session=session)
+        
+        run_in_transaction(write)
+        outbox.notify()
         
         return jsonify({"status": "User V1 updated with address " + new_address})
     else:
@@ -238,31 +351,90 @@ def get_number_of_users():
     return len(users)
 
 def find_new_user_id():
-    users = get_all_users()
-    if not users:
-        return 1
-    max_id = max(user.get("user_account_id", 0) for user in users)
-    return max_id + 1
+    return user_ids.next_id()
 
-def userCreation(email, address):
+def userCreation(email, address, session=None):
     new_id = find_new_user_id()
     users_collection.insert_one({
         "user_account_id": new_id,
         "email": email,
         "delivery_address": address
-    })
+    }, session=session)
     return new_id
 
-def userUpdate(object_id, user_account_id, email, address):
-    results = users_collection.update_one(
+def userUpdate(object_id, user_account_id, email, address, session=None):
+    """
+    Update a user's contact fields and return the user's new contact_version.
+    The version goes out with the update event, so consumers can ignore an
+    event that arrives after a newer one for the same user
+    """
+    user = users_collection.find_one_and_update(
         {"_id": object_id},
         {"$set": {
             "user_account_id": user_account_id,
             "email": email,
             "delivery_address": address
-        }}
+        }, "$inc": {"contact_version": 1}},
+        projection={"contact_version": 1},
+        return_document=ReturnDocument.AFTER,
+        session=session
     )
-    return results
+    return user["contact_version"] if user else None
+
+# Paginated / streaming list helpers --------------------------------
+
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+
+def is_paged_request():
+    """True when a list endpoint was called with limit/after/fields/format"""
+    return any(arg in request.args for arg in ('limit', 'after', 'fields', 'format'))
+
+def paged_list(collection, query, id_field):
+    """
+    Serve a list endpoint with cursor pagination and projection:
+    - limit: page size (default DEFAULT_PAGE_SIZE, capped at MAX_PAGE_SIZE)
+    - after: only documents with id_field greater than this value
+    - fields: comma-separated projection (id_field is always included)
+    - format=ndjson: stream one JSON document per line straight from the
+      Mongo cursor (no limit unless one is given)
+    """
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    fields = request.args.get('fields')
+    stream = request.args.get('format') == 'ndjson'
+
+    if after is not None:
+        query = dict(query, **{id_field: {"$gt": after}})
+    projection = None
+    if fields:
+        projection = {field.strip(): 1 for field in fields.split(',') if field.strip()}
+        projection[id_field] = 1
+        projection.setdefault("_id", 0)
+    if limit is None and not stream:
+        limit = DEFAULT_PAGE_SIZE
+    if limit is not None:
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+    cursor = collection.find(query, projection).sort(id_field, 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    if stream:
+        def generate():
+            for document in cursor:
+                if "_id" in document:
+                    document["_id"] = str(document["_id"])
+                yield json.dumps(document) + "\n"
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    documents = []
+    for document in cursor:
+        if "_id" in document:
+            document["_id"] = str(document["_id"])
+        documents.append(document)
+    next_after = documents[-1][id_field] if len(documents) == limit else None
+    return jsonify({"status": documents, "count": len(documents), "next_after": next_after})
 
 if __name__ == '__main__':
     print("=" * 50)
@@ -0,0 +1,100 @@
+"""
+Startup index reconciliation.
+
+Each service declares, per collection, the indexes its queries need and
+the shapes of its hot queries (equality filter fields plus sort/range
+field). On startup a background thread compares the declaration with
+index_information(), creates whatever is missing, and records failures
+(for example a unique index that existing duplicates prevent). report()
+lists every declared index and, for every hot query, the index that
+covers it or that none does.
+
+Maintained in Server/shared/: edit it there and run sync_shared.py to
+update the copy in each service.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class IndexManager:
+    """Declared indexes and hot queries for one collection"""
+
+    def __init__(self, collection, indexes, queries):
+        # indexes: [{"keys": [(field, 1), ...], "unique": bool}]
+        # queries: {name: {"filter": [fields], "sort": [fields]}}
+        self.collection = collection
+        self.indexes = indexes
+        self.queries = queries
+        self.state = {self.index_name(spec["keys"]): "pending" for spec in indexes}
+
+    @staticmethod
+    def index_name(keys):
+        return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+    def reconcile(self):
+        """Create every declared index that does not exist yet"""
+        existing = self.collection.index_information()
+        for spec in self.indexes:
+            name = self.index_name(spec["keys"])
+            if name in existing:
+                self.state[name] = "exists"
+                continue
+            try:
+                self.collection.create_index(
+                    spec["keys"],
+                    name=name,
+                    unique=spec.get("unique", False),
+                    background=True
+                )
+                self.state[name] = "created"
+                logger.info("Created index %s.%s", self.collection.name, name)
+            except Exception as e:
+                self.state[name] = f"failed: {str(e)[:200]}"
+                logger.error("Could not create index %s.%s: %s", self.collection.name, name, e)
+
+    def covering_index(self, query, existing):
+        """Name of an index whose key prefix serves the query's filter then sort fields"""
+        filter_fields = set(query.get("filter", []))
+        sort_fields = list(query.get("sort", []))
+        for name, info in existing.items():
+            fields = [field for field, _ in info["key"]]
+            if set(fields[:len(filter_fields)]) != filter_fields:
+                continue
+            if fields[len(filter_fields):len(filter_fields) + len(sort_fields)] != sort_fields:
+                continue
+            if filter_fields or sort_fields:
+                return name
+        return None
+
+    def report(self):
+        """Declared index states and index coverage of every hot query"""
+        try:
+            existing = self.collection.index_information()
+        except Exception as e:
+            return {"error": str(e)}
+        queries = {}
+        for name, query in self.queries.items():
+            index = self.covering_index(query, existing)
+            queries[name] = {"covered": index is not None, "index": index}
+        return {
+            "indexes": dict(self.state),
+            "queries": queries,
+            "uncovered": sorted(name for name, result in queries.items() if not result["covered"])
+        }
+
+
+def start_index_reconciliation(managers):
+    """Reconcile every collection's indexes in a background thread"""
+
+    def reconcile():
+        for manager in managers:
+            try:
+                manager.reconcile()
+            except Exception as e:
+                logger.error("Index reconciliation error on %s: %s", manager.collection.name, e)
+
+    thread = threading.Thread(target=reconcile, name='index-reconciliation', daemon=True)
+    thread.start()
+    return thread
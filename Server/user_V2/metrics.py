@@ -0,0 +1,247 @@
+"""
+Process-local service metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms are recorded into per-thread shards: a
+thread only ever writes its own dicts, so the hot path takes no lock and
+does one dict update (plus a bisect for histograms). GET /metrics merges
+every shard into one snapshot. When a thread exits, its shard is folded
+into a shared base shard, so counters never go backwards and servers
+that start a thread per request do not pile up shards. Values that other components already count
+(publisher and outbox stats, shared event counts) are read at scrape time
+through collectors instead of being counted twice.
+
+instrument(app) adds per-route request latency histograms, request
+counters by status and an in-flight gauge to a Flask app, plus the
+/metrics route. mongo_listener() returns a pymongo CommandListener that
+times every Mongo command; pass it to MongoClient(event_listeners=[...]).
+
+Each gunicorn worker keeps its own metrics; every sample carries the
+service and the worker pid, so a scraper can sum across workers.
+
+Maintained in Server/shared/: edit it there and run sync_shared.py to
+update the copy in each service.
+"""
+import bisect
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds (seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name -> (type, help) for the metrics every service records
+STANDARD_METRICS = {
+    'http_requests_total': ('counter', "HTTP requests handled, by route, method and status"),
+    'http_request_duration_seconds': ('histogram', "HTTP request latency, by route and method"),
+    'http_requests_in_flight': ('gauge', "HTTP requests currently being handled"),
+    'mongodb_command_duration_seconds': ('histogram', "MongoDB command latency, by command"),
+    'mongodb_command_failures_total': ('counter', "Failed MongoDB commands, by command"),
+    'rabbitmq_published_total': ('counter', "Messages that reached the RabbitMQ broker"),
+    'rabbitmq_publish_failures_total': ('counter', "Failed RabbitMQ publish attempts"),
+    'rabbitmq_consumed_total': ('counter', "Messages consumed from RabbitMQ, by queue"),
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _fold(target, shard):
+    """Add one (values, histograms) shard into another"""
+    values, histograms = target
+    shard_values, shard_histograms = shard
+    for key, value in shard_values.copy().items():
+        values[key] = values.get(key, 0) + value
+    for key, (buckets, total, count) in shard_histograms.copy().items():
+        merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+        merged[0] = [a + b for a, b in zip(merged[0], list(buckets))]
+        merged[1] += total
+        merged[2] += count
+
+
+class _ShardOwner:
+    """Lives in a thread's local storage; collected (with a finalizer) when the thread exits"""
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Lock-free-on-write metrics registry for one service process"""
+
+    def __init__(self, service):
+        self.service = service
+        self._base_labels = (('service', service), ('pid', str(os.getpid())))
+        self._local = threading.local()
+        self._shards = {}           # token -> shard of a live thread
+        self._retired = ({}, {})    # shards of exited threads, folded together
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._described = dict(STANDARD_METRICS)
+        self._collectors = []
+
+    def describe(self, name, kind, help_text):
+        """Declare the type ('counter', 'gauge', 'histogram') and help text of a metric"""
+        self._described[name] = (kind, help_text)
+
+    def add_collector(self, collect):
+        """collect() -> iterable of (name, {label: value}, value), read at scrape time"""
+        self._collectors.append(collect)
+
+    def _shard(self):
+        owner = getattr(self._local, 'owner', None)
+        if owner is None:
+            shard = ({}, {})   # (counters and gauges, histograms)
+            owner = self._local.owner = _ShardOwner(shard)
+            token = next(self._tokens)
+            with self._lock:
+                self._shards[token] = shard
+            weakref.finalize(owner, self._retire, token)
+        return owner.shard
+
+    def _retire(self, token):
+        """Fold the shard of an exited thread into the retired totals"""
+        with self._lock:
+            shard = self._shards.pop(token, None)
+            if shard is not None:
+                _fold(self._retired, shard)
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter (or to a gauge, with a negative value to go down)"""
+        values = self._shard()[0]
+        key = (name, tuple(sorted(labels.items())))
+        values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one histogram sample"""
+        histograms = self._shard()[1]
+        key = (name, tuple(sorted(labels.items())))
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def _merged(self):
+        values, histograms = {}, {}
+        with self._lock:
+            shards = list(self._shards.values())
+            _fold((values, histograms), self._retired)
+        for shard in shards:
+            _fold((values, histograms), shard)
+        for collect in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    key = (name, tuple(sorted(labels.items())))
+                    values[key] = values.get(key, 0) + value
+            except Exception as e:
+                logger.error("Metrics collector error: %s", e)
+        return values, histograms
+
+    def exposition(self):
+        """All metrics in the Prometheus text format (version 0.0.4)"""
+        values, histograms = self._merged()
+        families = {}
+        for (name, labels), value in values.items():
+            families.setdefault(name, []).append((labels, value))
+        for (name, labels), histogram in histograms.items():
+            families.setdefault(name, []).append((labels, histogram))
+
+        lines = []
+        for name in sorted(families):
+            kind, help_text = self._described.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(families[name], key=lambda sample: sample[0]):
+                labels = self._base_labels + labels
+                if kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                buckets, total, count = value
+                cumulative = 0
+                for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                    cumulative += bucket
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def instrument(self, app):
+        """Time every request of a Flask app and serve /metrics"""
+
+        @app.before_request
+        def start_timer():
+            g.metrics_started = time.perf_counter()
+            self.inc('http_requests_in_flight')
+
+        @app.after_request
+        def record_request(response):
+            started = g.pop('metrics_started', None)
+            if started is not None:
+                self._record_request(started, response.status_code)
+            return response
+
+        @app.teardown_request
+        def finish_request(exc):
+            started = g.pop('metrics_started', None)
+            if started is not None:
+                # An unhandled exception skipped after_request
+                self._record_request(started, 500)
+            self.inc('http_requests_in_flight', -1)
+
+        def metrics_view():
+            return Response(self.exposition(), mimetype='text/plain; version=0.0.4')
+
+        app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
+        return app
+
+    def _record_request(self, started, status):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        self.observe('http_request_duration_seconds', time.perf_counter() - started,
+                     route=route, method=request.method)
+        self.inc('http_requests_total', route=route, method=request.method, status=str(status))
+
+    def mongo_listener(self):
+        """pymongo command listener recording command latencies and failures"""
+        return MongoCommandMetrics(self)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times MongoDB commands into a Metrics registry"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.metrics.observe('mongodb_command_duration_seconds', event.duration_micros / 1e6,
+                             command=event.command_name)
+
+    def failed(self, event):
+        self.metrics.observe('mongodb_command_duration_seconds', event.duration_micros / 1e6,
+                             command=event.command_name)
+        self.metrics.inc('mongodb_command_failures_total', command=event.command_name)